@@ -1,20 +1,68 @@
-from flask import Flask, render_template, request, redirect, url_for, jsonify, flash
+from flask import Flask, render_template, request, redirect, url_for, jsonify, g, abort, has_request_context, get_template_attribute
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, insert, update, func, cast, text, tuple_, or_
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import selectinload, defer
 from flask_httpauth import HTTPBasicAuth
 from werkzeug.security import generate_password_hash, check_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 import random
 import json
-from datetime import datetime
-from flask import Response
+from datetime import datetime, timedelta
+from flask import Response, stream_with_context
+from markupsafe import escape
 from openai import OpenAI
 import os
+import hmac
+import hashlib
+import threading
+import time
+import re
+import bisect
+import math
+from collections import OrderedDict, Counter
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+import uuid
+import io
+import queue
 
 app = Flask(__name__)
-app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///mythic_gme.db'
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('MYTHIC_DATABASE_URI', 'sqlite:///mythic_gme.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SECRET_KEY'] = 'cle_secrete_mythic'
-
-db = SQLAlchemy(app)
+# Durée de vie (en secondes) des identifiants déjà vérifiés, 0 pour désactiver le cache
+app.config['AUTH_CACHE_TTL'] = 300
+app.config['AUTH_CACHE_SIZE'] = 256
+# En mode test, fait échouer une requête qui dépasse son budget de requêtes SQL (voir query_budget)
+app.config['QUERY_BUDGET_CHECK'] = False
+# Nombre maximum de jets dans un lancer groupé (/roll_batch)
+app.config['BATCH_ROLL_MAX'] = 1000
+# Nombre de tables personnelles gardées analysées en mémoire
+app.config['CUSTOM_TABLE_CACHE_SIZE'] = 128
+# Profil de stockage SQLite (voir SQLITE_PROFILES) et attente maximale sur un verrou, en ms
+app.config['SQLITE_PROFILE'] = os.environ.get('MYTHIC_SQLITE_PROFILE', 'wal')
+app.config['SQLITE_BUSY_TIMEOUT'] = 5000
+# Commit groupé des tables en ajout seul (historique des dés, questions du destin) :
+# les écritures arrivées pendant la fenêtre (en secondes) partagent une transaction
+app.config['GROUP_COMMIT'] = False
+app.config['GROUP_COMMIT_WINDOW'] = 0.005
+app.config['GROUP_COMMIT_MAX_BATCH'] = 256
+# Graine des jets (None : aléatoire à chaque démarrage). Avec une graine, chaque campagne
+# obtient une suite de jets reproductible, utile pour les tests de l'oracle.
+app.config['RNG_SEED'] = os.environ.get('MYTHIC_RNG_SEED')
+# Enregistre avec chaque jet de quoi le rejouer (voir replay_roll)
+app.config['ROLL_RECORD_SEED'] = True
+# Rétention : nombre de lignes gardées par campagne dans les tables en ajout seul (None :
+# sans limite) et nombre d'écritures entre deux compactages. Voir compact_campaign.
+# Désactivée par défaut : les lignes archivées restent comptées dans /roll_stats et
+# vérifiables par /audit_roll, mais sortent de la recherche et des historiques.
+app.config['DICE_HISTORY_KEEP'] = None
+app.config['FATE_HISTORY_KEEP'] = None
+app.config['RETENTION_EVERY'] = 100
+
+# Reliée à l'application par create_app : importer le module ne touche pas à la base
+db = SQLAlchemy()
 auth = HTTPBasicAuth()
 
 # Utilisateurs pour l'authentification
@@ -22,18 +70,95 @@ users = {
     "admin": generate_password_hash("motdepasse")
 }
 
+# Cache des identifiants déjà vérifiés.
+# check_password_hash est volontairement lent (pbkdf2/scrypt) et chaque petit fetch()
+# de la page repasse par l'authentification : on ne paye le hash qu'une fois par
+# couple identifiant/mot de passe, puis c'est une simple lecture de dictionnaire.
+# La clé est un HMAC des identifiants (on ne garde jamais le mot de passe en clair)
+# et chaque entrée retient le hash contre lequel elle a été validée : si `users`
+# change, l'entrée ne correspond plus et le mot de passe est revérifié.
+_auth_cache = OrderedDict()
+_auth_cache_lock = threading.Lock()
+
+def _credentials_digest(username, password):
+    message = f"{username}\x00{password}".encode("utf-8")
+    return hmac.new(app.config['SECRET_KEY'].encode("utf-8"), message, hashlib.sha256).digest()
+
+def clear_auth_cache():
+    with _auth_cache_lock:
+        _auth_cache.clear()
+
+def set_user_password(username, password):
+    users[username] = generate_password_hash(password)
+    clear_auth_cache()
+
+def check_credentials(username, password):
+    stored_hash = users.get(username)
+    if stored_hash is None:
+        return None
+
+    ttl = app.config['AUTH_CACHE_TTL']
+    if ttl > 0:
+        key = _credentials_digest(username, password)
+        now = time.monotonic()
+        with _auth_cache_lock:
+            cached = _auth_cache.get(key)
+            if cached and cached[0] == stored_hash and cached[1] > now:
+                _auth_cache.move_to_end(key)
+                return username
+
+    if not check_password_hash(stored_hash, password):
+        return None
+
+    if ttl > 0:
+        with _auth_cache_lock:
+            _auth_cache[key] = (stored_hash, now + ttl)
+            _auth_cache.move_to_end(key)
+            while len(_auth_cache) > app.config['AUTH_CACHE_SIZE']:
+                _auth_cache.popitem(last=False)
+    return username
+
 @auth.verify_password
 def verify_password(username, password):
-    if username in users and check_password_hash(users.get(username), password):
-        return username
+    # Le préfixe /c/<id> n'est validé (voir campaign_exists) qu'une fois l'utilisateur
+    # authentifié : une requête anonyme ne touche pas la base
+    username = check_credentials(username, password)
+    if username is not None and not campaign_exists(current_campaign_id()):
+        abort(404)
+    return username
+
+# Plusieurs campagnes dans la même base : chaque table porte un campaign_id et un index
+# composite (campaign_id, ...) pour que les requêtes d'une campagne ne parcourent
+# que ses propres lignes. La campagne est choisie par le préfixe d'URL /c/<id>/
+# (voir CampaignPrefixMiddleware) ; sans préfixe, c'est la campagne principale.
+DEFAULT_CAMPAIGN_ID = 1
+
+def current_campaign_id():
+    if has_request_context():
+        return g.get("campaign_id", DEFAULT_CAMPAIGN_ID)
+    return DEFAULT_CAMPAIGN_ID
+
+def campaign_column():
+    # Sans valeur explicite, une nouvelle ligne appartient à la campagne de la requête en cours
+    return db.Column(db.Integer, db.ForeignKey('campaign.id'), nullable=False,
+                     default=current_campaign_id, server_default=str(DEFAULT_CAMPAIGN_ID))
 
 # Modèles de base de données
+class Campaign(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(200), nullable=False)
+    created = db.Column(db.DateTime, default=datetime.utcnow)
+
 class GameState(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     chaos_factor = db.Column(db.Integer, default=5)
+    # Un seul état de jeu par campagne
+    __table_args__ = (db.Index("ix_game_state_campaign", "campaign_id", unique=True),)
 
 class FateQuestion(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     question = db.Column(db.String(500), nullable=False)
     odds = db.Column(db.String(50), nullable=False)
     answer = db.Column(db.String(50), nullable=False)
@@ -43,96 +168,685 @@ class FateQuestion(db.Model):
     exc_yes_threshold = db.Column(db.Integer, nullable=False)
     exc_no_threshold = db.Column(db.Integer, nullable=False)
     random_event = db.Column(db.Boolean, default=False)
+    seed = db.Column(db.String(40), nullable=True)  # graine du jet (voir replay_roll)
+    # Événement aléatoire résolu par le serveur (JSON, voir resolve_random_event)
+    event_details = db.Column(db.Text, nullable=True)
+    __table_args__ = (db.Index("ix_fate_question_campaign_id", "campaign_id", "id"),)
+
+    @property
+    def event(self):
+        return json.loads(self.event_details) if self.event_details else None
 
 class Objective(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     description = db.Column(db.String(500), nullable=False)
+    __table_args__ = (db.Index("ix_objective_campaign_id", "campaign_id", "id"),)
 
 class NPC(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     name = db.Column(db.String(100), nullable=False)
     description = db.Column(db.String(500), nullable=True)
+    # Dernière apparition (création ou tirage), pour favoriser les PNJ récents (voir sample_rows)
+    last_seen = db.Column(db.DateTime, nullable=True, default=datetime.utcnow)
+    __table_args__ = (db.Index("ix_npc_campaign_id", "campaign_id", "id"),)
 
 class Scene(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     title = db.Column(db.String(200), nullable=False)
     description = db.Column(db.String(1000), nullable=True)
     status = db.Column(db.String(50), default="normale")  # normale, altérée, interrompue
+    __table_args__ = (db.Index("ix_scene_campaign_id", "campaign_id", "id"),)
 
 class CustomTable(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     name = db.Column(db.String(200), nullable=False)
     # Les valeurs seront stockées en texte brut, séparées par des sauts de ligne
     values = db.Column(db.Text, nullable=False)
+    __table_args__ = (db.Index("ix_custom_table_campaign_id", "campaign_id", "id"),)
 
 class JournalEntry(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     date = db.Column(db.DateTime, default=datetime.utcnow)  # Date automatique
     content = db.Column(db.Text, nullable=False)
+    # Index pour la pagination par curseur (WHERE campaign_id = ? ORDER BY date DESC, id DESC)
+    __table_args__ = (db.Index("ix_journal_entry_campaign_date_id", "campaign_id", "date", "id"),)
 
 class Inventory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     title = db.Column(db.String(200), nullable=False)
+    __table_args__ = (db.Index("ix_inventory_campaign_id", "campaign_id", "id"),)
 
 class InventoryItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     inventory_id = db.Column(db.Integer, db.ForeignKey('inventory.id'), nullable=False)
     name = db.Column(db.String(200), nullable=False)
     description = db.Column(db.Text, nullable=True)
     quantity = db.Column(db.Integer, default=1)
     inventory = db.relationship('Inventory', backref=db.backref('items', lazy=True, cascade="all, delete"))
+    # Chargement des objets d'une liste d'inventaires (selectinload) ; tirage dans la campagne
+    __table_args__ = (db.Index("ix_inventory_item_inventory_id", "inventory_id", "id"),
+                      db.Index("ix_inventory_item_campaign_id", "campaign_id", "id"))
 
 class PlayerCharacter(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     name = db.Column(db.String(200), nullable=False)  # Nom du personnage
     description = db.Column(db.Text, nullable=True)   # Petite description ou historique
+    __table_args__ = (db.Index("ix_player_character_campaign_id", "campaign_id", "id"),)
 
 class PlayerAttribute(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     character_id = db.Column(db.Integer, db.ForeignKey('player_character.id'), nullable=False)
     attribute_name = db.Column(db.String(200), nullable=False)
     attribute_value = db.Column(db.String(200), nullable=False)
     is_numeric = db.Column(db.Boolean, default=False)  # Nouveau champ pour indiquer si c'est numérique
+    # Valeur entière des attributs numériques, modifiée par UPDATE atomique (voir adjust_attribute) ;
+    # attribute_value en garde la forme texte pour l'affichage
+    numeric_value = db.Column(db.Integer, nullable=True)
     character = db.relationship('PlayerCharacter', backref=db.backref('attributes', lazy=True, cascade="all, delete"))
+    __table_args__ = (db.Index("ix_player_attribute_character_id", "character_id", "id"),
+                      db.Index("ix_player_attribute_campaign_id", "campaign_id", "id"))
 
 class DiceRollHistory(db.Model):
     id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
     faces = db.Column(db.Integer, nullable=False)
     roll = db.Column(db.Integer, nullable=False)
-    date = db.Column(db.DateTime, default=datetime.utcnow)
+    seed = db.Column(db.String(40), nullable=True)  # graine du jet (voir replay_roll)
+    # Expression lancée (ex. « 4d6kh3+2 ») : roll en est le total, faces le plus grand dé
+    expression = db.Column(db.String(200), nullable=True)
+    date = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    __table_args__ = (db.Index("ix_dice_roll_history_campaign_id", "campaign_id", "id"),)
+
+def archive_table(model):
+    # Mêmes colonnes que la table d'origine, pour les lignes froides sorties par compact_campaign
+    name = model.__tablename__ + "_archive"
+    columns = [db.Column(column.name, column.type, primary_key=column.primary_key) for column in model.__table__.columns]
+    return db.Table(name, *columns, db.Index(f"ix_{name}_campaign_id", "campaign_id", "id"))
+
+dice_roll_history_archive = archive_table(DiceRollHistory)
+fate_question_archive = archive_table(FateQuestion)
+
+class RollStats(db.Model):
+    # Compteurs cumulés des lignes archivées : jets par dé et par valeur,
+    # réponses de l'oracle par probabilités, événements aléatoires
+    id = db.Column(db.Integer, primary_key=True)
+    campaign_id = campaign_column()
+    kind = db.Column(db.String(20), nullable=False)  # dice, fate, fate_event
+    key = db.Column(db.String(120), nullable=False)
+    count = db.Column(db.Integer, nullable=False, default=0)
+    __table_args__ = (db.Index("ix_roll_stats_campaign_kind_key", "campaign_id", "kind", "key", unique=True),)
 
 class OpenAIConfig(db.Model):
+    # Commune à toutes les campagnes
     id = db.Column(db.Integer, primary_key=True)
     api_key = db.Column(db.String(200), nullable=True)
 
-with app.app_context():
+def scoped(model):
+    return model.query.filter(model.campaign_id == current_campaign_id())
+
+def get_scoped_or_404(model, object_id):
+    # Une ligne d'une autre campagne est traitée comme inexistante
+    return scoped(model).filter(model.id == object_id).first_or_404()
+
+class CacheVersion(db.Model):
+    # Version de chaque ligne mise en cache (voir cached_singleton) : incrémentée dans la
+    # transaction qui modifie la ligne, elle prévient les autres processus du changement
+    name = db.Column(db.String(100), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+# Cache write-through des petites lignes lues à chaque requête : état de jeu (facteur de
+# chaos) de chaque campagne et clé OpenAI. Une écriture met le cache à jour après son
+# commit ; une lecture ne touche pas la base si la dernière vérification a moins de
+# SINGLETON_CACHE_CHECK secondes, sinon elle relit seulement le numéro de version.
+app.config['SINGLETON_CACHE_CHECK'] = 1.0
+CACHE_VERSION_SQL = "(SELECT version FROM cache_version WHERE name = :key)"
+
+_singletons = {}  # clé -> [valeur, version, dernière vérification]
+_singletons_lock = threading.Lock()
+
+def cached_singleton(key, load_sql, params=None):
+    # load_sql renvoie (valeur, CACHE_VERSION_SQL) : une seule requête pour les deux
+    now = time.monotonic()
+    with _singletons_lock:
+        entry = _singletons.get(key)
+        if entry is not None and now - entry[2] < app.config['SINGLETON_CACHE_CHECK']:
+            return entry[0]
+    if entry is not None:
+        version = db.session.execute(text(f"SELECT {CACHE_VERSION_SQL}"), {"key": key}).scalar() or 0
+        if version == entry[1]:
+            with _singletons_lock:
+                entry[2] = now
+            return entry[0]
+    row = db.session.execute(text(load_sql), {"key": key, **(params or {})}).first()
+    value, version = (row[0], row[1] or 0) if row else (None, 0)
+    store_singleton(key, value, version)
+    return value
+
+def bump_cache_version(key):
+    # À exécuter dans la transaction de l'écriture, avant le commit
+    return db.session.execute(text(
+        "INSERT INTO cache_version (name, version) VALUES (:key, 1) "
+        "ON CONFLICT (name) DO UPDATE SET version = version + 1 RETURNING version"), {"key": key}).scalar()
+
+def store_singleton(key, value, version):
+    with _singletons_lock:
+        _singletons[key] = [value, version, time.monotonic()]
+
+def current_chaos_factor():
+    campaign_id = current_campaign_id()
+    return cached_singleton(f"game_state:{campaign_id}",
+                            f"SELECT chaos_factor, {CACHE_VERSION_SQL} FROM game_state WHERE campaign_id = :campaign_id",
+                            {"campaign_id": campaign_id})
+
+def adjust_chaos_factor(adjustment):
+    campaign_id = current_campaign_id()
+    key = f"game_state:{campaign_id}"
+    # Mise à jour atomique : deux ajustements simultanés ne se marchent pas dessus
+    chaos_factor = db.session.execute(text(
+        "UPDATE game_state SET chaos_factor = max(:low, min(:high, chaos_factor + :adjustment)) "
+        "WHERE campaign_id = :campaign_id RETURNING chaos_factor"),
+        {"low": 1, "high": 9, "adjustment": adjustment, "campaign_id": campaign_id}).scalar()
+    version = bump_cache_version(key)
+    db.session.commit()
+    store_singleton(key, chaos_factor, version)
+    return chaos_factor
+
+def openai_api_key():
+    return cached_singleton("openai_config",
+                            f"SELECT api_key, {CACHE_VERSION_SQL} FROM open_ai_config ORDER BY id LIMIT 1")
+
+# Campagnes déjà vérifiées : évite une requête par appel pour valider le préfixe d'URL
+_known_campaigns = set()
+_known_campaigns_lock = threading.Lock()
+
+def campaign_exists(campaign_id):
+    with _known_campaigns_lock:
+        if campaign_id in _known_campaigns:
+            return True
+    if db.session.get(Campaign, campaign_id) is None:
+        return False
+    with _known_campaigns_lock:
+        _known_campaigns.add(campaign_id)
+    return True
+
+def create_campaign(name):
+    campaign = Campaign(name=name)
+    db.session.add(campaign)
+    db.session.flush()
+    db.session.add(GameState(campaign_id=campaign.id, chaos_factor=5))
+    db.session.commit()
+    return campaign
+
+class CampaignPrefixMiddleware:
+    # /c/<id>/... est servi comme /... pour la campagne <id>. Le préfixe passe dans
+    # SCRIPT_NAME : les URLs relatives de la page (./ask_fate...) et url_for() restent
+    # dans la campagne sans dupliquer les routes.
+    PREFIX_RE = re.compile(r"^/c/(\d+)(/.*)?$")
+
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        script_name = environ.get("SCRIPT_NAME", "")
+        environ["mythic.script_root"] = script_name
+        match = self.PREFIX_RE.match(environ.get("PATH_INFO", ""))
+        if match:
+            if match.group(2) is None:
+                # Sans « / » final, les URLs relatives sortiraient de la campagne
+                location = script_name + environ["PATH_INFO"] + "/"
+                if environ.get("QUERY_STRING"):
+                    location += "?" + environ["QUERY_STRING"]
+                start_response("308 Permanent Redirect", [("Location", location), ("Content-Length", "0")])
+                return [b""]
+            environ["mythic.campaign_id"] = int(match.group(1))
+            environ["SCRIPT_NAME"] = script_name + "/c/" + match.group(1)
+            environ["PATH_INFO"] = match.group(2)
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = CampaignPrefixMiddleware(app.wsgi_app)
+
+@app.before_request
+def load_campaign():
+    # Sans requête SQL : l'existence de la campagne est vérifiée par verify_password
+    g.campaign_id = request.environ.get("mythic.campaign_id", DEFAULT_CAMPAIGN_ID)
+
+def campaign_url(campaign_id):
+    root = request.environ.get("mythic.script_root", request.script_root)
+    if campaign_id == DEFAULT_CAMPAIGN_ID:
+        return root + "/"
+    return f"{root}/c/{campaign_id}/"
+
+# Réglages appliqués à chaque nouvelle connexion SQLite.
+# "wal" : les lectures ne bloquent plus les écritures et un commit n'attend plus un fsync
+# du fichier principal (synchronous=NORMAL : une coupure de courant peut perdre les
+# dernières transactions, jamais corrompre la base). "safe" : réglages d'origine de SQLite.
+SQLITE_PROFILES = {
+    "wal": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -20000,
+            "mmap_size": 256 * 1024 * 1024, "temp_store": "MEMORY"},
+    "safe": {"journal_mode": "DELETE", "synchronous": "FULL"},
+}
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA busy_timeout = {int(app.config['SQLITE_BUSY_TIMEOUT'])}")
+    for name, value in SQLITE_PROFILES[app.config['SQLITE_PROFILE']].items():
+        cursor.execute(f"PRAGMA {name} = {value}")
+    cursor.close()
+
+class GroupCommitWriter:
+    # Un thread unique écrit les lignes en file d'attente : tout ce qui arrive pendant
+    # la fenêtre part en un INSERT groupé par table et un seul commit (un seul fsync).
+    # Chaque appelant attend que sa ligne soit écrite et récupère son id.
+    def __init__(self, engine, window, max_batch):
+        self.engine = engine
+        self.window = window
+        self.max_batch = max_batch
+        self.pending = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="group-commit", daemon=True)
+        self.thread.start()
+
+    def insert(self, table, row):
+        item = {"table": table, "row": row, "done": threading.Event(), "id": None, "error": None}
+        self.pending.put(item)
+        item["done"].wait()
+        if item["error"] is not None:
+            raise item["error"]
+        return item["id"]
+
+    def _run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._write(batch)
+
+    def _write(self, batch):
+        by_table = {}
+        for item in batch:
+            by_table.setdefault(item["table"], []).append(item)
+        try:
+            with self.engine.begin() as connection:
+                for table, items in by_table.items():
+                    statement = insert(table).returning(table.c.id, sort_by_parameter_order=True)
+                    ids = connection.execute(statement, [item["row"] for item in items]).scalars().all()
+                    for item, new_id in zip(items, ids):
+                        item["id"] = new_id
+        except Exception as e:
+            for item in batch:
+                item["error"] = e
+        for item in batch:
+            item["done"].set()
+
+_group_writer = None
+_group_writer_lock = threading.Lock()
+
+def append_row(model, **values):
+    # Ajout d'une ligne dans une table en ajout seul ; renvoie l'objet avec son id
+    values.setdefault("campaign_id", current_campaign_id())
+    obj = model(**values)
+    if not app.config['GROUP_COMMIT']:
+        db.session.add(obj)
+        db.session.commit()
+        note_writes(model.__tablename__, values["campaign_id"])
+        return obj
+    global _group_writer
+    with _group_writer_lock:
+        if _group_writer is None:
+            _group_writer = GroupCommitWriter(db.engine, app.config['GROUP_COMMIT_WINDOW'],
+                                              app.config['GROUP_COMMIT_MAX_BATCH'])
+    obj.id = _group_writer.insert(model.__table__, values)
+    note_writes(model.__tablename__, values["campaign_id"])
+    return obj
+
+# Rétention des tables en ajout seul.
+# Chaque campagne garde ses N dernières lignes (tampon circulaire) : au-delà, les lignes
+# les plus anciennes sont comptées dans roll_stats, copiées dans la table d'archive puis
+# supprimées, en une transaction. Les requêtes courantes ne lisent que ce petit jeu.
+# table : (réglage du nombre de lignes gardées, table d'archive, agrégats vers roll_stats)
+RETENTION_TABLES = {
+    "dice_roll_history": ("DICE_HISTORY_KEEP", "dice_roll_history_archive", [
+        "SELECT campaign_id, 'dice', coalesce(expression, 'd' || faces) || ':' || roll, count(*) FROM dice_roll_history "
+        "WHERE campaign_id = :campaign_id AND id <= :cutoff GROUP BY 3",
+    ]),
+    "fate_question": ("FATE_HISTORY_KEEP", "fate_question_archive", [
+        "SELECT campaign_id, 'fate', odds || ':' || answer, count(*) FROM fate_question "
+        "WHERE campaign_id = :campaign_id AND id <= :cutoff GROUP BY odds, answer",
+        "SELECT campaign_id, 'fate_event', odds, count(*) FROM fate_question "
+        "WHERE campaign_id = :campaign_id AND id <= :cutoff AND random_event GROUP BY odds",
+    ]),
+}
+
+_retention_writes = {}
+_retention_lock = threading.Lock()
+
+def note_writes(table, campaign_id, count=1):
+    # Compte les écritures et lance un compactage toutes les RETENTION_EVERY lignes
+    if table not in RETENTION_TABLES:
+        return
+    with _retention_lock:
+        key = (table, campaign_id)
+        _retention_writes[key] = _retention_writes.get(key, 0) + count
+        if _retention_writes[key] < app.config['RETENTION_EVERY']:
+            return
+        _retention_writes[key] = 0
+    compact_campaign(campaign_id, [table])
+
+def compact_campaign(campaign_id, tables=None):
+    archived = {}
+    for table in tables or RETENTION_TABLES:
+        setting, archive, aggregates = RETENTION_TABLES[table]
+        keep = app.config[setting]
+        if keep is None:
+            continue
+        params = {"campaign_id": campaign_id, "keep": keep}
+        # Id de la plus récente ligne à sortir (index campaign_id, id)
+        cutoff = db.session.execute(text(
+            f"SELECT id FROM {table} WHERE campaign_id = :campaign_id ORDER BY id DESC LIMIT 1 OFFSET :keep"),
+            params).scalar()
+        if cutoff is None:
+            continue
+        params["cutoff"] = cutoff
+        for aggregate in aggregates:
+            db.session.execute(text(
+                f"INSERT INTO roll_stats (campaign_id, kind, key, count) {aggregate} "
+                "ON CONFLICT (campaign_id, kind, key) DO UPDATE SET count = count + excluded.count"), params)
+        columns = ", ".join(column.name for column in db.metadata.tables[archive].columns)
+        db.session.execute(text(
+            f"INSERT INTO {archive} ({columns}) SELECT {columns} FROM {table} "
+            "WHERE campaign_id = :campaign_id AND id <= :cutoff"), params)
+        archived[table] = db.session.execute(text(
+            f"DELETE FROM {table} WHERE campaign_id = :campaign_id AND id <= :cutoff"), params).rowcount
+    db.session.commit()
+    return archived
+
+@app.cli.command("compact")
+def compact_command():
+    """Archive les anciens jets et questions de toutes les campagnes."""
+    create_app()
+    for (campaign_id,) in db.session.query(Campaign.id).all():
+        for table, count in compact_campaign(campaign_id).items():
+            print(f"Campagne {campaign_id} : {count} lignes de {table} archivées")
+
+# Compteur de requêtes SQL par requête HTTP
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context():
+        g.query_count = g.get("query_count", 0) + 1
+
+def query_budget(max_queries):
+    # Nombre maximum de requêtes SQL qu'une route a le droit d'exécuter
+    def decorator(view):
+        view.query_budget = max_queries
+        return view
+    return decorator
+
+@app.after_request
+def check_query_budget(response):
+    if not app.config['QUERY_BUDGET_CHECK']:
+        return response
+    count = g.get("query_count", 0)
+    response.headers["X-Query-Count"] = str(count)
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, "query_budget", None)
+    if budget is not None and count > budget:
+        raise AssertionError(f"{request.endpoint} a exécuté {count} requêtes SQL (budget : {budget})")
+    return response
+
+# Index de recherche plein texte (SQLite FTS5).
+# Chaque ligne indexée a pour rowid id * 8 + code de la table source : les triggers
+# ci-dessous mettent l'index à jour à chaque INSERT/UPDATE/DELETE (y compris les
+# suppressions en cascade ou en masse) et une mise à jour ne touche qu'une ligne.
+SEARCH_INDEX_SQL = ("CREATE VIRTUAL TABLE search_index USING fts5("
+                    "kind UNINDEXED, ref_id UNINDEXED, campaign_id UNINDEXED, title, body, "
+                    "tokenize = 'unicode61 remove_diacritics 2')")
+
+# table source : (code, type, titre, texte) ; {row} est remplacé par new/old ou le nom de la table
+SEARCH_SOURCES = {
+    "journal_entry": (1, "journal", "strftime('%Y-%m-%d %H:%M', {row}.date)", "{row}.content"),
+    "npc": (2, "npc", "{row}.name", "coalesce({row}.description, '')"),
+    "scene": (3, "scene", "{row}.title", "coalesce({row}.description, '')"),
+    "fate_question": (4, "fate", "{row}.question", "{row}.odds || ' : ' || {row}.answer"),
+    "inventory_item": (5, "item", "{row}.name", "coalesce({row}.description, '')"),
+}
+
+# Colonnes dont la modification met l'index à jour : changer une quantité ou une
+# réponse ne réécrit pas la ligne de l'index
+SEARCH_UPDATE_COLUMNS = {
+    "journal_entry": "campaign_id, date, content",
+    "npc": "campaign_id, name, description",
+    "scene": "campaign_id, title, description",
+    "fate_question": "campaign_id, question, odds, answer",
+    "inventory_item": "campaign_id, name, description",
+}
+
+search_enabled = False
+
+def _search_insert_sql(table, row):
+    code, kind, title, body = SEARCH_SOURCES[table]
+    return (f"INSERT INTO search_index (rowid, kind, ref_id, campaign_id, title, body) "
+            f"SELECT {row}.id * 8 + {code}, '{kind}', {row}.id, {row}.campaign_id, "
+            f"{title.format(row=row)}, {body.format(row=row)}")
+
+def rebuild_search_index():
+    db.session.execute(text("DELETE FROM search_index"))
+    for table in SEARCH_SOURCES:
+        db.session.execute(text(_search_insert_sql(table, table) + f" FROM {table}"))
+    db.session.commit()
+
+def setup_search_index():
+    global search_enabled
+    existing = db.session.execute(text("SELECT sql FROM sqlite_master WHERE name = 'search_index'")).scalar()
+    try:
+        if existing != SEARCH_INDEX_SQL:
+            # Nouvel index ou définition modifiée : on le reconstruit entièrement
+            db.session.execute(text("DROP TABLE IF EXISTS search_index"))
+            db.session.execute(text(SEARCH_INDEX_SQL))
+        for table, (code, kind, title, body) in SEARCH_SOURCES.items():
+            delete_sql = f"DELETE FROM search_index WHERE rowid = old.id * 8 + {code};"
+            for suffix, when, statements in (
+                    ("ai", "AFTER INSERT", _search_insert_sql(table, "new") + ";"),
+                    ("au", f"AFTER UPDATE OF {SEARCH_UPDATE_COLUMNS[table]}", delete_sql + " " + _search_insert_sql(table, "new") + ";"),
+                    ("ad", "AFTER DELETE", delete_sql)):
+                db.session.execute(text(f"DROP TRIGGER IF EXISTS search_{table}_{suffix}"))
+                db.session.execute(text(f"CREATE TRIGGER search_{table}_{suffix} {when} ON {table} BEGIN {statements} END"))
+        db.session.commit()
+    except OperationalError:
+        # SQLite compilé sans FTS5 : l'application fonctionne, sans la recherche
+        db.session.rollback()
+        app.logger.warning("FTS5 indisponible, la recherche est désactivée.")
+        return
+    if existing != SEARCH_INDEX_SQL:
+        rebuild_search_index()
+    search_enabled = True
+
+def ensure_columns():
+    # create_all ne modifie pas une table existante : on ajoute les colonnes apparues
+    # depuis (ex. campaign_id), avec leur valeur par défaut côté serveur
+    inspector = db.inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(db.engine.dialect)}"
+            if column.server_default is not None:
+                ddl += f" NOT NULL DEFAULT {column.server_default.arg}" if not column.nullable else f" DEFAULT {column.server_default.arg}"
+            db.session.execute(text(ddl))
+    db.session.commit()
+
+def init_db():
+    # Création et mise à niveau du schéma, puis données de départ (appelé par create_app,
+    # dans un contexte d'application)
+    # Peut être rappelée sur une base vidée : les écouteurs ne sont posés qu'une fois
+    if not event.contains(db.engine, "before_cursor_execute", _count_query):
+        event.listen(db.engine, "before_cursor_execute", _count_query)
+    if db.engine.dialect.name == "sqlite" and not event.contains(db.engine, "connect", _apply_sqlite_pragmas):
+        event.listen(db.engine, "connect", _apply_sqlite_pragmas)
     db.create_all()
+    ensure_columns()
+    # create_all ne crée pas les index ajoutés à une table déjà existante
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(db.engine, checkfirst=True)
+    # Attributs numériques créés avant la colonne numeric_value (texte illisible → 0)
+    db.session.execute(text("UPDATE player_attribute SET numeric_value = CAST(attribute_value AS INTEGER) "
+                            "WHERE is_numeric AND numeric_value IS NULL"))
+    db.session.commit()
+    setup_search_index()
     if not OpenAIConfig.query.first():
         db.session.add(OpenAIConfig(api_key=""))
         db.session.commit()
+    if db.session.get(Campaign, DEFAULT_CAMPAIGN_ID) is None:
+        db.session.add(Campaign(id=DEFAULT_CAMPAIGN_ID, name="Campagne principale"))
+        db.session.commit()
+    # Chaque campagne a son état de jeu (facteur de chaos)
+    missing = db.session.query(Campaign.id).filter(~Campaign.id.in_(db.session.query(GameState.campaign_id))).all()
+    for (campaign_id,) in missing:
+        db.session.add(GameState(campaign_id=campaign_id, chaos_factor=5))
+    db.session.commit()
+
+# Moteur de jets.
+# Chaque campagne a son propre flux (RollStream) et chaque taille de dé son tampon :
+# un bloc de ROLL_BLOCK_SIZE jets est tiré d'un coup avec random.Random(graine du bloc)
+# .choices(), puis chaque jet n'est plus qu'une lecture dans une liste. La graine du bloc
+# vient du générateur maître de la campagne ; « graine/position » suffit à rejouer un jet.
+# Cette référence reste en base et n'est jamais envoyée au client : la graine d'un bloc
+# donne aussi tous les jets suivants du bloc (d100 de l'oracle compris). /audit_roll
+# rejoue le jet côté serveur à partir de son id.
+ROLL_BLOCK_SIZE = 256
+
+def _roll_block(faces, block_seed, size):
+    return random.Random(block_seed).choices(range(1, faces + 1), k=size)
+
+def seed_ref(block_seed, position):
+    return f"{block_seed:016x}/{position}"
+
+def replay_roll(faces, seed_ref):
+    block_seed, position = seed_ref.split("/")
+    return _roll_block(faces, int(block_seed, 16), int(position) + 1)[-1]
+
+class RollStream:
+    def __init__(self, seed=None, block_size=ROLL_BLOCK_SIZE):
+        self.master = random.Random(seed)
+        self.block_size = block_size
+        self.buffers = {}  # faces -> [graine du bloc, jets, position]
+        self.lock = threading.Lock()
+
+    def _buffer(self, faces, wanted=1):
+        # Appelé avec le verrou pris. Un grand lancer groupé tire un bloc plus long
+        # d'un coup : choices() donne le même début de suite quelle que soit la taille.
+        buffer = self.buffers.get(faces)
+        if buffer is None or buffer[2] >= len(buffer[1]):
+            block_seed = self.master.getrandbits(64)
+            block = _roll_block(faces, block_seed, max(self.block_size, wanted))
+            buffer = self.buffers[faces] = [block_seed, block, 0]
+        return buffer
+
+    def roll(self, faces):
+        # (jet, graine du bloc, position dans le bloc)
+        with self.lock:
+            buffer = self._buffer(faces)
+            position = buffer[2]
+            buffer[2] = position + 1
+            return buffer[1][position], buffer[0], position
+
+    def rolls(self, faces, count, with_seeds=False):
+        values, seeds = [], []
+        with self.lock:
+            while len(values) < count:
+                buffer = self._buffer(faces, count - len(values))
+                block_seed, block, position = buffer
+                end = min(len(block), position + count - len(values))
+                values.extend(block[position:end])
+                if with_seeds:
+                    seeds.extend(seed_ref(block_seed, i) for i in range(position, end))
+                buffer[2] = end
+        return values, seeds
+
+    def random(self):
+        # Flottant dans [0, 1) pour les tirages qui ne sont pas des jets de dé (voir sample_rows)
+        with self.lock:
+            return self.master.random()
+
+class RollEngine:
+    # Un flux par campagne ; remplacer roll_engine (reset_roll_engine) change de générateur
+    def __init__(self, seed=None, stream_factory=RollStream):
+        self.seed = seed
+        self.stream_factory = stream_factory
+        self.streams = {}
+        self.lock = threading.Lock()
+
+    def stream(self, campaign_id):
+        stream = self.streams.get(campaign_id)
+        if stream is not None:
+            return stream
+        with self.lock:
+            stream = self.streams.get(campaign_id)
+            if stream is None:
+                # Graine dérivée par campagne : les campagnes ne partagent pas leur suite
+                seed = None if self.seed is None else f"{self.seed}:{campaign_id}"
+                stream = self.streams[campaign_id] = self.stream_factory(seed)
+            return stream
+
+roll_engine = RollEngine(app.config['RNG_SEED'])
+
+def reset_roll_engine(seed=None):
+    global roll_engine
+    roll_engine = RollEngine(seed)
+
+def roll_die(faces):
+    # Un jet de 1 à faces pour la campagne en cours
+    return roll_engine.stream(current_campaign_id()).roll(faces)[0]
+
+def roll_die_with_seed(faces):
+    # Comme roll_die, avec la référence de graine à enregistrer (None si désactivé)
+    value, block_seed, position = roll_engine.stream(current_campaign_id()).roll(faces)
+    return value, seed_ref(block_seed, position) if app.config['ROLL_RECORD_SEED'] else None
+
+def roll_dice_many(faces, count, with_seeds=False):
+    # (jets, références de graine) ; la liste des graines est vide si elle n'est pas demandée
+    with_seeds = with_seeds and app.config['ROLL_RECORD_SEED']
+    return roll_engine.stream(current_campaign_id()).rolls(faces, count, with_seeds)
 
 # Fonction Fate Check selon la règle du PDF pour l'événement aléatoire
-def fate_check(odds, chaos_factor):
-    table_odds = {
-        "Certain": 90,
-        "Presque Certain": 85,
-        "Très Probable": 75,
-        "Probable": 65,
-        "50/50": 50,
-        "Improbable": 35,
-        "Très Improbable": 25,
-        "Presque Impossible": 15,
-        "Impossible": 10
-    }
-    
-    base_chance = table_odds.get(odds, 50)
+FATE_ODDS = {
+    "Certain": 90,
+    "Presque Certain": 85,
+    "Très Probable": 75,
+    "Probable": 65,
+    "50/50": 50,
+    "Improbable": 35,
+    "Très Improbable": 25,
+    "Presque Impossible": 15,
+    "Impossible": 10
+}
+FATE_ANSWERS = ("Oui Exceptionnel", "Oui", "Non", "Non Exceptionnel")
+CHAOS_MIN, CHAOS_MAX = 1, 9
+
+# Règle d'origine, jet fourni : sert à construire FATE_CHART et à le vérifier (tests/test_fate.py)
+def _fate_check_reference(odds, chaos_factor, roll):
+    base_chance = FATE_ODDS.get(odds, 50)
     modifier = (chaos_factor - 5) * 5
     final_chance = min(max(base_chance + modifier, 1), 99)
     
     exc_yes_threshold = int(final_chance * 0.2)
     exc_no_threshold = 100 - int((100 - final_chance) * 0.2)
     
-    roll = random.randint(1, 100)
     roll_str = str(roll)
     # Un Random Event est déclenché si le résultat est un double (11, 22, 33, etc.)
     # dont le chiffre (ex : 5 pour 55) est inférieur ou égal au Facteur de Chaos.
@@ -157,64 +871,322 @@ def fate_check(odds, chaos_factor):
         "random_event": is_double
     }
 
-@app.route("/")
+# Tout ne dépend que de (probabilités, chaos, jet) : 9 × 9 × 100 résultats calculés une
+# fois au démarrage. Chaque case de FATE_CHART est un octet : index de la réponse dans
+# FATE_ANSWERS (bits 0-1) et événement aléatoire (bit 2). FATE_THRESHOLDS donne les seuils
+# d'une ligne (probabilités, chaos). Un Fate Check est alors un jet et deux accès par index.
+FATE_ODDS_ROW = {odds: i for i, odds in enumerate(FATE_ODDS)}
+FATE_DEFAULT_ROW = FATE_ODDS_ROW["50/50"]  # probabilités inconnues : 50 %
+FATE_RANDOM_EVENT = 4
+
+def build_fate_chart():
+    chart = bytearray()
+    thresholds = []
+    for odds in FATE_ODDS:
+        for chaos_factor in range(CHAOS_MIN, CHAOS_MAX + 1):
+            first = _fate_check_reference(odds, chaos_factor, 1)
+            thresholds.append((first["base_chance"], first["final_chance"],
+                               first["exc_yes_threshold"], first["exc_no_threshold"]))
+            for roll in range(1, 101):
+                result = _fate_check_reference(odds, chaos_factor, roll)
+                chart.append(FATE_ANSWERS.index(result["answer"]) | (FATE_RANDOM_EVENT if result["random_event"] else 0))
+    return bytes(chart), tuple(thresholds)
+
+FATE_CHART, FATE_THRESHOLDS = build_fate_chart()
+
+def fate_chart_row(odds, chaos_factor):
+    return FATE_ODDS_ROW.get(odds, FATE_DEFAULT_ROW) * (CHAOS_MAX - CHAOS_MIN + 1) + chaos_factor - CHAOS_MIN
+
+def fate_outcome(odds, chaos_factor, roll):
+    if not CHAOS_MIN <= chaos_factor <= CHAOS_MAX:
+        return _fate_check_reference(odds, chaos_factor, roll)
+    row = fate_chart_row(odds, chaos_factor)
+    code = FATE_CHART[row * 100 + roll - 1]
+    base_chance, final_chance, exc_yes_threshold, exc_no_threshold = FATE_THRESHOLDS[row]
+    return {
+        "answer": FATE_ANSWERS[code & 3],
+        "base_chance": base_chance,
+        "final_chance": final_chance,
+        "roll": roll,
+        "exc_yes_threshold": exc_yes_threshold,
+        "exc_no_threshold": exc_no_threshold,
+        "random_event": bool(code & FATE_RANDOM_EVENT)
+    }
+
+def fate_check(odds, chaos_factor):
+    roll, seed = roll_die_with_seed(100)
+    result = fate_outcome(odds, chaos_factor, roll)
+    result["seed"] = seed
+    return result
+
+# Statistiques de l'oracle, calculées depuis FATE_CHART : les probabilités exactes
+# se comptent sur les 100 jets possibles, la simulation (Monte-Carlo) vérifie le
+# résultat sur un grand nombre de tirages. Tout est mis en cache par jeu de paramètres.
+# La réponse contient toujours les probabilités exactes : la simulation n'est qu'un
+# contrôle : 20 000 tirages suffisent (écart type < 0,4 point) et les 9 lignes de la
+# table (probabilités non précisées) se simulent alors en quelques dizaines de ms.
+SIMULATION_MAX_TRIALS = 20_000
+SIMULATION_MAX_SCENES = 50
+
+def _answer_rates(codes, total):
+    counts = [0] * len(FATE_ANSWERS)
+    random_events = 0
+    for code, count in codes.items():
+        counts[code & 3] += count
+        if code & FATE_RANDOM_EVENT:
+            random_events += count
+    return {"answers": {answer: counts[i] / total for i, answer in enumerate(FATE_ANSWERS)},
+            "random_event": random_events / total}
+
+@lru_cache(maxsize=None)
+def fate_probabilities(odds, chaos_factor):
+    row = fate_chart_row(odds, chaos_factor) * 100
+    return _answer_rates(Counter(FATE_CHART[row:row + 100]), 100)
+
+@lru_cache(maxsize=256)
+def simulate_fate_trials(odds, chaos_factor, trials):
+    # Graine tirée des paramètres : même simulation, même résultat (d'où le cache)
+    rng = random.Random(f"{odds}:{chaos_factor}:{trials}")
+    start = fate_chart_row(odds, chaos_factor) * 100
+    return _answer_rates(Counter(rng.choices(FATE_CHART[start:start + 100], k=trials)), trials)
+
+def scene_chaos_rates(chaos_factor):
+    # Chaos Roll sur d10 : ≤ chaos et impair → altérée, ≤ chaos et pair → interrompue
+    altered = sum(1 for roll in range(1, chaos_factor + 1) if roll % 2 == 1)
+    interrupted = min(chaos_factor, 10) - altered
+    return altered / 10, interrupted / 10
+
+@lru_cache(maxsize=256)
+def chaos_drift(start_chaos, scenes, p_control):
+    # Chaîne de Markov sur le facteur de chaos : à la fin de chaque scène il baisse de 1
+    # si les personnages ont gardé le contrôle (probabilité p_control), monte de 1 sinon.
+    distribution = [0.0] * (CHAOS_MAX + 1)
+    distribution[start_chaos] = 1.0
+    steps = []
+    for scene in range(1, scenes + 1):
+        altered = interrupted = 0.0
+        for chaos_factor in range(CHAOS_MIN, CHAOS_MAX + 1):
+            p_altered, p_interrupted = scene_chaos_rates(chaos_factor)
+            altered += distribution[chaos_factor] * p_altered
+            interrupted += distribution[chaos_factor] * p_interrupted
+        steps.append({
+            "scene": scene,
+            "expected_chaos": sum(cf * p for cf, p in enumerate(distribution)),
+            "chaos": {cf: distribution[cf] for cf in range(CHAOS_MIN, CHAOS_MAX + 1)},
+            "altered": altered,
+            "interrupted": interrupted,
+        })
+        following = [0.0] * (CHAOS_MAX + 1)
+        for chaos_factor in range(CHAOS_MIN, CHAOS_MAX + 1):
+            following[max(CHAOS_MIN, chaos_factor - 1)] += distribution[chaos_factor] * p_control
+            following[min(CHAOS_MAX, chaos_factor + 1)] += distribution[chaos_factor] * (1 - p_control)
+        distribution = following
+    return steps
+
+# Rendu d'un morceau de page (macro de _fragments.html) : les routes qui modifient
+# une entité le renvoient pour que la page se mette à jour sans location.reload()
+def render_fragment(macro_name, *args):
+    return str(get_template_attribute("_fragments.html", macro_name)(*args))
+
+# Synchronisation en direct entre onglets et joueurs (Server-Sent Events).
+# Une écriture publie un petit delta sur le canal de sa campagne ; il est sérialisé une
+# seule fois puis copié dans la file de chaque abonné de /events. Le broker local vit
+# dans le processus : avec plusieurs processus, EVENT_BROKER désigne un autre broker
+# offrant les mêmes méthodes (subscribe, unsubscribe, publish).
+app.config['EVENT_BROKER'] = 'local'
+app.config['EVENT_QUEUE_SIZE'] = 100  # au-delà, un abonné trop lent perd des événements
+app.config['EVENT_HEARTBEAT'] = 15  # secondes entre deux commentaires de maintien
+
+class LocalBroker:
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.channels = {}
+        self.lock = threading.Lock()
+
+    def subscribe(self, channel):
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.channels.setdefault(channel, set()).add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, channel, subscriber):
+        with self.lock:
+            subscribers = self.channels.get(channel)
+            if subscribers is not None:
+                subscribers.discard(subscriber)
+                if not subscribers:
+                    del self.channels[channel]
+
+    def publish(self, channel, message):
+        with self.lock:
+            subscribers = list(self.channels.get(channel, ()))
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(message)
+            except queue.Full:
+                pass
+
+EVENT_BROKERS = {"local": LocalBroker}
+_event_broker = None
+_event_broker_lock = threading.Lock()
+
+def get_event_broker():
+    global _event_broker
+    with _event_broker_lock:
+        if _event_broker is None:
+            _event_broker = EVENT_BROKERS[app.config['EVENT_BROKER']](app.config['EVENT_QUEUE_SIZE'])
+        return _event_broker
+
+def publish_event(event_type, payload):
+    # À appeler après le commit : les abonnés ne voient que des données écrites
+    message = f"event: {event_type}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+    get_event_broker().publish(current_campaign_id(), message)
+
+@app.route("/events", methods=["GET"])
 @auth.login_required
-def index():
-    game_state = GameState.query.first()
-    if not game_state:
-        game_state = GameState(chaos_factor=5)
-        db.session.add(game_state)
-        db.session.commit()
-        
-    fate_page = request.args.get('fate_page', 1, type=int)
-    fate_questions = FateQuestion.query.order_by(FateQuestion.id.desc()).paginate(page=fate_page, per_page=6, error_out=False)
-
-    objectives = Objective.query.all()
-    npcs = NPC.query.all()
-    scenes = Scene.query.all()
-    custom_tables = CustomTable.query.order_by(CustomTable.id.desc()).all()
-    
-    # Pagination pour le journal (5 entrées par page, page 1 par défaut)
-    page = request.args.get('page', 1, type=int)
-    journal_entries = JournalEntry.query.order_by(JournalEntry.date.desc()).paginate(page=page, per_page=5, error_out=False)
-    
-    last_fq = fate_questions.items[0] if fate_questions.items else None
-    current_scene = Scene.query.order_by(Scene.id.desc()).first()
+def events():
+    broker = get_event_broker()
+    channel = current_campaign_id()
+    subscriber = broker.subscribe(channel)
+    heartbeat = app.config['EVENT_HEARTBEAT']
+
+    def stream():
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            # Navigateur fermé : le serveur s'en aperçoit à l'écriture suivante
+            broker.unsubscribe(channel, subscriber)
+
+    return Response(stream(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Pagination par curseur (keyset) : on repart de la dernière ligne affichée au lieu
+# d'un OFFSET, et sans COUNT(*). Une page profonde coûte autant que la première.
+FATE_PAGE_SIZE = 6
+JOURNAL_PAGE_SIZE = 5
+DICE_HISTORY_SIZE = 10
+
+def _keyset_page(query, limit, cursor_of):
+    rows = query.limit(limit + 1).all()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    return rows, cursor_of(rows[-1])
+
+def fate_questions_page(before_id=None, limit=FATE_PAGE_SIZE):
+    query = scoped(FateQuestion)
+    if before_id is not None:
+        query = query.filter(FateQuestion.id < before_id)
+    return _keyset_page(query.order_by(FateQuestion.id.desc()), limit,
+                        lambda fq: {"before_id": fq.id})
+
+def journal_entries_page(before_date=None, before_id=None, limit=JOURNAL_PAGE_SIZE):
+    query = scoped(JournalEntry)
+    if before_date is not None and before_id is not None:
+        query = query.filter(tuple_(JournalEntry.date, JournalEntry.id) < tuple_(before_date, before_id))
+    return _keyset_page(query.order_by(JournalEntry.date.desc(), JournalEntry.id.desc()), limit,
+                        lambda entry: {"before_date": entry.date.isoformat(), "before_id": entry.id})
+
+def _page_limit(default):
+    return max(1, min(request.values.get("limit", default, type=int), 100))
+
+@app.route("/fate_history", methods=["GET", "POST"])
+@auth.login_required
+def fate_history():
+    questions, next_cursor = fate_questions_page(request.values.get("before_id", type=int), _page_limit(FATE_PAGE_SIZE))
+    return jsonify({"html": "".join(render_fragment("fate_question_item", fq) for fq in questions), "next": next_cursor})
 
-    inventories = Inventory.query.all()
+@app.route("/journal_entries", methods=["GET", "POST"])
+@auth.login_required
+def journal_entries():
+    before_date = request.values.get("before_date")
+    try:
+        before_date = datetime.fromisoformat(before_date) if before_date else None
+    except ValueError:
+        return jsonify({"error": "Curseur invalide"}), 400
+    entries, next_cursor = journal_entries_page(before_date, request.values.get("before_id", type=int), _page_limit(JOURNAL_PAGE_SIZE))
+    return jsonify({"html": "".join(render_fragment("journal_entry_item", entry) for entry in entries), "next": next_cursor})
+
+# Données de la page principale, chargées avec un nombre fixe de requêtes
+# quel que soit le nombre d'inventaires ou de personnages (pas de N+1 dans le template)
+def main_page_context():
+    campaigns = Campaign.query.order_by(Campaign.id).all()
+
+    fate_questions, fate_next = fate_questions_page()
+
+    objectives = scoped(Objective).all()
+    npcs = scoped(NPC).all()
+    scenes = scoped(Scene).all()
+    # Le contenu des tables personnelles n'est pas envoyé avec la page, seulement leurs noms
+    custom_tables = scoped(CustomTable).options(defer(CustomTable.values)).order_by(CustomTable.id.desc()).all()
+
+    journal_entries, journal_next = journal_entries_page()
+
+    last_fq = fate_questions[0] if fate_questions else None
+    # La scène actuelle est la dernière créée : inutile de refaire une requête
+    current_scene = max(scenes, key=lambda s: s.id) if scenes else None
+
+    # Les objets et attributs sont chargés en une seule requête chacun (selectin)
+    inventories = scoped(Inventory).options(selectinload(Inventory.items)).all()
+    players = scoped(PlayerCharacter).options(selectinload(PlayerCharacter.attributes)).all()
+
+    openai_key_display = '*******' if openai_api_key() else ''
+
+    return dict(chaos_factor=current_chaos_factor(),
+                campaign=next(c for c in campaigns if c.id == current_campaign_id()),
+                campaigns=[{"id": c.id, "name": c.name, "url": campaign_url(c.id)} for c in campaigns],
+                fate_questions=fate_questions,
+                fate_next=fate_next,
+                objectives=objectives,
+                npcs=npcs,
+                scenes=scenes,
+                last_fq=last_fq,
+                current_scene=current_scene,
+                custom_tables=custom_tables,
+                journal_entries=journal_entries,
+                journal_next=journal_next,
+                inventories=inventories,
+                players=players,
+                dice_history_size=DICE_HISTORY_SIZE,
+                custom_tables_json=json.dumps([{ "id": t.id, "name": t.name } for t in custom_tables]),
+                openai_key=openai_key_display)
 
-    players = PlayerCharacter.query.all()
+@app.route("/")
+@auth.login_required
+# 11 requêtes caches chauds ; la première page d'un processus relit aussi la campagne,
+# le facteur de chaos et la clé OpenAI (campaign_exists, cached_singleton)
+@query_budget(14)
+def index():
+    return render_template("index.html", **main_page_context())
 
-    openai_config = OpenAIConfig.query.first()
-    openai_key_display = '*******' if openai_config and openai_config.api_key else ''
 
-    return render_template("index.html", 
-                       chaos_factor=game_state.chaos_factor, 
-                       fate_questions=fate_questions, 
-                       objectives=objectives, 
-                       npcs=npcs, 
-                       scenes=scenes, 
-                       last_fq=last_fq, 
-                       current_scene=current_scene, 
-                       custom_tables=custom_tables, 
-                       journal_entries=journal_entries,
-                       current_fate_page=fate_page,
-                       inventories=inventories,
-                       players=players,
-                       custom_tables_json=json.dumps([{ "id": t.id, "name": t.name, "values": t.values } for t in custom_tables]),
-                       openai_key=openai_key_display)
+@app.route("/campaigns", methods=["GET", "POST"])
+@auth.login_required
+def campaigns():
+    return jsonify([{"id": c.id, "name": c.name, "url": campaign_url(c.id)}
+                    for c in Campaign.query.order_by(Campaign.id).all()])
 
+@app.route("/add_campaign", methods=["POST"])
+@auth.login_required
+def add_campaign():
+    name = (request.form.get("name") or "").strip()
+    if not name:
+        return jsonify({"error": "Le nom de la campagne est requis."}), 400
+    campaign = create_campaign(name)
+    return jsonify({"success": True, "id": campaign.id, "url": campaign_url(campaign.id)}), 200
 
 @app.route("/ask_fate", methods=["POST"])
 @auth.login_required
 def ask_fate():
     question = request.form.get("question")
     odds = request.form.get("odds")
-    game_state = GameState.query.first()
-    
-    result = fate_check(odds, game_state.chaos_factor)
-    
-    new_question = FateQuestion(
+    result = fate_check(odds, current_chaos_factor())
+    values = dict(
         question=question,
         odds=odds,
         answer=result["answer"],
@@ -223,19 +1195,99 @@ def ask_fate():
         roll=result["roll"],
         exc_yes_threshold=result["exc_yes_threshold"],
         exc_no_threshold=result["exc_no_threshold"],
-        random_event=result["random_event"]
+        random_event=result["random_event"],
+        seed=result["seed"]
     )
-    db.session.add(new_question)
-    db.session.commit()
-    return jsonify({"success": True}), 200
+    if result["random_event"] and request.form.get("resolve_event") == "1":
+        # Focus, sens et cible tirés ici : le PNJ ciblé est marqué « vu » dans la même transaction
+        values["event_details"] = json.dumps(resolve_random_event(), ensure_ascii=False)
+        new_question = FateQuestion(**values)
+        db.session.add(new_question)
+        db.session.commit()
+        note_writes("fate_question", current_campaign_id())
+    else:
+        new_question = append_row(FateQuestion, **values)
+    payload = {"id": new_question.id,
+               "event": new_question.event,
+               "html": render_fragment("fate_question_item", new_question),
+               "last_html": render_fragment("last_fate_question", new_question)}
+    publish_event("fate", payload)
+    return jsonify({"success": True, **payload}), 200
 
 @app.route("/delete_fate/<int:question_id>", methods=["POST"])
 @auth.login_required
 def delete_fate(question_id):
-    fq = FateQuestion.query.get_or_404(question_id)
+    fq = get_scoped_or_404(FateQuestion, question_id)
     db.session.delete(fq)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": question_id}), 200
+
+@app.route("/simulate_fate", methods=["GET", "POST"])
+@auth.login_required
+def simulate_fate():
+    chaos_factor = request.values.get("chaos", type=int)
+    if chaos_factor is None:
+        chaos_factor = current_chaos_factor()
+    trials = request.values.get("trials", 0, type=int)
+    scenes = request.values.get("scenes", 0, type=int)
+    p_control = request.values.get("p_control", 0.5, type=float)
+    odds = request.values.get("odds")
+    if not CHAOS_MIN <= chaos_factor <= CHAOS_MAX:
+        return jsonify({"error": f"Facteur de chaos invalide ({CHAOS_MIN} à {CHAOS_MAX})"}), 400
+    if odds is not None and odds not in FATE_ODDS:
+        return jsonify({"error": "Probabilités inconnues"}), 400
+    if not 0 <= trials <= SIMULATION_MAX_TRIALS or not 0 <= scenes <= SIMULATION_MAX_SCENES:
+        return jsonify({"error": f"Au plus {SIMULATION_MAX_TRIALS} tirages et {SIMULATION_MAX_SCENES} scènes"}), 400
+    if not 0 <= p_control <= 1:
+        return jsonify({"error": "p_control doit être entre 0 et 1"}), 400
+
+    # Sans probabilités précisées : toutes les lignes de la table pour ce facteur de chaos
+    result = {"chaos_factor": chaos_factor, "odds": {}}
+    for name in ([odds] if odds else FATE_ODDS):
+        stats = {"exact": fate_probabilities(name, chaos_factor)}
+        if trials:
+            stats["simulated"] = simulate_fate_trials(name, chaos_factor, trials)
+        result["odds"][name] = stats
+    if scenes:
+        result["drift"] = chaos_drift(chaos_factor, scenes, round(p_control, 3))
+    return jsonify(result)
+
+# Recherche plein texte dans le journal, les PNJ, les scènes, les questions et les objets
+SEARCH_MARK_START = "\x02"
+SEARCH_MARK_END = "\x03"
+
+def _search_match_query(terms):
+    # Chaque mot est cité (pas de syntaxe FTS5 venant de l'utilisateur) et cherché en préfixe
+    words = re.findall(r"\w+", terms)
+    return " ".join(f'"{word}"*' for word in words)
+
+def _search_highlight(snippet):
+    # Le texte est échappé avant d'ajouter les balises de surlignage
+    return str(escape(snippet)).replace(SEARCH_MARK_START, "<mark>").replace(SEARCH_MARK_END, "</mark>")
+
+@app.route("/search", methods=["GET", "POST"])
+@auth.login_required
+def search():
+    if not search_enabled:
+        return jsonify({"error": "Recherche indisponible (SQLite sans FTS5)."}), 503
+    match = _search_match_query(request.values.get("q", ""))
+    if not match:
+        return jsonify([])
+    limit = min(request.values.get("limit", 20, type=int), 100)
+    rows = db.session.execute(text(
+        "SELECT kind, ref_id, "
+        "snippet(search_index, 3, :start, :end, '…', 8) AS title, "
+        "snippet(search_index, 4, :start, :end, '…', 16) AS body "
+        "FROM search_index WHERE search_index MATCH :match AND campaign_id = :campaign_id "
+        "ORDER BY bm25(search_index, 0, 0, 0, 5.0, 1.0) LIMIT :limit"),
+        {"start": SEARCH_MARK_START, "end": SEARCH_MARK_END, "match": match,
+         "campaign_id": current_campaign_id(), "limit": limit})
+    return jsonify([{
+        "kind": row.kind,
+        "id": row.ref_id,
+        "title": _search_highlight(row.title),
+        "snippet": _search_highlight(row.body)
+    } for row in rows])
 
 @app.route("/add_objective", methods=["POST"])
 @auth.login_required
@@ -244,15 +1296,15 @@ def add_objective():
     new_objective = Objective(description=description)
     db.session.add(new_objective)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": new_objective.id, "html": render_fragment("objective_item", new_objective)}), 200
 
 @app.route("/delete_objective/<int:objective_id>", methods=["POST"])
 @auth.login_required
 def delete_objective(objective_id):
-    obj = Objective.query.get_or_404(objective_id)
+    obj = get_scoped_or_404(Objective, objective_id)
     db.session.delete(obj)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": objective_id}), 200
 
 @app.route("/add_npc", methods=["POST"])
 @auth.login_required
@@ -262,22 +1314,122 @@ def add_npc():
     new_npc = NPC(name=name, description=description)
     db.session.add(new_npc)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": new_npc.id, "html": render_fragment("npc_item", new_npc)}), 200
 
 @app.route("/delete_npc/<int:npc_id>", methods=["POST"])
 @auth.login_required
 def delete_npc(npc_id):
-    npc = NPC.query.get_or_404(npc_id)
+    npc = get_scoped_or_404(NPC, npc_id)
     db.session.delete(npc)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": npc_id}), 200
+
+# Tirage de lignes au hasard sans charger toute la table.
+# On tire un id entre le plus petit et le plus grand de la campagne (deux lectures de
+# l'index (campaign_id, id)), puis on lit cette ligne par sa clé : un trou (ligne supprimée,
+# autre campagne, filtre non satisfait) est simplement retiré. Un poids s'applique par
+# acceptation (probabilité poids / poids maximal), le tirage reste donc exact. Si les ids
+# sont trop clairsemés, on termine le tirage dans la liste des ids restants.
+app.config['SAMPLE_MAX'] = 50
+app.config['SAMPLE_ATTEMPTS'] = 8  # essais par ligne voulue avant de passer à la liste des ids
+app.config['NPC_RECENT_WEIGHT'] = 3  # un PNJ vu récemment a trois fois plus de chances de revenir
+app.config['NPC_RECENT_HOURS'] = 24
+
+def _id_bounds(model):
+    low = scoped(model).with_entities(func.min(model.id)).scalar_subquery()
+    high = scoped(model).with_entities(func.max(model.id)).scalar_subquery()
+    return db.session.query(low, high).one()
+
+def _accept(stream, row, weight, max_weight):
+    return weight is None or stream.random() * max_weight < weight(row)
+
+def sample_rows(model, k=1, filters=(), weight=None, max_weight=1):
+    # k lignes distinctes (moins si la campagne n'en a pas assez), dans l'ordre du tirage
+    low, high = _id_bounds(model)
+    if low is None:
+        return []
+    query = scoped(model).filter(*filters)
+    stream = roll_engine.stream(current_campaign_id())
+    span = high - low + 1
+    picked = {}
+    attempts = app.config['SAMPLE_ATTEMPTS'] * k
+    while len(picked) < k and attempts > 0:
+        attempts -= 1
+        candidate = low + int(stream.random() * span)
+        if candidate in picked:
+            continue
+        row = query.filter(model.id == candidate).first()
+        if row is not None and _accept(stream, row, weight, max_weight):
+            picked[candidate] = row
+    if len(picked) < k:
+        ids = [row_id for (row_id,) in query.filter(model.id.notin_(list(picked))).with_entities(model.id)]
+        while len(picked) < k and ids:
+            index = int(stream.random() * len(ids))
+            row = db.session.get(model, ids[index])
+            if _accept(stream, row, weight, max_weight):
+                ids[index] = ids[-1]
+                ids.pop()
+                picked[row.id] = row
+    return list(picked.values())
+
+def npc_recency_weight():
+    recent_since = datetime.utcnow() - timedelta(hours=app.config['NPC_RECENT_HOURS'])
+    recent_weight = app.config['NPC_RECENT_WEIGHT']
+    return lambda npc: recent_weight if npc.last_seen is not None and npc.last_seen >= recent_since else 1
+
+def mark_npcs_seen(npcs):
+    # Les PNJ tirés entrent en scène : ils deviennent « vus récemment » (sans commit)
+    if npcs:
+        db.session.execute(update(NPC).where(NPC.id.in_([npc.id for npc in npcs])).values(last_seen=datetime.utcnow()))
+
+def sample_npcs(k=1, recent=False, commit=True):
+    weight = npc_recency_weight() if recent else None
+    npcs = sample_rows(NPC, k, weight=weight, max_weight=max(1, app.config['NPC_RECENT_WEIGHT']))
+    mark_npcs_seen(npcs)
+    if npcs and commit:
+        db.session.commit()
+    return npcs
+
+def _sample_items(k, values):
+    filters = []
+    inventory_id = values.get("inventory_id", type=int)
+    if inventory_id is not None:
+        filters.append(InventoryItem.inventory_id == inventory_id)
+    return sample_rows(InventoryItem, k, filters)
+
+# Tirages proposés par /random_pick : fonction de tirage (k, paramètres) et champs renvoyés
+SAMPLE_KINDS = {
+    "npc": (lambda k, values: sample_npcs(k, values.get("recent", type=int) == 1),
+            lambda npc: {"name": npc.name, "description": npc.description}),
+    "scene": (lambda k, values: sample_rows(Scene, k),
+              lambda scene: {"title": scene.title, "description": scene.description, "status": scene.status}),
+    "objective": (lambda k, values: sample_rows(Objective, k),
+                  lambda objective: {"description": objective.description}),
+    "player": (lambda k, values: sample_rows(PlayerCharacter, k),
+               lambda player: {"name": player.name, "description": player.description}),
+    "item": (_sample_items,
+             lambda item: {"name": item.name, "description": item.description,
+                           "quantity": item.quantity, "inventory_id": item.inventory_id}),
+}
+
+@app.route("/random_pick/<string:kind>", methods=["POST"])
+@auth.login_required
+def random_pick(kind):
+    if kind not in SAMPLE_KINDS:
+        return jsonify({"error": "Type de tirage inconnu."}), 400
+    sample, fields = SAMPLE_KINDS[kind]
+    k = max(1, min(request.values.get("k", 1, type=int), app.config['SAMPLE_MAX']))
+    rows = sample(k, request.values)
+    if not rows:
+        return jsonify({"error": "Rien à tirer.", "samples": []})
+    return jsonify({"kind": kind, "samples": [{"id": row.id, **fields(row)} for row in rows]})
 
 @app.route("/random_npc", methods=["POST"])
 @auth.login_required
 def random_npc():
-    npcs = NPC.query.all()
+    npcs = sample_npcs(1, request.values.get("recent", type=int) == 1)
     if npcs:
-        npc = random.choice(npcs)
+        npc = npcs[0]
         return jsonify({"name": npc.name, "description": npc.description})
     else:
         return jsonify({"error": "Aucun PNJ enregistré."})
@@ -291,32 +1443,37 @@ def add_scene():
     new_scene = Scene(title=title, description=description, status=status)
     db.session.add(new_scene)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    # La nouvelle scène devient la scène actuelle
+    return jsonify({"success": True,
+                    "id": new_scene.id,
+                    "html": render_fragment("scene_item", new_scene),
+                    "current_scene_html": render_fragment("current_scene_banner", new_scene)}), 200
 
 @app.route("/delete_scene/<int:scene_id>", methods=["POST"])
 @auth.login_required
 def delete_scene(scene_id):
-    scene = Scene.query.get_or_404(scene_id)
+    scene = get_scoped_or_404(Scene, scene_id)
     db.session.delete(scene)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    current_scene = scoped(Scene).order_by(Scene.id.desc()).first()
+    return jsonify({"success": True,
+                    "id": scene_id,
+                    "current_scene_html": render_fragment("current_scene_banner", current_scene)}), 200
 
 @app.route("/adjust_chaos", methods=["POST"])
 @auth.login_required
 def adjust_chaos():
     adjustment = int(request.form.get("adjustment"))
-    game_state = GameState.query.first()
-    game_state.chaos_factor = max(1, min(9, game_state.chaos_factor + adjustment))
-    db.session.commit()
+    chaos_factor = adjust_chaos_factor(adjustment)
+    publish_event("chaos", {"chaos": chaos_factor})
     return jsonify({"success": True}), 200
 
 # Endpoint pour le Chaos Roll des scènes sur d10
 @app.route("/scene_chaos_roll", methods=["POST"])
 @auth.login_required
 def scene_chaos_roll():
-    game_state = GameState.query.first()
-    cf = game_state.chaos_factor
-    roll = random.randint(1, 10)
+    cf = current_chaos_factor()
+    roll = roll_die(10)
     # Règle pour le Chaos Roll des scènes :
     # Si roll > cf → scène normale
     # Si roll ≤ cf et impair → scène altérée
@@ -334,19 +1491,15 @@ def scene_chaos_roll():
 @app.route("/roll_d100", methods=["POST"])
 @auth.login_required
 def roll_d100():
-    roll = random.randint(1, 100)
+    roll = roll_die(100)
     return jsonify({"roll": roll})
 
-@app.route("/journal", defaults={'page': 1}, methods=["POST"])
-@app.route("/journal/page/<int:page>", methods=["POST"])
+# Anciennes URLs de pagination du journal : tout est maintenant sur la page principale
+@app.route("/journal", defaults={'page': 1}, methods=["GET", "POST"])
+@app.route("/journal/page/<int:page>", methods=["GET", "POST"])
 @auth.login_required
 def journal(page):
-    per_page = 5  # Nombre d'entrées par page
-    journal_entries = JournalEntry.query.order_by(JournalEntry.date.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    fate_page = request.args.get('fate_page', 1, type=int)
-    fate_questions = FateQuestion.query.order_by(FateQuestion.id.desc()).paginate(page=fate_page, per_page=6, error_out=False)
-    print(journal_entries)
-    return render_template("index.html", journal_entries=journal_entries, current_page=page)
+    return redirect(url_for("index") + "#journal")
 
 @app.route("/add_journal_entry", methods=["POST"])
 @auth.login_required
@@ -356,25 +1509,65 @@ def add_journal_entry():
         new_entry = JournalEntry(content=content)
         db.session.add(new_entry)
         db.session.commit()
+        return jsonify({"success": True, "id": new_entry.id, "html": render_fragment("journal_entry_item", new_entry)}), 200
     return jsonify({"success": True}), 200
 
 @app.route("/delete_journal_entry/<int:entry_id>", methods=["POST"])
 @auth.login_required
 def delete_journal_entry(entry_id):
-    entry = JournalEntry.query.get_or_404(entry_id)
+    entry = get_scoped_or_404(JournalEntry, entry_id)
     db.session.delete(entry)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": entry_id}), 200
+
+# Export du journal en flux : les entrées sont lues par paquets (yield_per) et envoyées
+# au fur et à mesure, le téléchargement démarre tout de suite et la mémoire reste constante.
+JOURNAL_EXPORT_BATCH = 200
+
+def export_journal_markdown(entries):
+    yield "# Journal\n\n"
+    for entry in entries:
+        yield f"## {entry.date.strftime('%Y-%m-%d %H:%M:%S')}\n\n{entry.content}\n\n---\n\n"
+
+def export_journal_jsonl(entries):
+    for entry in entries:
+        yield json.dumps({"id": entry.id, "date": entry.date.isoformat(), "content": entry.content}, ensure_ascii=False) + "\n"
+
+def export_journal_html(entries):
+    yield '<!DOCTYPE html>\n<html lang="fr">\n<head><meta charset="UTF-8"><title>Journal</title></head>\n<body>\n<h1>Journal</h1>\n'
+    for entry in entries:
+        yield (f"<h2>{entry.date.strftime('%Y-%m-%d %H:%M:%S')}</h2>\n"
+               f'<p style="white-space: pre-line;">{escape(entry.content)}</p>\n<hr>\n')
+    yield "</body>\n</html>\n"
+
+JOURNAL_EXPORT_FORMATS = {
+    "md": (export_journal_markdown, "text/markdown", "journal.md"),
+    "jsonl": (export_journal_jsonl, "application/x-ndjson", "journal.jsonl"),
+    "html": (export_journal_html, "text/html", "journal.html"),
+}
 
-@app.route("/export_journal", methods=["POST"])
+@app.route("/export_journal", methods=["GET", "POST"])
 @auth.login_required
 def export_journal():
-    entries = JournalEntry.query.order_by(JournalEntry.date.asc()).all()
-    markdown_content = "# Journal\n\n"
-    for entry in entries:
-        markdown_content += f"## {entry.date.strftime('%Y-%m-%d %H:%M:%S')}\n\n{entry.content}\n\n---\n\n"
-    
-    return Response(markdown_content, mimetype="text/markdown", headers={"Content-Disposition": "attachment;filename=journal.md"})
+    export_format = request.values.get("format", "md")
+    if export_format not in JOURNAL_EXPORT_FORMATS:
+        return jsonify({"error": "Format d'export inconnu"}), 400
+    writer, mimetype, filename = JOURNAL_EXPORT_FORMATS[export_format]
+
+    query = scoped(JournalEntry)
+    try:
+        # Période optionnelle, bornes incluses (AAAA-MM-JJ)
+        if request.values.get("start"):
+            query = query.filter(JournalEntry.date >= datetime.strptime(request.values["start"], "%Y-%m-%d"))
+        if request.values.get("end"):
+            end = datetime.strptime(request.values["end"], "%Y-%m-%d") + timedelta(days=1)
+            query = query.filter(JournalEntry.date < end)
+    except ValueError:
+        return jsonify({"error": "Date invalide (format attendu : AAAA-MM-JJ)"}), 400
+
+    entries = query.order_by(JournalEntry.date.asc()).yield_per(JOURNAL_EXPORT_BATCH)
+    return Response(stream_with_context(writer(entries)), mimetype=mimetype,
+                    headers={"Content-Disposition": f"attachment;filename={filename}"})
 
 @app.route("/add_inventory", methods=["POST"])
 @auth.login_required
@@ -385,15 +1578,16 @@ def add_inventory():
         db.session.add(new_inventory)
         print(new_inventory)
         db.session.commit()
+        return jsonify({"success": True, "id": new_inventory.id, "html": render_fragment("inventory_block", new_inventory)}), 200
     return jsonify({"success": True}), 200
 
 @app.route("/delete_inventory/<int:inventory_id>", methods=["POST"])
 @auth.login_required
 def delete_inventory(inventory_id):
-    inventory = Inventory.query.get_or_404(inventory_id)
+    inventory = get_scoped_or_404(Inventory, inventory_id)
     db.session.delete(inventory)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": inventory_id}), 200
 
 @app.route("/add_inventory_item/<int:inventory_id>", methods=["POST"])
 @auth.login_required
@@ -402,123 +1596,183 @@ def add_inventory_item(inventory_id):
     description = request.form.get("description")
     quantity = request.form.get("quantity", type=int)  # Récupérer la quantité en tant qu'entier
 
-    if not name or quantity < 1:
-        flash("Le nom de l'objet et une quantité valide sont requis.", "danger")
-        return redirect(url_for("index"))
+    if not name or quantity is None or quantity < 1:
+        return jsonify({"error": "Le nom de l'objet et une quantité valide sont requis."}), 400
+    get_scoped_or_404(Inventory, inventory_id)
 
     new_item = InventoryItem(name=name, description=description, quantity=quantity, inventory_id=inventory_id)
     db.session.add(new_item)
     db.session.commit()
-    flash("Objet ajouté avec succès à l'inventaire.", "success")
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True,
+                    "id": new_item.id,
+                    "inventory_id": inventory_id,
+                    "html": render_fragment("inventory_item_row", new_item)}), 200
 
 @app.route("/delete_inventory_item/<int:item_id>", methods=["POST"])
 @auth.login_required
 def delete_inventory_item(item_id):
-    item = InventoryItem.query.get_or_404(item_id)
+    item = get_scoped_or_404(InventoryItem, item_id)
     db.session.delete(item)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": item_id}), 200
+
+# Compteurs modifiés en une seule requête UPDATE ... RETURNING : pas de lecture
+# préalable, et deux clics simultanés ne peuvent pas perdre une modification
+def adjust_item_quantity(item_id, delta):
+    # La quantité ne descend pas sous 0 ; renvoie (quantité, inventaire) ou None
+    return db.session.execute(
+        update(InventoryItem)
+        .where(InventoryItem.id == item_id, InventoryItem.campaign_id == current_campaign_id())
+        .values(quantity=func.max(0, InventoryItem.quantity + delta))
+        .returning(InventoryItem.quantity, InventoryItem.inventory_id)
+        .execution_options(synchronize_session=False)
+    ).first()
+
+def adjust_attribute(attribute_id, delta):
+    # Seuls les attributs numériques sont modifiés ; renvoie la nouvelle valeur ou None
+    return db.session.execute(
+        update(PlayerAttribute)
+        .where(PlayerAttribute.id == attribute_id, PlayerAttribute.campaign_id == current_campaign_id(),
+               PlayerAttribute.is_numeric)
+        .values(numeric_value=PlayerAttribute.numeric_value + delta,
+                attribute_value=cast(PlayerAttribute.numeric_value + delta, db.String))
+        .returning(PlayerAttribute.numeric_value)
+        .execution_options(synchronize_session=False)
+    ).scalar()
+
+# Pas maximal d'une modification : bien en deçà des entiers 64 bits de SQLite (au-delà,
+# l'envoi de la valeur échoue et une addition passerait en flottant)
+COUNTER_MAX_DELTA = 10 ** 9
+SQLITE_MAX_INT = 2 ** 63 - 1
+
+def counter_delta(value, signed=False):
+    # Entier dans [0, COUNTER_MAX_DELTA] (ou [-COUNTER_MAX_DELTA, ...] si signed), ValueError sinon
+    if isinstance(value, (bool, float)):
+        raise ValueError("Pas entier attendu")
+    delta = int(value)
+    if not (-COUNTER_MAX_DELTA if signed else 0) <= delta <= COUNTER_MAX_DELTA:
+        raise ValueError("Pas hors limites")
+    return delta
+
+def row_id(value):
+    if isinstance(value, (bool, float)):
+        raise ValueError("Id entier attendu")
+    value = int(value)
+    if not 0 < value <= SQLITE_MAX_INT:
+        raise ValueError("Id hors limites")
+    return value
+
+def _operation_delta(operation):
+    # increase / decrease, d'un pas de 1 ou de la valeur « delta » envoyée ; None si invalide
+    try:
+        step = counter_delta(request.values.get("delta", 1))
+    except ValueError:
+        return None
+    if operation == "increase":
+        return step
+    if operation == "decrease":
+        return -step
+    return None
 
 @app.route("/update_attribute/<int:attribute_id>/<string:operation>", methods=["POST"])
 @auth.login_required
 def update_attribute(attribute_id, operation):
-    attr = PlayerAttribute.query.get_or_404(attribute_id)
-    
-    # Vérifier que l'attribut est numérique
-    if attr.is_numeric:
-        try:
-            value = int(attr.attribute_value)
-        except ValueError:
-            value = 0  # Si la valeur n'est pas numérique, le réinitialiser
-        if operation == "increase":
-            value += 1
-        elif operation == "decrease":
-            value -= 1
-        attr.attribute_value = str(value)
-        db.session.commit()
-        return jsonify({"success": True, "new_value": value})  # Retour JSON
-    
-    return jsonify({"success": False}), 400  # Erreur si l'attribut n'est pas numérique
+    delta = _operation_delta(operation)
+    if delta is None:
+        return jsonify({"success": False}), 400
+    value = adjust_attribute(attribute_id, delta)
+    if value is None:
+        db.session.rollback()
+        get_scoped_or_404(PlayerAttribute, attribute_id)
+        return jsonify({"success": False}), 400  # Erreur si l'attribut n'est pas numérique
+    db.session.commit()
+    publish_event("attribute_value", {"id": attribute_id, "value": value})
+    return jsonify({"success": True, "new_value": value})  # Retour JSON
 
 @app.route("/update_item_quantity/<int:item_id>/<string:operation>", methods=["POST"])
 @auth.login_required
 def update_item_quantity(item_id, operation):
-    item = InventoryItem.query.get_or_404(item_id)
-    if operation == "increase":
-        item.quantity += 1
-    elif operation == "decrease" and item.quantity > 0:
-        item.quantity -= 1
+    delta = _operation_delta(operation)
+    if delta is None:
+        return jsonify({"success": False}), 400
+    row = adjust_item_quantity(item_id, delta)
+    if row is None:
+        abort(404)
     db.session.commit()
-    return jsonify({"success": True, "new_quantity": item.quantity, "inventory_id": item.inventory_id})
+    quantity, inventory_id = row
+    publish_event("item_quantity", {"id": item_id, "quantity": quantity, "inventory_id": inventory_id})
+    return jsonify({"success": True, "new_quantity": quantity, "inventory_id": inventory_id})
+
+# Plusieurs modifications en un aller-retour et une transaction (ex. PV et munitions
+# de tout le groupe) : {"items": [{"id": 3, "delta": -2}], "attributes": [{"id": 7, "delta": -5}]}
+@app.route("/bulk_update", methods=["POST"])
+@auth.login_required
+def bulk_update():
+    # JSON invalide ou absent : None ; un tableau ou un nombre n'est pas accepté non plus
+    changes = request.get_json(silent=True)
+    try:
+        if not isinstance(changes, dict):
+            raise TypeError
+        items = [(row_id(change["id"]), counter_delta(change["delta"], signed=True))
+                 for change in changes.get("items", [])]
+        attributes = [(row_id(change["id"]), counter_delta(change["delta"], signed=True))
+                      for change in changes.get("attributes", [])]
+    except (KeyError, TypeError, ValueError, OverflowError):
+        return jsonify({"error": "Format attendu : {\"items\": [{\"id\", \"delta\"}], \"attributes\": [...]}"}), 400
+
+    item_results, attribute_results = [], []
+    for item_id, delta in items:
+        row = adjust_item_quantity(item_id, delta)
+        if row is None:
+            db.session.rollback()
+            return jsonify({"error": f"Objet {item_id} introuvable"}), 404
+        item_results.append({"id": item_id, "quantity": row[0], "inventory_id": row[1]})
+    for attribute_id, delta in attributes:
+        value = adjust_attribute(attribute_id, delta)
+        if value is None:
+            db.session.rollback()
+            return jsonify({"error": f"Attribut numérique {attribute_id} introuvable"}), 404
+        attribute_results.append({"id": attribute_id, "value": value})
+    db.session.commit()
+
+    for result in item_results:
+        publish_event("item_quantity", result)
+    for result in attribute_results:
+        publish_event("attribute_value", result)
+    return jsonify({"success": True, "items": item_results, "attributes": attribute_results})
 
 @app.route("/update_openai_key", methods=["POST"])
 @auth.login_required
 def update_openai_key():
     
-    api_key = request.form.get("api_key")
+    api_key = request.form.get("api_key") or ""
     if not api_key.startswith("sk-"):
-        flash("La clé OpenAI doit commencer par 'sk-'.", "danger")
-        return jsonify({"success": False}), 200
+        return jsonify({"success": False, "error": "La clé OpenAI doit commencer par 'sk-'."}), 400
     
-    config = OpenAIConfig.query.first()
+    config = OpenAIConfig.query.order_by(OpenAIConfig.id).first()
     if config:
         config.api_key = api_key
     else:
         config = OpenAIConfig(api_key=api_key)
         db.session.add(config)
+    version = bump_cache_version("openai_config")
     db.session.commit()
-    flash("Clé OpenAI mise à jour avec succès.", "success")
+    store_singleton("openai_config", api_key, version)
     return jsonify({"success": True}), 200
 
-@app.route("/transcribe_audio", methods=["POST"])
-@auth.login_required
-def transcribe_audio():
-    config = OpenAIConfig.query.first()
-    if not config or not config.api_key:
-        return jsonify({"error": "Clé API OpenAI non configurée."}), 400
-
-    audio_file = request.files["audio"]
-    audio_blob = audio_file.read()  # Read the file content as bytes
-    audio_file_path = "temp_audio.wav"
-    
-    # Save the audio blob to a temporary file
-    with open(audio_file_path, "wb") as f:
-        f.write(audio_blob)
-
-    client = OpenAI(api_key=config.api_key)
-    with open(audio_file_path, "rb") as f:
-        transcription = client.audio.transcriptions.create(
-            model="whisper-1",
-            file=f,
-            response_format="json"
-        )
-    
-    # Optionally, remove the temporary file after processing
-    os.remove(audio_file_path)
-
-    # Access the transcription text directly
-    transcription_text = transcription.text if hasattr(transcription, 'text') else ""
-    
-    return jsonify({"transcription": transcription_text})
-
-@app.route("/reformat_journal", methods=["POST"])
-@auth.login_required
-def reformat_journal():
-    text = request.form.get("journal_text")
-    config = OpenAIConfig.query.first()
-    
-    if not config or not config.api_key:
-        return jsonify({"error": "Aucune clé OpenAI configurée."}), 400
-
-    client = OpenAI(api_key=config.api_key)
-
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4",
-            messages=[
-                {"role": "system", "content":
-                 """
+# Appels OpenAI (Whisper, GPT-4) : ils durent souvent plusieurs dizaines de secondes,
+# on ne veut pas bloquer un worker pendant ce temps. La route crée un job exécuté dans
+# un pool de threads et renvoie tout de suite son id ; la page interroge /jobs/<id>
+# (ou écoute /jobs/<id>/events) jusqu'au résultat.
+app.config['AI_BACKEND'] = 'openai'  # 'stub' pour travailler sans OpenAI (tests, hors ligne)
+app.config['AI_WORKERS'] = 4
+app.config['AI_JOB_TTL'] = 600  # secondes pendant lesquelles un résultat reste disponible
+app.config['AUDIO_MAX_BYTES'] = 25 * 1024 * 1024  # limite de l'API Whisper
+# Un corps plus gros (enregistrement + en-têtes multipart) est refusé par Werkzeug avant
+# d'être lu. En dessous, Werkzeug garde l'upload en mémoire s'il est petit, sur disque sinon.
+app.config['MAX_CONTENT_LENGTH'] = app.config['AUDIO_MAX_BYTES'] + 64 * 1024
+
+JOURNAL_SUMMARY_PROMPT = """
                  Tu es un assistant de jeu de rôle spécialisé dans la reformulation de résumés de sessions de JDR. 
                  Réalise un document résumant cette scène de JDR Solo en respectant ce format :
                  ### Résumé
@@ -533,19 +1787,168 @@ def reformat_journal():
                  Ici tu met les objets importants du recit tel que décris 
                  ### Evolution
                  Ici tu décris l'évolution du lore, cad tel qu'il était avant la scène, comparé a après la scène
-                 """ 
-                },
+                 """
+
+class OpenAIBackend:
+    def __init__(self):
+        # Un client par clé API, réutilisé d'un appel à l'autre (il garde ses connexions ouvertes)
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def client(self, api_key):
+        with self._lock:
+            client = self._clients.get(api_key)
+            if client is None:
+                self._clients.clear()  # la clé a changé, l'ancien client ne sert plus
+                client = self._clients[api_key] = OpenAI(api_key=api_key)
+            return client
+
+    def transcribe(self, api_key, audio):
+        transcription = self.client(api_key).audio.transcriptions.create(
+            model="whisper-1",
+            file=audio,
+            response_format="json"
+        )
+        return transcription.text if hasattr(transcription, 'text') else ""
+
+    def reformat(self, api_key, text):
+        response = self.client(api_key).chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {"role": "system", "content": JOURNAL_SUMMARY_PROMPT},
                 {"role": "user", "content": text}
             ],
             temperature=0.7
         )
-        formatted_text = response.choices[0].message.content
-        
-        return jsonify({"formatted_text": formatted_text})
-    
+        return response.choices[0].message.content
+
+class StubAIBackend:
+    # Réponses locales et instantanées, sans appel réseau
+    def transcribe(self, api_key, audio):
+        return "Transcription de test."
+
+    def reformat(self, api_key, text):
+        return "### Résumé\n" + text
+
+AI_BACKENDS = {"openai": OpenAIBackend, "stub": StubAIBackend}
+_ai_backends = {}
+_ai_executor = None
+_ai_lock = threading.Lock()
+_jobs = {}
+
+def get_ai_backend():
+    name = app.config['AI_BACKEND']
+    with _ai_lock:
+        if name not in _ai_backends:
+            _ai_backends[name] = AI_BACKENDS[name]()
+        return _ai_backends[name]
+
+def _run_job(job, fn, args):
+    job["status"] = "running"
+    try:
+        job["result"] = fn(*args)
+        job["status"] = "done"
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
-    
+        job["error"] = str(e)
+        job["status"] = "error"
+    finally:
+        job["finished"].set()
+
+def submit_job(fn, *args):
+    global _ai_executor
+    now = time.monotonic()
+    job_id = uuid.uuid4().hex
+    job = {"status": "pending", "result": None, "error": None, "created": now, "finished": threading.Event()}
+    with _ai_lock:
+        # On oublie les jobs trop anciens
+        for old_id in [i for i, j in _jobs.items() if now - j["created"] > app.config['AI_JOB_TTL']]:
+            del _jobs[old_id]
+        _jobs[job_id] = job
+        if _ai_executor is None:
+            _ai_executor = ThreadPoolExecutor(max_workers=app.config['AI_WORKERS'], thread_name_prefix="ai-job")
+    _ai_executor.submit(_run_job, job, fn, args)
+    return job_id
+
+def job_payload(job):
+    return {"status": job["status"], "result": job["result"], "error": job["error"]}
+
+def take_upload(file_storage, max_bytes):
+    # Reprend le fichier où Werkzeug a déjà mis l'upload, sans le recopier.
+    # Renvoie None si l'enregistrement dépasse max_bytes.
+    stream = file_storage.stream
+    stream.seek(0, os.SEEK_END)
+    if stream.tell() > max_bytes:
+        return None
+    stream.seek(0)
+    # La fin de la requête ferme les fichiers reçus : celui-ci appartient désormais au job
+    file_storage.stream = io.BytesIO()
+    return stream
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(e):
+    return jsonify({"error": "Requête trop volumineuse."}), 413
+
+@app.route("/jobs/<job_id>", methods=["GET", "POST"])
+@auth.login_required
+def job_status(job_id):
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Tâche inconnue ou expirée."}), 404
+    return jsonify(job_payload(job))
+
+@app.route("/jobs/<job_id>/events", methods=["GET"])
+@auth.login_required
+def job_events(job_id):
+    job = _jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Tâche inconnue ou expirée."}), 404
+
+    def stream():
+        # Un commentaire toutes les 15 s garde la connexion ouverte jusqu'au résultat
+        while not job["finished"].wait(timeout=15):
+            yield ": en cours\n\n"
+        yield f"data: {json.dumps(job_payload(job))}\n\n"
+
+    return Response(stream(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.route("/transcribe_audio", methods=["POST"])
+@auth.login_required
+def transcribe_audio():
+    api_key = openai_api_key()
+    if not api_key and app.config['AI_BACKEND'] == 'openai':
+        return jsonify({"error": "Clé API OpenAI non configurée."}), 400
+
+    audio_file = request.files.get("audio")
+    if audio_file is None:
+        return jsonify({"error": "Aucun fichier audio reçu."}), 400
+
+    audio = take_upload(audio_file, app.config['AUDIO_MAX_BYTES'])
+    if audio is None:
+        return jsonify({"error": "Enregistrement trop volumineux."}), 413
+
+    backend = get_ai_backend()
+    mimetype = audio_file.mimetype or "audio/wav"
+
+    def transcribe():
+        # Le fichier appartient au job : on le ferme (et on libère le disque) une fois envoyé
+        with audio:
+            return {"transcription": backend.transcribe(api_key, ("audio.wav", audio, mimetype))}
+
+    job_id = submit_job(transcribe)
+    return jsonify({"job_id": job_id}), 202
+
+@app.route("/reformat_journal", methods=["POST"])
+@auth.login_required
+def reformat_journal():
+    text = request.form.get("journal_text")
+    api_key = openai_api_key()
+    if not api_key and app.config['AI_BACKEND'] == 'openai':
+        return jsonify({"error": "Aucune clé OpenAI configurée."}), 400
+
+    backend = get_ai_backend()
+    job_id = submit_job(lambda: {"formatted_text": backend.reformat(api_key, text)})
+    return jsonify({"job_id": job_id}), 202
+
 # -
 # Tables aléatoires du PDF
 
@@ -564,33 +1967,53 @@ SCENE_ADJUSTMENT_TABLE = {
 }
 
 # TABLE DE FOCUS D'ÉVÉNEMENT ALÉATOIRE (1d100)
+# Chaque entrée : (dernière valeur de la plage, résultat)
+RANDOM_EVENT_FOCUS_TABLE = [
+    (5, "Événement lointain: Votre PC attend des nouvelles de loin et le moment semble bien choisi pour le bon moment pour qu'elles arrivent."),
+    (10, "Événement ambigu: L'aventure s'est ralentie et vous et vous êtes prêt pour un mystère à poursuivre."),
+    (20, "Nouveau PNJ: Il y a une raison logique pour qu'un qu'un nouveau PNJ apparaisse dans votre dans votre aventure."),
+    (40, "Action de PNJ: Votre PC attend l'action d'un action des PNJ pour faire avancer l'aventure."),
+    (45, "PNJ négatif: Vous voulez déplacer le centre d'intérêt de votre aventure sur un PNJ en ce moment, peut-être pour développer de nouvelles nouvelles intrigues dans votre aventure."),
+    (50, "PNJ positif: Vous voulez déplacer le centre d'intérêt de votre aventure sur un PNJ en ce moment, peut-être pour développer de nouvelles nouvelles intrigues dans votre aventure."),
+    (55, "Avancer vers un fil narratif: Votre aventure est au point mort et a besoin d'un coup de pouce. Ceci est particulièrement utile pour une scène d'interruption."),
+    (65, "S'éloigner d'un fil narratif: Vous voulez un nouveau défi pour votre PC."),
+    (70, "Fermer un fil narratif: L'aventure s'est compliquée compliquée et vous voulez réduire la liste des fils de discussion."),
+    (80, "Désavantage pour le PJ: Vous voulez un nouveau défi pour votre PC."),
+    (85, "Avantage pour le PJ: Votre PC traverse une période difficile et a besoin d'une pause."),
+    (100, "Contexte actuel: La table Evénement aléatoire peut aider à expliquer le résultat d'une question sur le destin, ou un événement aléatoire peut perturber l'action en cours"),
+]
+
 def roll_random_event_focus():
-    roll = random.randint(1, 100)
-    if 1 <= roll <= 5:
-        result = "Événement lointain: Votre PC attend des nouvelles de loin et le moment semble bien choisi pour le bon moment pour qu'elles arrivent."
-    elif 6 <= roll <= 10:
-        result = "Événement ambigu: L'aventure s'est ralentie et vous et vous êtes prêt pour un mystère à poursuivre."
-    elif 11 <= roll <= 20:
-        result = "Nouveau PNJ: Il y a une raison logique pour qu'un qu'un nouveau PNJ apparaisse dans votre dans votre aventure."
-    elif 21 <= roll <= 40:
-        result = "Action de PNJ: Votre PC attend l'action d'un action des PNJ pour faire avancer l'aventure."
-    elif 41 <= roll <= 45:
-        result = "PNJ négatif: Vous voulez déplacer le centre d'intérêt de votre aventure sur un PNJ en ce moment, peut-être pour développer de nouvelles nouvelles intrigues dans votre aventure."
-    elif 46 <= roll <= 50:
-        result = "PNJ positif: Vous voulez déplacer le centre d'intérêt de votre aventure sur un PNJ en ce moment, peut-être pour développer de nouvelles nouvelles intrigues dans votre aventure."
-    elif 51 <= roll <= 55:
-        result = "Avancer vers un fil narratif: Votre aventure est au point mort et a besoin d'un coup de pouce. Ceci est particulièrement utile pour une scène d'interruption."
-    elif 56 <= roll <= 65:
-        result = "S'éloigner d'un fil narratif: Vous voulez un nouveau défi pour votre PC."
-    elif 66 <= roll <= 70:
-        result = "Fermer un fil narratif: L'aventure s'est compliquée compliquée et vous voulez réduire la liste des fils de discussion."
-    elif 71 <= roll <= 80:
-        result = "Désavantage pour le PJ: Vous voulez un nouveau défi pour votre PC."
-    elif 81 <= roll <= 85:
-        result = "Avantage pour le PJ: Votre PC traverse une période difficile et a besoin d'une pause."
-    elif 86 <= roll <= 100:
-        result = "Contexte actuel: La table Evénement aléatoire peut aider à expliquer le résultat d'une question sur le destin, ou un événement aléatoire peut perturber l'action en cours"
-    return roll, result
+    return roll_on_table("random_event_focus")
+
+# Type de ligne visée par chaque focus (texte avant « : ») ; les autres focus n'ont pas de cible
+EVENT_FOCUS_TARGETS = {
+    "Action de PNJ": "npc",
+    "PNJ négatif": "npc",
+    "PNJ positif": "npc",
+    "Avancer vers un fil narratif": "objective",
+    "S'éloigner d'un fil narratif": "objective",
+    "Fermer un fil narratif": "objective",
+    "Désavantage pour le PJ": "player",
+    "Avantage pour le PJ": "player",
+}
+
+def resolve_random_event():
+    # Toute la chaîne d'un événement aléatoire : focus, paire de sens (action, descripteur)
+    # et PNJ, objectif ou PJ visé. Le PNJ tiré est marqué vu, le commit revient à l'appelant.
+    focus_roll, focus = roll_random_event_focus()
+    action_roll, action = roll_on_table("ACTIONS")
+    descriptor_roll, descriptor = roll_on_table("DESCRIPTEURS")
+    details = {"focus_roll": focus_roll, "focus": focus,
+               "action_roll": action_roll, "action": action,
+               "descriptor_roll": descriptor_roll, "descriptor": descriptor,
+               "target": None}
+    kind = EVENT_FOCUS_TARGETS.get(focus.split(":", 1)[0])
+    if kind is not None:
+        rows = sample_npcs(1, commit=False) if kind == "npc" else SAMPLE_KINDS[kind][0](1, request.values)
+        if rows:
+            details["target"] = {"kind": kind, "id": rows[0].id, **SAMPLE_KINDS[kind][1](rows[0])}
+    return details
 
 # TABLES DE SIGNIFICATION : ACTIONS, DESCRIPTEURS, ÉLÉMENTS ...
 ACTIONS = {
@@ -822,171 +2245,382 @@ DESCRIPTEUR_MORT_VIVANT = {
     16: "Miasmatique", 17: "Putréfié", 18: "Silencieux", 19: "Squelettique", 20: "Spectral"}
 
 
+# Registre des tables intégrées.
+# Chaque table est compilée une seule fois au démarrage en un tuple indexé par (jet - 1) :
+# un tirage coûte une recherche dans un dict, un randint et un accès par index,
+# quel que soit le nombre de tables ou la forme de la table (valeurs ou plages).
+def compile_table(table):
+    if isinstance(table, dict):
+        faces = max(table)
+        return faces, tuple(table.get(roll, "Inconnu") for roll in range(1, faces + 1))
+    # Table par plages : [(dernière valeur, résultat), ...] triée par valeur croissante
+    results = []
+    for last, result in table:
+        results.extend([result] * (last - len(results)))
+    return len(results), tuple(results)
+
+ROLL_TABLES = {name: compile_table(table) for name, table in {
+    "scene_adjustment": SCENE_ADJUSTMENT_TABLE,
+    "random_event_focus": RANDOM_EVENT_FOCUS_TABLE,
+    "ACTIONS": ACTIONS,
+    "DESCRIPTEURS": DESCRIPTEURS,
+    "ELEMENT_PERSONNAGE": ELEMENT_PERSONNAGE,
+    "ELEMENT_OBJET": ELEMENT_OBJET,
+    "ACTIONS_COMBAT": ACTIONS_COMBAT,
+    "APPARENCE": APPARENCE,
+    "IDENTITE_PERSONNAGE": IDENTITE_PERSONNAGE,
+    "MOTIVATIONS": MOTIVATIONS,
+    "PERSONNALITE": PERSONNALITE,
+    "CAPACITE_PERSONNAGE": CAPACITE_PERSONNAGE,
+    "TRAITS_PERSONNAGE": TRAITS_PERSONNAGE,
+    "DEFAUTS_PERSONNAGE": DEFAUTS_PERSONNAGE,
+    "DESCRIPTEUR_CITE": DESCRIPTEUR_CITE,
+    "DESCRIPTEUR_CIVILISATION": DESCRIPTEUR_CIVILISATION,
+    "CAPACITE_CREATURE": CAPACITE_CREATURE,
+    "DESCRIPTEUR_CREATURE": DESCRIPTEUR_CREATURE,
+    "MALEDICTIONS": MALEDICTIONS,
+    "DESCRIPTEUR_DOMICILE": DESCRIPTEUR_DOMICILE,
+    "DESCRIPTEUR_DONJON": DESCRIPTEUR_DONJON,
+    "PIEGE_DONJON": PIEGE_DONJON,
+    "DESCRIPTEUR_FORET": DESCRIPTEUR_FORET,
+    "DIEUX": DIEUX,
+    "LEGENDES": LEGENDES,
+    "LIEUX": LIEUX,
+    "DESCRIPTEURS_OBJETS_MAGIQUES": DESCRIPTEURS_OBJETS_MAGIQUES,
+    "MUTATION": MUTATION,
+    "DESCRIPTEUR_NOMS": DESCRIPTEUR_NOMS,
+    "SYLLABE_NOMS": SYLLABE_NOMS,
+    "POUVOIR": POUVOIR,
+    "RÊVE": RÊVE,
+    "REBONDISSEMENT": REBONDISSEMENT,
+    "RÉSULTAT_DE_FOUILLE": RÉSULTAT_DE_FOUILLE,
+    "ODEUR": ODEUR,
+    "SONS": SONS,
+    "EFFET_DE_SORT": EFFET_DE_SORT,
+    "DESCRIPTEUR_VAISSEAU_SPATIAL": DESCRIPTEUR_VAISSEAU_SPATIAL,
+    "DESCRIPTEUR_TERRAIN": DESCRIPTEUR_TERRAIN,
+    "DESCRIPTEUR_MORT_VIVANT": DESCRIPTEUR_MORT_VIVANT,
+}.items()}
+
+def roll_on_table(name):
+    faces, results = ROLL_TABLES[name]
+    roll = roll_die(faces)
+    return roll, results[roll - 1]
+
 @app.route("/roll_table", methods=["POST"])
 @auth.login_required
 def roll_table():
     table = request.args.get("table")
-    if table == "scene_adjustment":
-        roll = random.randint(1, 10)
-        result = SCENE_ADJUSTMENT_TABLE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "random_event_focus":
-        roll, result = roll_random_event_focus()
-        return jsonify({"roll": roll, "result": result})
-    elif table == "ACTIONS":
-        roll = random.randint(1, 20)
-        result = ACTIONS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEURS":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEURS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "ELEMENT_PERSONNAGE":
-        roll = random.randint(1, 20)
-        result = ELEMENT_PERSONNAGE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "ELEMENT_OBJET":
-        roll = random.randint(1, 20)
-        result = ELEMENT_OBJET.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "ACTIONS_COMBAT":
-        roll = random.randint(1, 20)
-        result = ACTIONS_COMBAT.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "APPARENCE":
-        roll = random.randint(1, 20)
-        result = APPARENCE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "IDENTITE_PERSONNAGE":
-        roll = random.randint(1, 20)
-        result = IDENTITE_PERSONNAGE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "MOTIVATIONS":
-        roll = random.randint(1, 20)
-        result = MOTIVATIONS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "PERSONNALITE":
-        roll = random.randint(1, 20)
-        result = PERSONNALITE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "CAPACITE_PERSONNAGE":
-        roll = random.randint(1, 20)
-        result = CAPACITE_PERSONNAGE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "TRAITS_PERSONNAGE":
-        roll = random.randint(1, 20)
-        result = TRAITS_PERSONNAGE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DEFAUTS_PERSONNAGE":
-        roll = random.randint(1, 20)
-        result = DEFAUTS_PERSONNAGE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_CITE":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_CITE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_CIVILISATION":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_CIVILISATION.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "CAPACITE_CREATURE":
-        roll = random.randint(1, 20)
-        result = CAPACITE_CREATURE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_CREATURE":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_CREATURE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "MALEDICTIONS":
-        roll = random.randint(1, 20)
-        result = MALEDICTIONS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_DOMICILE":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_DOMICILE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_DONJON":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_DONJON.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "PIEGE_DONJON":
-        roll = random.randint(1, 20)
-        result = PIEGE_DONJON.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_FORET":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_FORET.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DIEUX":
-        roll = random.randint(1, 20)
-        result = DIEUX.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "LEGENDES":
-        roll = random.randint(1, 20)
-        result = LEGENDES.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "LIEUX":
-        roll = random.randint(1, 20)
-        result = LIEUX.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEURS_OBJETS_MAGIQUES":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEURS_OBJETS_MAGIQUES.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "MUTATION":
-        roll = random.randint(1, 20)
-        result = MUTATION.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_NOMS":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_NOMS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "SYLLABE_NOMS":
-        roll = random.randint(1, 20)
-        result = SYLLABE_NOMS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "POUVOIR":
-        roll = random.randint(1, 20)
-        result = POUVOIR.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "RÊVE":
-        roll = random.randint(1, 20)
-        result = RÊVE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "REBONDISSEMENT":
-        roll = random.randint(1, 20)
-        result = REBONDISSEMENT.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "RÉSULTAT_DE_FOUILLE":
-        roll = random.randint(1, 20)
-        result = RÉSULTAT_DE_FOUILLE.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "ODEUR":
-        roll = random.randint(1, 20)
-        result = ODEUR.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "SONS":
-        roll = random.randint(1, 20)
-        result = SONS.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "EFFET_DE_SORT":
-        roll = random.randint(1, 20)
-        result = EFFET_DE_SORT.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_VAISSEAU_SPATIAL":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_VAISSEAU_SPATIAL.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    elif table == "DESCRIPTEUR_TERRAIN":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_TERRAIN.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})    
-    elif table == "DESCRIPTEUR_MORT_VIVANT":
-        roll = random.randint(1, 20)
-        result = DESCRIPTEUR_MORT_VIVANT.get(roll, "Inconnu")
-        return jsonify({"roll": roll, "result": result})
-    else:
+    if table not in ROLL_TABLES:
         return jsonify({"error": "Table non définie"})
+    roll, result = roll_on_table(table)
+    return jsonify({"roll": roll, "result": result})
+
+# Tables personnelles analysées une seule fois puis gardées en cache (LRU).
+# Une ligne peut être préfixée par une plage « 1-5: valeur » (ou « 6: valeur »)
+# ou par un poids « x3: valeur » ; sans préfixe, elle a un poids de 1.
+# Le tirage est un randint sur le poids total puis une recherche dichotomique
+# dans les poids cumulés : O(log n) même pour une table de milliers de lignes.
+CUSTOM_RANGE_RE = re.compile(r"^(\d+)\s*(?:-\s*(\d+))?\s*:\s*(.+)$")
+CUSTOM_WEIGHT_RE = re.compile(r"^x(\d+)\s*:\s*(.+)$", re.IGNORECASE)
+
+class ParsedTable:
+    __slots__ = ("results", "cumulative", "total")
+
+    def __init__(self, entries):
+        self.results = []
+        self.cumulative = []
+        total = 0
+        for weight, result in entries:
+            total += weight
+            self.results.append(result)
+            self.cumulative.append(total)
+        self.total = total
+
+    def result_for(self, roll):
+        return self.results[bisect.bisect_left(self.cumulative, roll)]
+
+    def roll(self):
+        roll = roll_die(self.total)
+        return roll, self.result_for(roll)
+
+def parse_custom_table(values):
+    entries = []
+    for line in values.split("\n"):
+        line = line.strip()
+        if not line:
+            continue
+        match = CUSTOM_WEIGHT_RE.match(line)
+        if match:
+            weight, result = int(match.group(1)), match.group(2).strip()
+        else:
+            match = CUSTOM_RANGE_RE.match(line)
+            if match:
+                low = int(match.group(1))
+                high = int(match.group(2) or low)
+                weight, result = max(high - low + 1, 1), match.group(3).strip()
+            else:
+                weight, result = 1, line
+        if weight > 0:
+            entries.append((weight, result))
+    return ParsedTable(entries)
+
+_custom_table_cache = OrderedDict()
+_custom_table_cache_lock = threading.Lock()
+
+def get_parsed_custom_table(table_id):
+    # La clé inclut la campagne : une table d'une autre campagne n'est jamais servie
+    key = (current_campaign_id(), table_id)
+    with _custom_table_cache_lock:
+        parsed = _custom_table_cache.get(key)
+        if parsed is not None:
+            _custom_table_cache.move_to_end(key)
+            return parsed
+    values = (db.session.query(CustomTable.values)
+              .filter(CustomTable.campaign_id == key[0], CustomTable.id == table_id).scalar())
+    if values is None:
+        return None
+    parsed = parse_custom_table(values)
+    with _custom_table_cache_lock:
+        _custom_table_cache[key] = parsed
+        while len(_custom_table_cache) > app.config['CUSTOM_TABLE_CACHE_SIZE']:
+            _custom_table_cache.popitem(last=False)
+    return parsed
+
+def invalidate_custom_table(table_id):
+    with _custom_table_cache_lock:
+        _custom_table_cache.pop((current_campaign_id(), table_id), None)
+    invalidate_template_graphs()
+
+# Références entre tables : une valeur « Un [DESCRIPTEURS] [Peuples] qui veut [ACTIONS] »
+# est développée en tirant dans la table intégrée ou personnelle nommée (ou « [custom 12] »
+# par id). Une référence inconnue reste telle quelle. Les valeurs sont compilées une fois
+# (cache LRU) ; le graphe des tables atteignables depuis une racine est chargé niveau par
+# niveau, une requête par niveau, vérifié (références circulaires, profondeur, nombre de
+# tirages) puis gardé en cache par campagne jusqu'à la prochaine modification d'une table
+# personnelle.
+app.config['TEMPLATE_MAX_DEPTH'] = 8
+# Tirages au plus pour une requête (toutes répétitions comprises) : la profondeur seule ne
+# borne pas le travail, 20 références par valeur sur 3 niveaux font déjà 8 000 tirages
+app.config['TEMPLATE_MAX_EXPANSIONS'] = 10_000
+TEMPLATE_MAX_LENGTH = 2000  # caractères d'un modèle libre
+TEMPLATE_REF_RE = re.compile(r"\[([^\[\]]+)\]")
+
+@lru_cache(maxsize=4096)
+def compile_template(value):
+    # Tuple de morceaux : texte littéral (str) ou référence (tuple d'un nom de table)
+    parts, position = [], 0
+    for match in TEMPLATE_REF_RE.finditer(value):
+        if match.start() > position:
+            parts.append(value[position:match.start()])
+        parts.append((match.group(1).strip(),))
+        position = match.end()
+    if position < len(value):
+        parts.append(value[position:])
+    return tuple(parts)
+
+def _template_refs(parsed):
+    return {part[0] for result in parsed.results for part in compile_template(result) if not isinstance(part, str)}
+
+class TemplateGraph:
+    # tables : clé -> ParsedTable ; edges : clé -> {référence: clé visée ou None}
+    # Clés : ("custom", id), ("builtin", nom) ou ("template", texte) pour un modèle libre
+    # rolls : nombre de tirages au pire pour un développement de la racine
+    __slots__ = ("root", "tables", "edges", "rolls")
+
+    def __init__(self, root, tables, edges, rolls):
+        self.root = root
+        self.tables = tables
+        self.edges = edges
+        self.rolls = rolls
+
+    def check_count(self, count):
+        # ValueError si count développements dépasseraient TEMPLATE_MAX_EXPANSIONS tirages
+        limit = app.config['TEMPLATE_MAX_EXPANSIONS']
+        if count * self.rolls > limit:
+            raise ValueError(f"Trop de tirages ({count} × {self.rolls}, au plus {limit})")
+
+    def expand_text(self, key, value):
+        out = []
+        for part in compile_template(value):
+            if isinstance(part, str):
+                out.append(part)
+            else:
+                target = self.edges[key].get(part[0])
+                out.append(self.expand(target) if target else f"[{part[0]}]")
+        return "".join(out)
+
+    def expand(self, key=None):
+        key = key or self.root
+        if key[0] == "builtin":
+            return roll_on_table(key[1])[1]
+        parsed = self.tables[key]
+        if not parsed.total:
+            return ""
+        return self.expand_text(key, parsed.roll()[1])
+
+def _resolve_template_ref(ref, names):
+    if ref in ROLL_TABLES:
+        return ("builtin", ref)
+    custom = CUSTOM_SPEC_RE.match(ref)
+    if custom:
+        return ("custom", int(custom.group(1)))
+    return names.get(ref)
+
+def build_template_graph(root, root_table=None):
+    # None si la table racine n'existe pas ; ValueError si le graphe est circulaire ou trop profond
+    campaign_id = current_campaign_id()
+    tables, edges, names = {}, {}, {}
+    labels = {root: "modèle"}
+    if root_table is not None:
+        tables[root] = root_table
+        loaded, load_ids = [root], set()
+    else:
+        loaded, load_ids = [], {root[1]}
+    load_names = set()
+    while True:
+        if load_ids or load_names:
+            # Toutes les tables personnelles du niveau en une requête
+            rows = (db.session.query(CustomTable.id, CustomTable.name, CustomTable.values)
+                    .filter(CustomTable.campaign_id == campaign_id,
+                            or_(CustomTable.id.in_(load_ids), CustomTable.name.in_(load_names)))
+                    .order_by(CustomTable.id).all())
+            for table_id, name, values in rows:
+                key = ("custom", table_id)
+                if names.get(name.strip()) is None:
+                    names[name.strip()] = key
+                if key not in tables:
+                    tables[key] = parse_custom_table(values)
+                    labels[key] = name
+                    loaded.append(key)
+        load_ids, load_names = set(), set()
+        for key in loaded:
+            edges[key] = {}
+            for ref in _template_refs(tables[key]):
+                target = _resolve_template_ref(ref, names)
+                edges[key][ref] = target
+                if target is None and ref not in names:
+                    load_names.add(ref)
+                elif target is not None and target[0] == "custom" and target not in tables:
+                    load_ids.add(target[1])
+        loaded = []
+        if not load_ids and not load_names:
+            break
+        # Les noms inconnus de ce niveau ne sont cherchés qu'une fois
+        for ref in load_names:
+            names.setdefault(ref, None)
+    if root not in tables:
+        return None
+    # Un nom n'est connu qu'une fois son niveau chargé : on résout les références à la fin
+    for targets in edges.values():
+        for ref in targets:
+            target = _resolve_template_ref(ref, names)
+            targets[ref] = target if target is None or target[0] == "builtin" or target in tables else None
+
+    max_depth = app.config['TEMPLATE_MAX_DEPTH']
+    max_rolls = app.config['TEMPLATE_MAX_EXPANSIONS']
+    heights, rolls = {}, {}
+
+    def result_rolls(key, result, path):
+        # Tirages pour développer une valeur : chaque référence compte autant de fois qu'elle apparaît
+        total = 0
+        for part in compile_template(result):
+            target = None if isinstance(part, str) else edges[key].get(part[0])
+            if target is not None:
+                total += 1 if target[0] == "builtin" else height(target, path)[1]
+        return total
+
+    def height(key, path):
+        # (niveaux sous key, key compris ; tirages au pire pour un développement de key),
+        # mémorisés : une table atteinte par plusieurs chemins n'est parcourue qu'une fois,
+        # mais sa hauteur compte pour chacun d'eux
+        if key in path:
+            cycle = path[path.index(key):] + [key]
+            raise ValueError("Référence circulaire : " + " → ".join(labels[k] for k in cycle))
+        if key not in heights:
+            if len(path) >= max_depth:
+                raise ValueError(f"Références trop imbriquées (au plus {max_depth} niveaux)")
+            path.append(key)
+            heights[key] = 1 + max((height(target, path)[0] for target in edges[key].values()
+                                    if target is not None and target[0] != "builtin"), default=0)
+            rolls[key] = 1 + max((result_rolls(key, result, path) for result in set(tables[key].results)), default=0)
+            path.pop()
+            if rolls[key] > max_rolls:
+                raise ValueError(f"Références trop nombreuses (plus de {max_rolls} tirages)")
+        if len(path) + heights[key] > max_depth:
+            raise ValueError(f"Références trop imbriquées (au plus {max_depth} niveaux)")
+        return heights[key], rolls[key]
+
+    return TemplateGraph(root, tables, edges, height(root, [])[1])
+
+_template_graph_cache = OrderedDict()
+_template_graph_lock = threading.Lock()
+
+def get_template_graph(root, root_table=None):
+    key = (current_campaign_id(), root)
+    with _template_graph_lock:
+        graph = _template_graph_cache.get(key)
+        if graph is not None:
+            _template_graph_cache.move_to_end(key)
+            return graph
+    graph = build_template_graph(root, root_table)
+    if graph is None:
+        return None
+    with _template_graph_lock:
+        _template_graph_cache[key] = graph
+        while len(_template_graph_cache) > app.config['CUSTOM_TABLE_CACHE_SIZE']:
+            _template_graph_cache.popitem(last=False)
+    return graph
+
+def invalidate_template_graphs():
+    # Une table ajoutée, renommée ou modifiée peut changer n'importe quel graphe de la campagne
+    campaign_id = current_campaign_id()
+    with _template_graph_lock:
+        for key in [key for key in _template_graph_cache if key[0] == campaign_id]:
+            del _template_graph_cache[key]
+
+@app.route("/roll_custom_table/<int:table_id>", methods=["POST"])
+@auth.login_required
+def roll_custom_table(table_id):
+    parsed = get_parsed_custom_table(table_id)
+    if parsed is None:
+        return jsonify({"error": "Table non trouvée"}), 404
+    if not parsed.total:
+        return jsonify({"error": "La table est vide."}), 400
+    roll, result = parsed.roll()
+    if any(not isinstance(part, str) for part in compile_template(result)):
+        try:
+            graph = get_template_graph(("custom", table_id))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        result = graph.expand_text(graph.root, result)
+    return jsonify({"roll": roll, "result": result, "total": parsed.total})
+
+@app.route("/expand_template", methods=["POST"])
+@auth.login_required
+def expand_template():
+    # Développe une table personnelle (table_id) ou un modèle libre (template), count fois
+    count = request.values.get("count", 1, type=int)
+    if count < 1 or count > app.config['BATCH_ROLL_MAX']:
+        return jsonify({"error": f"Nombre de tirages invalide (1 à {app.config['BATCH_ROLL_MAX']})"}), 400
+    table_id = request.values.get("table_id", type=int)
+    template = (request.values.get("template") or "").strip()
+    if len(template) > TEMPLATE_MAX_LENGTH:
+        return jsonify({"error": f"Modèle trop long (au plus {TEMPLATE_MAX_LENGTH} caractères)"}), 400
+    try:
+        if table_id is not None:
+            graph = get_template_graph(("custom", table_id))
+        elif template:
+            graph = get_template_graph(("template", template), ParsedTable([(1, template)]))
+        else:
+            return jsonify({"error": "Indiquez une table ou un modèle."}), 400
+        if graph is not None:
+            graph.check_count(count)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if graph is None:
+        return jsonify({"error": "Table non trouvée"}), 404
+    return jsonify({"results": [graph.expand() for _ in range(count)]})
 
 @app.route("/add_custom_table", methods=["POST"])
 @auth.login_required
@@ -997,31 +2631,40 @@ def add_custom_table():
         new_table = CustomTable(name=name, values=values)
         db.session.add(new_table)
         db.session.commit()
+        invalidate_template_graphs()
+        return jsonify({"success": True,
+                        "id": new_table.id,
+                        "table": {"id": new_table.id, "name": new_table.name},
+                        "html": render_fragment("custom_table_card", new_table)}), 200
     return jsonify({"success": True}), 200
 
 @app.route("/delete_custom_table/<int:table_id>", methods=["POST"])
 @auth.login_required
 def delete_custom_table(table_id):
-    table = CustomTable.query.get_or_404(table_id)
+    table = get_scoped_or_404(CustomTable, table_id)
     db.session.delete(table)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    invalidate_custom_table(table_id)
+    return jsonify({"success": True, "id": table_id}), 200
 
 @app.route("/edit_custom_table/<int:table_id>", methods=["POST"])
 @auth.login_required
 def edit_custom_table(table_id):
     print('edit !')
-    table = CustomTable.query.get_or_404(table_id)
+    table = get_scoped_or_404(CustomTable, table_id)
     table.name = request.form.get("customTableNameEdit").strip()
     table.values = request.form.get("customTableValuesEdit").strip()
     db.session.commit()
-    return jsonify({"success": True}), 200
+    invalidate_custom_table(table_id)
+    return jsonify({"success": True,
+                    "id": table.id,
+                    "table": {"id": table.id, "name": table.name},
+                    "html": render_fragment("custom_table_card", table)}), 200
 
 @app.route("/get_custom_table", methods=["POST"])
 @auth.login_required
 def get_custom_table():
-    table_id = request.args.get("table_id")
-    table = CustomTable.query.get(table_id)
+    table = scoped(CustomTable).filter(CustomTable.id == request.args.get("table_id", type=int)).first()
     if table:
         return jsonify({"values": table.values})
     else:
@@ -1036,22 +2679,23 @@ def add_player():
         new_player = PlayerCharacter(name=name, description=description)
         db.session.add(new_player)
         db.session.commit()
+        return jsonify({"success": True, "id": new_player.id, "html": render_fragment("player_block", new_player)}), 200
     return jsonify({"success": True}), 200
 
 @app.route("/delete_player/<int:player_id>", methods=["POST"])
 @auth.login_required
 def delete_player(player_id):
     print('elete')
-    player = PlayerCharacter.query.get_or_404(player_id)
+    player = get_scoped_or_404(PlayerCharacter, player_id)
     db.session.delete(player)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": player_id}), 200
 
 @app.route("/add_player_attribute/<int:player_id>", methods=["POST"])
 @auth.login_required
 def add_player_attribute(player_id):
-    attr_name = request.form.get("attribute_name").strip()
-    attr_value = request.form.get("attribute_value").strip()
+    attr_name = (request.form.get("attribute_name") or "").strip()
+    attr_value = (request.form.get("attribute_value") or "").strip()
     is_numeric = request.form.get("is_numeric") == "on"  # True si coché
 
     # Vérification côté serveur
@@ -1059,31 +2703,35 @@ def add_player_attribute(player_id):
         try:
             int(attr_value)  # Essayer de convertir en entier
         except ValueError:
-            flash("⚠️ La valeur doit être un nombre si 'Numérique' est coché.", "danger")
-            return redirect(url_for("index") + "#players")
+            return jsonify({"error": "⚠️ La valeur doit être un nombre si 'Numérique' est coché."}), 400
+    get_scoped_or_404(PlayerCharacter, player_id)
 
     new_attr = PlayerAttribute(
         character_id=player_id,
         attribute_name=attr_name,
         attribute_value=attr_value,
-        is_numeric=is_numeric
+        is_numeric=is_numeric,
+        numeric_value=int(attr_value) if is_numeric else None
     )
     db.session.add(new_attr)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True,
+                    "id": new_attr.id,
+                    "player_id": player_id,
+                    "html": render_fragment("attribute_item", new_attr)}), 200
 
 @app.route("/delete_player_attribute/<int:attribute_id>", methods=["POST"])
 @auth.login_required
 def delete_player_attribute(attribute_id):
-    attribute = PlayerAttribute.query.get_or_404(attribute_id)
+    attribute = get_scoped_or_404(PlayerAttribute, attribute_id)
     db.session.delete(attribute)
     db.session.commit()
-    return jsonify({"success": True}), 200
+    return jsonify({"success": True, "id": attribute_id}), 200
 
 @app.route("/edit_player_description/<int:player_id>", methods=["POST"])
 @auth.login_required
 def edit_player_description(player_id):
-    player = PlayerCharacter.query.get_or_404(player_id)
+    player = get_scoped_or_404(PlayerCharacter, player_id)
     player.description = request.form.get("description").strip()
     db.session.commit()
     return jsonify({"success": True}), 200
@@ -1092,34 +2740,437 @@ def edit_player_description(player_id):
 @auth.login_required
 def update_chaos():
     adjustment = int(request.form.get("adjustment"))
-    game_state = GameState.query.first()
-    game_state.chaos_factor = max(1, min(9, game_state.chaos_factor + adjustment))
-    db.session.commit()
-    return jsonify({"new_chaos": game_state.chaos_factor})
+    chaos_factor = adjust_chaos_factor(adjustment)
+    publish_event("chaos", {"chaos": chaos_factor})
+    return jsonify({"new_chaos": chaos_factor})
 
 @app.route("/roll_dice/<int:faces>", methods=["POST"])
 @auth.login_required
 def roll_dice(faces):
     if faces < 1:
         return jsonify({"error": "Nombre de faces invalide"}), 400
-    roll = random.randint(1, faces)
+    roll, seed = roll_die_with_seed(faces)
     # Sauvegarder le lancer dans la base SQL
-    new_roll = DiceRollHistory(faces=faces, roll=roll)
-    db.session.add(new_roll)
+    new_roll = append_row(DiceRollHistory, faces=faces, roll=roll, seed=seed, date=datetime.utcnow())
+    publish_event("dice", {"rolls": [{"id": new_roll.id, "faces": faces, "roll": roll}]})
+    return jsonify({"roll": roll, "faces": faces, "id": new_roll.id})
+
+# Lancer groupé : plusieurs jets en une seule requête.
+# Formats acceptés : "4d6", "d20", "10x ACTIONS", "3x custom 12" (id d'une table personnelle)
+DICE_SPEC_RE = re.compile(r"^(\d*)\s*d\s*(\d+)$", re.IGNORECASE)
+TABLE_SPEC_RE = re.compile(r"^(\d+)\s*x\s*(.+)$", re.IGNORECASE)
+CUSTOM_SPEC_RE = re.compile(r"^custom(?:\s+table)?\s+(\d+)$", re.IGNORECASE)
+
+def parse_roll_spec(spec):
+    spec = (spec or "").strip()
+    match = DICE_SPEC_RE.match(spec)
+    if match:
+        count = int(match.group(1) or 1)
+        faces = int(match.group(2))
+        if faces < 1:
+            raise ValueError("Nombre de faces invalide")
+        return "dice", count, faces
+    match = TABLE_SPEC_RE.match(spec)
+    if not match:
+        raise ValueError("Format de lancer non reconnu")
+    count = int(match.group(1))
+    target = match.group(2).strip()
+    custom = CUSTOM_SPEC_RE.match(target)
+    if custom:
+        return "custom", count, int(custom.group(1))
+    if target not in ROLL_TABLES:
+        raise ValueError("Table non définie")
+    return "table", count, target
+
+@app.route("/roll_batch", methods=["POST"])
+@auth.login_required
+def roll_batch():
+    spec = request.form.get("spec") or request.args.get("spec")
+    try:
+        kind, count, target = parse_roll_spec(spec)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    if count < 1 or count > app.config['BATCH_ROLL_MAX']:
+        return jsonify({"error": f"Nombre de jets invalide (1 à {app.config['BATCH_ROLL_MAX']})"}), 400
+
+    if kind == "dice":
+        rolls, seeds = roll_dice_many(target, count, with_seeds=True)
+        # Un seul INSERT groupé pour tout l'historique
+        ids = db.session.execute(
+            insert(DiceRollHistory).returning(DiceRollHistory.id, sort_by_parameter_order=True),
+            [{"faces": target, "roll": roll, "seed": seed} for roll, seed in zip(rolls, seeds or [None] * count)]
+        ).scalars().all()
+        db.session.commit()
+        note_writes(DiceRollHistory.__tablename__, current_campaign_id(), count)
+        # Seuls les derniers jets s'affichent dans l'historique des autres onglets
+        publish_event("dice", {"rolls": [{"id": roll_id, "faces": target, "roll": roll}
+                                         for roll_id, roll in zip(ids[-DICE_HISTORY_SIZE:], rolls[-DICE_HISTORY_SIZE:])]})
+        return jsonify({"spec": spec, "faces": target, "rolls": rolls, "total": sum(rolls)})
+
+    if kind == "table":
+        faces, results = ROLL_TABLES[target]
+        rolls, _ = roll_dice_many(faces, count)
+        return jsonify({"spec": spec, "results": [{"roll": roll, "result": results[roll - 1]} for roll in rolls]})
+
+    parsed = get_parsed_custom_table(target)
+    if parsed is None:
+        return jsonify({"error": "Table non trouvée"}), 404
+    if not parsed.total:
+        return jsonify({"error": "La table est vide."}), 400
+    rolls, _ = roll_dice_many(parsed.total, count)
+    results = [parsed.result_for(roll) for roll in rolls]
+    # Références [TABLE] développées comme dans roll_custom_table, avec un seul graphe
+    if any(not isinstance(part, str) for result in set(results) for part in compile_template(result)):
+        try:
+            graph = get_template_graph(("custom", target))
+            graph.check_count(count)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        results = [graph.expand_text(graph.root, result) for result in results]
+    return jsonify({"spec": spec, "results": [{"roll": roll, "result": result} for roll, result in zip(rolls, results)]})
+
+# Expressions de dés : « 3d6+2 », « 4d6kh3 » (garder les 3 meilleurs, kl pour les pires),
+# « d10! » (un dé au maximum est relancé et ajouté), « 6d10>=8 » (réserve : nombre de dés
+# à 8 ou plus). Modificateurs dans cet ordre : !, kh/kl, >=. Une expression est analysée une
+# fois (cache LRU) ; les répétitions tirent tous leurs dés d'un coup dans le flux de la
+# campagne. La distribution exacte se calcule par convolution, en cache par expression.
+DICE_EXPRESSION_MAX_DICE = 100
+DICE_MAX_FACES = 10_000
+DICE_EXPRESSION_MAX_TERMS = 20
+DICE_EXPLODE_MAX = 5  # relances au plus par dé explosif
+DICE_DISTRIBUTION_MAX_WORK = 5_000_000  # produits au plus pour une distribution exacte
+DICE_TERM_RE = re.compile(r"([+-]?)(?:(\d*)d(\d+|%)(!?)(?:k([hl])(\d*))?(?:(>=?)(\d+))?|(\d+))")
+
+class DiceTerm:
+    # Un terme de l'expression : des dés ou une constante (faces = 0, count = valeur)
+    __slots__ = ("sign", "count", "faces", "explode", "keep", "keep_highest", "target")
+
+    def __init__(self, sign, count, faces=0, explode=False, keep=None, keep_highest=True, target=None):
+        self.sign = sign
+        self.count = count
+        self.faces = faces
+        self.explode = explode
+        self.keep = keep
+        self.keep_highest = keep_highest
+        self.target = target
+
+    def __str__(self):
+        text = "-" if self.sign < 0 else "+"
+        if not self.faces:
+            return text + str(self.count)
+        text += f"{self.count}d{self.faces}" + ("!" if self.explode else "")
+        if self.keep is not None:
+            text += ("kh" if self.keep_highest else "kl") + str(self.keep)
+        if self.target is not None:
+            text += f">={self.target}"
+        return text
+
+    def score(self, values):
+        if self.keep is not None:
+            values = sorted(values, reverse=self.keep_highest)[:self.keep]
+        if self.target is not None:
+            return sum(1 for value in values if value >= self.target)
+        return sum(values)
+
+@lru_cache(maxsize=256)
+def parse_dice_expression(expression):
+    # (termes, forme canonique) ; ValueError si l'expression est invalide
+    # Espaces permis autour de + et - seulement : « 3d6 2 » reste invalide
+    source = re.sub(r"\s*([+-])\s*", r"\1", (expression or "").strip()).lower()
+    if not source:
+        raise ValueError("Expression vide")
+    terms, position = [], 0
+    while position < len(source):
+        match = DICE_TERM_RE.match(source, position)
+        if not match or match.end() == position or (position and not match.group(1)):
+            raise ValueError(f"Expression non reconnue près de « {source[position:]} »")
+        position = match.end()
+        sign = -1 if match.group(1) == "-" else 1
+        if match.group(9) is not None:
+            terms.append(DiceTerm(sign, int(match.group(9))))
+            continue
+        count = int(match.group(2) or 1)
+        faces = 100 if match.group(3) == "%" else int(match.group(3))
+        term = DiceTerm(sign, count, faces, explode=bool(match.group(4)))
+        if count < 1 or faces < 1:
+            raise ValueError("Nombre de dés ou de faces invalide")
+        if faces > DICE_MAX_FACES:
+            raise ValueError(f"Trop de faces (au plus {DICE_MAX_FACES})")
+        if term.explode and faces < 2:
+            raise ValueError("Un dé explosif a au moins deux faces")
+        if match.group(5):
+            term.keep = int(match.group(6) or 1)
+            term.keep_highest = match.group(5) == "h"
+            if not 1 <= term.keep <= count:
+                raise ValueError("Nombre de dés gardés invalide")
+        if match.group(7):
+            term.target = int(match.group(8)) + (1 if match.group(7) == ">" else 0)
+        terms.append(term)
+    if len(terms) > DICE_EXPRESSION_MAX_TERMS:
+        raise ValueError(f"Trop de termes (au plus {DICE_EXPRESSION_MAX_TERMS})")
+    if sum(term.count for term in terms if term.faces) > DICE_EXPRESSION_MAX_DICE:
+        raise ValueError(f"Trop de dés (au plus {DICE_EXPRESSION_MAX_DICE})")
+    canonical = "".join(str(term) for term in terms)
+    return tuple(terms), canonical[1:] if canonical.startswith("+") else canonical
+
+def _explode(values, faces):
+    # Relance groupée des dés au maximum, jusqu'à DICE_EXPLODE_MAX fois
+    pending = [i for i, value in enumerate(values) if value == faces]
+    for _ in range(DICE_EXPLODE_MAX):
+        if not pending:
+            break
+        extra, _ = roll_dice_many(faces, len(pending))
+        values_pending = []
+        for i, value in zip(pending, extra):
+            values[i] += value
+            if value == faces:
+                values_pending.append(i)
+        pending = values_pending
+
+def roll_expression(terms, repeat=1):
+    # (totaux, dés de chaque répétition par terme de dés)
+    totals = [0] * repeat
+    dice = [[] for _ in range(repeat)]
+    for term in terms:
+        if not term.faces:
+            totals = [total + term.sign * term.count for total in totals]
+            continue
+        values, _ = roll_dice_many(term.faces, term.count * repeat)
+        if term.explode:
+            _explode(values, term.faces)
+        for i in range(repeat):
+            chunk = values[i * term.count:(i + 1) * term.count]
+            dice[i].append(chunk)
+            totals[i] += term.sign * term.score(chunk)
+    return totals, dice
+
+# Distributions : (valeur minimale, [probabilité de chaque valeur à partir du minimum])
+def _charge(budget, work):
+    budget[0] -= work
+    if budget[0] < 0:
+        raise ValueError("Expression trop lourde pour une distribution exacte")
+
+def _convolve(a, b, budget):
+    (offset_a, probs_a), (offset_b, probs_b) = a, b
+    _charge(budget, len(probs_a) * len(probs_b))
+    out = [0.0] * (len(probs_a) + len(probs_b) - 1)
+    for i, p in enumerate(probs_a):
+        if p:
+            for j, q in enumerate(probs_b):
+                out[i + j] += p * q
+    return offset_a + offset_b, out
+
+def _die_distribution(term, budget):
+    # Taille de la liste comptée avant de la construire
+    faces = term.faces
+    _charge(budget, faces * (DICE_EXPLODE_MAX + 1 if term.explode else 1))
+    if not term.explode:
+        return 1, [1.0 / faces] * faces
+    # k relances : valeur k * faces + r (r < faces), sauf à la dernière où le maximum reste
+    probs = []
+    for k in range(DICE_EXPLODE_MAX + 1):
+        p = faces ** -(k + 1)
+        probs.extend([p] * (faces - 1))
+        probs.append(p if k == DICE_EXPLODE_MAX else 0.0)
+    return 1, probs
+
+def _scored(term, die):
+    # Distribution du score d'un dé : sa valeur, ou 1 s'il atteint la cible
+    offset, probs = die
+    if term.target is None:
+        return die
+    success = sum(p for i, p in enumerate(probs) if offset + i >= term.target)
+    return 0, [1.0 - success, success]
+
+def _keep_distribution(term, die, budget):
+    # Statistiques d'ordre : on parcourt les valeurs du dé de la meilleure à la pire (kh) ;
+    # à chaque valeur, c dés parmi les restants y tombent (loi binomiale conditionnelle),
+    # les premiers gardés ajoutent leur score. Un état est fini dès que keep dés sont gardés.
+    offset, probs = die
+    values = [(offset + i, p) for i, p in enumerate(probs) if p]
+    if term.keep_highest:
+        values.reverse()
+    states = {(0, 0): 1.0}
+    final = {}
+    tail = 1.0
+    for index, (value, p) in enumerate(values):
+        score = (1 if value >= term.target else 0) if term.target is not None else value
+        # Probabilité de tomber sur cette valeur sachant qu'on n'est sur aucune des précédentes
+        q = 1.0 if index == len(values) - 1 else min(1.0, p / tail)
+        tail -= p
+        next_states = {}
+        for (taken, total), prob in states.items():
+            remaining = term.count - taken
+            _charge(budget, remaining + 1)
+            for c in range(remaining + 1):
+                weight = prob * math.comb(remaining, c) * q ** c * (1 - q) ** (remaining - c)
+                if not weight:
+                    continue
+                kept = min(c, term.keep - taken)
+                key = (taken + c, total + kept * score)
+                if key[0] >= term.keep:
+                    final[key[1]] = final.get(key[1], 0.0) + weight
+                else:
+                    next_states[key] = next_states.get(key, 0.0) + weight
+        states = next_states
+    low = min(final)
+    probs = [0.0] * (max(final) - low + 1)
+    for total, prob in final.items():
+        probs[total - low] = prob
+    return low, probs
+
+def _term_distribution(term, budget):
+    if not term.faces:
+        distribution = (term.count, [1.0])
+    elif term.keep is not None:
+        distribution = _keep_distribution(term, _die_distribution(term, budget), budget)
+    else:
+        single = _scored(term, _die_distribution(term, budget))
+        distribution = single
+        for _ in range(term.count - 1):
+            distribution = _convolve(distribution, single, budget)
+    if term.sign < 0:
+        offset, probs = distribution
+        distribution = (-(offset + len(probs) - 1), probs[::-1])
+    return distribution
+
+@lru_cache(maxsize=128)
+def dice_distribution(canonical):
+    # Distribution exacte du total : [(valeur, probabilité, probabilité d'au moins cette valeur)]
+    terms, _ = parse_dice_expression(canonical)
+    budget = [DICE_DISTRIBUTION_MAX_WORK]
+    distribution = (0, [1.0])
+    for term in terms:
+        distribution = _convolve(distribution, _term_distribution(term, budget), budget)
+    offset, probs = distribution
+    rows, at_least = [], 1.0
+    for i, p in enumerate(probs):
+        if p > 1e-12:
+            rows.append((offset + i, p, max(at_least, 0.0)))
+        at_least -= p
+    return tuple(rows)
+
+@app.route("/roll_expression", methods=["POST"])
+@auth.login_required
+def roll_expression_route():
+    try:
+        terms, canonical = parse_dice_expression(request.values.get("expression", ""))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    repeat = request.values.get("repeat", 1, type=int)
+    if repeat < 1 or repeat > app.config['BATCH_ROLL_MAX']:
+        return jsonify({"error": f"Nombre de répétitions invalide (1 à {app.config['BATCH_ROLL_MAX']})"}), 400
+    totals, dice = roll_expression(terms, repeat)
+    faces = max((term.faces for term in terms), default=0)
+    ids = db.session.execute(
+        insert(DiceRollHistory).returning(DiceRollHistory.id, sort_by_parameter_order=True),
+        [{"faces": faces, "roll": total, "expression": canonical} for total in totals]
+    ).scalars().all()
     db.session.commit()
-    return jsonify({"roll": roll, "faces": faces})
+    note_writes(DiceRollHistory.__tablename__, current_campaign_id(), repeat)
+    publish_event("dice", {"rolls": [{"id": roll_id, "faces": faces, "roll": total, "expression": canonical}
+                                     for roll_id, total in zip(ids[-DICE_HISTORY_SIZE:], totals[-DICE_HISTORY_SIZE:])]})
+    return jsonify({"expression": canonical, "totals": totals, "dice": dice})
+
+@app.route("/dice_distribution", methods=["GET", "POST"])
+@auth.login_required
+def dice_distribution_route():
+    try:
+        _, canonical = parse_dice_expression(request.values.get("expression", ""))
+        rows = dice_distribution(canonical)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    mean = sum(total * p for total, p, _ in rows)
+    return jsonify({"expression": canonical,
+                    "mean": mean,
+                    "min": rows[0][0],
+                    "max": rows[-1][0],
+                    "distribution": [{"total": total, "p": p, "at_least": at_least} for total, p, at_least in rows]})
 
 @app.route("/dice_history", methods=["POST"])
 @auth.login_required
 def dice_history():
-    history = DiceRollHistory.query.order_by(DiceRollHistory.date.desc()).limit(10).all()
+    # Les lancers sont insérés dans l'ordre chronologique : l'id suffit comme curseur
+    query = scoped(DiceRollHistory)
+    before_id = request.values.get("before_id", type=int)
+    if before_id is not None:
+        query = query.filter(DiceRollHistory.id < before_id)
+    history = query.order_by(DiceRollHistory.id.desc()).limit(_page_limit(DICE_HISTORY_SIZE)).all()
     # On prépare une liste de dictionnaires pour le JSON
     history_list = [{
         "date": entry.date.strftime("%Y-%m-%d %H:%M:%S"),
+        "id": entry.id,
         "faces": entry.faces,
-        "roll": entry.roll
+        "roll": entry.roll,
+        "expression": entry.expression
     } for entry in history]
     return jsonify(history_list)
 
+# Statistiques complètes : compteurs archivés (roll_stats) + lignes encore présentes
+ROLL_STATS_LIVE_SQL = {
+    "dice": "SELECT coalesce(expression, 'd' || faces) || ':' || roll, count(*) FROM dice_roll_history "
+            "WHERE campaign_id = :campaign_id GROUP BY 1",
+    "fate": "SELECT odds || ':' || answer, count(*) FROM fate_question "
+            "WHERE campaign_id = :campaign_id GROUP BY odds, answer",
+    "fate_event": "SELECT odds, count(*) FROM fate_question "
+                  "WHERE campaign_id = :campaign_id AND random_event GROUP BY odds",
+}
+
+@app.route("/roll_stats", methods=["GET", "POST"])
+@auth.login_required
+def roll_stats():
+    campaign_id = current_campaign_id()
+    stats = {kind: Counter() for kind in ROLL_STATS_LIVE_SQL}
+    for row in scoped(RollStats).all():
+        stats[row.kind][row.key] += row.count
+    for kind, sql in ROLL_STATS_LIVE_SQL.items():
+        for key, count in db.session.execute(text(sql), {"campaign_id": campaign_id}):
+            stats[kind][key] += count
+    return jsonify({kind: dict(counts) for kind, counts in stats.items()})
+
+# Vérifie un jet enregistré en le rejouant depuis sa graine
+@app.route("/audit_roll/<int:roll_id>", methods=["GET", "POST"])
+@auth.login_required
+def audit_roll(roll_id):
+    # Un jet sorti par compact_campaign se vérifie depuis l'archive
+    entry = scoped(DiceRollHistory).filter_by(id=roll_id).first() or db.session.execute(
+        dice_roll_history_archive.select().where(dice_roll_history_archive.c.id == roll_id,
+                                                 dice_roll_history_archive.c.campaign_id == current_campaign_id())
+    ).first()
+    if entry is None:
+        abort(404)
+    if not entry.seed:
+        return jsonify({"error": "Ce jet n'a pas de graine enregistrée."}), 404
+    replayed = replay_roll(entry.faces, entry.seed)
+    return jsonify({"id": entry.id, "faces": entry.faces, "roll": entry.roll,
+                    "replayed": replayed, "valid": replayed == entry.roll})
+
+# Fabrique de l'application.
+# Les routes sont déclarées sur `app`, il n'y a donc qu'une application par processus :
+# create_app applique les réglages, relie la base et la prépare (init_db), une seule fois.
+# Un serveur de production l'appelle au chargement (wsgi.py) ; avec preload_app, le
+# processus maître le fait avant de créer les workers, qui appellent dispose_engines
+# pour ne pas partager les connexions ouvertes par le maître (voir gunicorn.conf.py).
+_app_lock = threading.Lock()
+
+def create_app(config=None):
+    with _app_lock:
+        if "sqlalchemy" in app.extensions:
+            return app
+        if config:
+            app.config.update(config)
+        reset_roll_engine(app.config['RNG_SEED'])
+        db.init_app(app)
+        with app.app_context():
+            init_db()
+    return app
+
+def dispose_engines():
+    # Après un fork : le pool hérité est abandonné sans fermer les connexions du parent
+    with app.app_context():
+        for engine in db.engines.values():
+            engine.dispose(close=False)
+
 if __name__ == "__main__":
-    app.run(debug=False, port=5345)
+    # Serveur de développement ; en production, voir wsgi.py et gunicorn.conf.py
+    create_app().run(debug=False, port=5345)
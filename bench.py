@@ -0,0 +1,247 @@
+"""Petits benchmarks du Compagnon Mythic GME.
+
+Lancer avec :
+    python bench.py
+Les résultats s'affichent dans la console (rediriger vers bench_output.txt si besoin).
+Les mesures utilisent une base temporaire, jamais celle de l'application.
+"""
+import base64
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+_bench_dir = tempfile.mkdtemp(prefix="mythic-bench-")
+os.environ.setdefault("MYTHIC_DATABASE_URI", "sqlite:///" + os.path.join(_bench_dir, "bench.db"))
+
+from app import (app, db, RollStream, FATE_ODDS, CHAOS_MAX, fate_outcome, _fate_check_reference,
+                 parse_dice_expression, roll_expression, dice_distribution, create_app)
+
+create_app()
+
+AUTH_HEADERS = {"Authorization": "Basic " + base64.b64encode(b"admin:motdepasse").decode("ascii")}
+
+
+def requests_per_second(client, method, url, n=200, **kwargs):
+    # Une requête de chauffe pour ne pas mesurer l'initialisation
+    getattr(client, method)(url, headers=AUTH_HEADERS, **kwargs)
+    start = time.perf_counter()
+    for _ in range(n):
+        response = getattr(client, method)(url, headers=AUTH_HEADERS, **kwargs)
+        assert response.status_code == 200, response.status_code
+    return n / (time.perf_counter() - start)
+
+
+def bench_auth_cache():
+    client = app.test_client()
+    previous_ttl = app.config['AUTH_CACHE_TTL']
+
+    app.config['AUTH_CACHE_TTL'] = 0
+    without_cache = requests_per_second(client, "post", "/roll_d100", n=50)
+
+    app.config['AUTH_CACHE_TTL'] = previous_ttl or 300
+    with_cache = requests_per_second(client, "post", "/roll_d100", n=2000)
+
+    app.config['AUTH_CACHE_TTL'] = previous_ttl
+    print(f"/roll_d100 sans cache d'authentification : {without_cache:8.1f} req/s")
+    print(f"/roll_d100 avec cache d'authentification : {with_cache:8.1f} req/s")
+
+
+def concurrent_writes_per_second(clients, writes_per_client, url="/roll_dice/20"):
+    # Chaque client a son thread et son test_client ; on mesure le débit total
+    errors = []
+    barrier = threading.Barrier(clients + 1)
+
+    def worker():
+        client = app.test_client()
+        barrier.wait()
+        for _ in range(writes_per_client):
+            response = client.post(url, headers=AUTH_HEADERS)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert not errors, errors
+    return clients * writes_per_client / elapsed
+
+
+def bench_concurrent_writes(clients=8, writes_per_client=100):
+    previous = app.config['SQLITE_PROFILE'], app.config['GROUP_COMMIT']
+    for profile, group_commit in (("safe", False), ("wal", False), ("wal", True)):
+        app.config['SQLITE_PROFILE'] = profile
+        app.config['GROUP_COMMIT'] = group_commit
+        with app.app_context():
+            # Les pragmas sont appliqués à la connexion : on repart d'un pool vide
+            db.engine.dispose()
+        rate = concurrent_writes_per_second(clients, writes_per_client)
+        label = f"{profile}{' + commit groupé' if group_commit else ''}"
+        print(f"/roll_dice, {clients} clients, profil {label:<20} : {rate:8.1f} écritures/s")
+    app.config['SQLITE_PROFILE'], app.config['GROUP_COMMIT'] = previous
+
+
+def bench_roll_engine(n=1_000_000):
+    start = time.perf_counter()
+    for _ in range(n):
+        random.randint(1, 100)
+    global_random = n / (time.perf_counter() - start)
+
+    stream = RollStream(seed="bench")
+    start = time.perf_counter()
+    for _ in range(n):
+        stream.roll(100)
+    buffered = n / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    stream.rolls(100, n)
+    bulk = n / (time.perf_counter() - start)
+    print(f"d100 random.randint            : {global_random / 1e6:6.2f} M jets/s")
+    print(f"d100 RollStream.roll (tampon)  : {buffered / 1e6:6.2f} M jets/s")
+    print(f"d100 RollStream.rolls (en bloc): {bulk / 1e6:6.2f} M jets/s")
+
+
+def bench_fate_check(n=300_000):
+    rolls = [random.randint(1, 100) for _ in range(n)]
+    odds = list(FATE_ODDS)
+    cases = [(odds[i % len(odds)], i % CHAOS_MAX + 1, roll) for i, roll in enumerate(rolls)]
+    for label, function in (("règle d'origine", _fate_check_reference), ("table précalculée", fate_outcome)):
+        start = time.perf_counter()
+        for case in cases:
+            function(*case)
+        rate = n / (time.perf_counter() - start)
+        print(f"Fate Check, {label:<18} : {rate / 1e6:6.2f} M/s")
+
+
+def check_dice_distribution(expressions=("3d6+2", "4d6kh3", "d10!", "6d10>=8"), repeat=100_000):
+    # La distribution exacte doit coller aux fréquences observées sur beaucoup de lancers
+    for expression in expressions:
+        terms, canonical = parse_dice_expression(expression)
+        totals, _ = roll_expression(terms, repeat)
+        exact = dice_distribution(canonical)
+        observed = {total: totals.count(total) / repeat for total, _, _ in exact}
+        gap = max(abs(observed[total] - p) for total, p, _ in exact)
+        assert gap < 0.01, (expression, gap)
+        print(f"{canonical:<10} : écart maximal distribution exacte / observée {gap:.4f}")
+
+
+def bench_dice_expression(expression="4d6kh3+2", n=20_000):
+    terms, _ = parse_dice_expression(expression)
+    start = time.perf_counter()
+    for _ in range(n):
+        roll_expression(terms)
+    one_by_one = n / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    roll_expression(terms, n)
+    grouped = n / (time.perf_counter() - start)
+    print(f"{expression} une répétition à la fois : {one_by_one / 1e3:8.1f} k/s")
+    print(f"{expression} répétitions groupées     : {grouped / 1e3:8.1f} k/s")
+
+
+# Serveurs comparés sur les routes principales : serveur de développement (app.run,
+# threadé) et gunicorn (gunicorn.conf.py), s'il est installé. Chaque serveur tourne dans
+# son propre processus sur la base de benchmark.
+SERVER_ROUTES = [
+    ("GET", "/", None),
+    ("POST", "/roll_d100", None),
+    ("POST", "/ask_fate", b"question=Q&odds=50%2F50"),
+    ("POST", "/random_npc", None),
+]
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_server(port, process, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Le serveur s'est arrêté au démarrage")
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.2):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError("Le serveur ne répond pas")
+
+
+def http_requests_per_second(port, method, path, body, clients, requests_per_client):
+    errors = []
+    barrier = threading.Barrier(clients + 1)
+
+    def worker():
+        barrier.wait()
+        for _ in range(requests_per_client):
+            request = urllib.request.Request(f"http://127.0.0.1:{port}{path}", data=body,
+                                             method=method, headers=AUTH_HEADERS)
+            try:
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+            except Exception as e:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    assert not errors, errors[:3]
+    return clients * requests_per_client / elapsed
+
+
+def bench_servers(clients=8, requests_per_client=100):
+    here = os.path.dirname(os.path.abspath(__file__))
+    servers = [("développement (app.run)",
+                [sys.executable, "-c", "import sys; from app import create_app; "
+                                       "create_app().run(port=int(sys.argv[1]))", "{port}"])]
+    if shutil.which("gunicorn"):
+        servers.append(("gunicorn 1 worker x 32 threads",
+                        ["gunicorn", "-c", "gunicorn.conf.py", "--bind", "127.0.0.1:{port}", "wsgi:app"]))
+        servers.append(("gunicorn 4 workers x 8 threads",
+                        ["gunicorn", "-c", "gunicorn.conf.py", "--bind", "127.0.0.1:{port}",
+                         "--workers", "4", "--threads", "8", "wsgi:app"]))
+    else:
+        print("gunicorn n'est pas installé : seul le serveur de développement est mesuré")
+    client = app.test_client()
+    client.post("/add_npc", headers=AUTH_HEADERS, data={"name": "Bench", "description": "PNJ de test"})
+    for label, command in servers:
+        port = _free_port()
+        process = subprocess.Popen([part.format(port=port) for part in command], cwd=here,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            _wait_for_server(port, process)
+            for method, path, body in SERVER_ROUTES:
+                http_requests_per_second(port, method, path, body, 2, 5)  # chauffe
+                rate = http_requests_per_second(port, method, path, body, clients, requests_per_client)
+                print(f"{label:<32} {method:<4} {path:<12} : {rate:8.1f} req/s")
+        finally:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    bench_fate_check()
+    bench_auth_cache()
+    bench_concurrent_writes()
+    bench_roll_engine()
+    check_dice_distribution()
+    bench_dice_expression()
+    bench_servers()
@@ -0,0 +1,26 @@
+# Configuration gunicorn du Compagnon Mythic GME.
+# Lancer avec : gunicorn -c gunicorn.conf.py wsgi:app
+import os
+
+bind = os.environ.get("MYTHIC_BIND", "127.0.0.1:5345")
+
+# Un seul processus par défaut, beaucoup de threads : les événements en direct (/events),
+# les tâches d'IA (/jobs) et les caches (identifiants, tables personnelles) vivent en
+# mémoire dans le processus, et SQLite n'a de toute façon qu'un écrivain à la fois.
+# Plusieurs workers conviennent à un usage en lecture seule ou sans flux en direct.
+workers = int(os.environ.get("MYTHIC_WORKERS", 1))
+worker_class = "gthread"
+# Chaque onglet ouvert garde un thread pour son flux d'événements (server-sent events)
+threads = int(os.environ.get("MYTHIC_THREADS", 32))
+timeout = 60
+keepalive = 5
+
+# L'application (schéma, données de départ, tables compilées) est préparée une fois dans
+# le processus maître ; les workers en héritent par fork.
+preload_app = True
+
+
+def post_fork(server, worker):
+    # Les connexions ouvertes par le maître pendant la préparation ne sont pas partagées
+    from app import dispose_engines
+    dispose_engines()
@@ -0,0 +1,45 @@
+import base64
+import os
+import tempfile
+
+import pytest
+
+# Base de test dans un dossier temporaire, fixée avant l'import de l'application
+os.environ["MYTHIC_DATABASE_URI"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="mythic-tests-"), "tests.db")
+
+import app as mythic  # noqa: E402
+
+mythic.create_app({"TESTING": True, "AI_BACKEND": "stub", "RNG_SEED": "tests"})
+
+AUTH_HEADERS = {"Authorization": "Basic " + base64.b64encode(b"admin:motdepasse").decode("ascii")}
+
+
+def reset_database():
+    # Base vide et caches en mémoire oubliés : chaque test part d'une application neuve
+    with mythic.app.app_context():
+        mythic.db.session.remove()
+        mythic.db.drop_all()
+        mythic.db.session.execute(mythic.text("DROP TABLE IF EXISTS search_index"))
+        mythic.db.session.commit()
+        mythic.init_db()
+    mythic.clear_auth_cache()
+    for cache in (mythic._singletons, mythic._known_campaigns, mythic._custom_table_cache,
+                  mythic._template_graph_cache, mythic._retention_writes):
+        cache.clear()
+    mythic.reset_roll_engine(mythic.app.config["RNG_SEED"])
+
+
+@pytest.fixture
+def app():
+    reset_database()
+    previous = dict(mythic.app.config)
+    yield mythic.app
+    mythic.app.config.clear()
+    mythic.app.config.update(previous)
+
+
+@pytest.fixture
+def client(app):
+    client = app.test_client()
+    client.environ_base["HTTP_AUTHORIZATION"] = AUTH_HEADERS["Authorization"]
+    return client
@@ -0,0 +1,42 @@
+import io
+
+import app as mythic
+
+
+def wait_for_job(client, job_id):
+    mythic._jobs[job_id]["finished"].wait(5)
+    return client.get(f"/jobs/{job_id}").get_json()
+
+
+def test_reformat_runs_in_the_background(client):
+    response = client.post("/reformat_journal", data={"journal_text": "bonjour"})
+    assert response.status_code == 202
+    job = wait_for_job(client, response.get_json()["job_id"])
+    assert job["status"] == "done"
+    assert job["result"] == {"formatted_text": "### Résumé\nbonjour"}
+
+
+def test_transcription_job_and_event_stream(client):
+    response = client.post("/transcribe_audio", data={"audio": (io.BytesIO(b"RIFF...."), "a.wav")})
+    assert response.status_code == 202
+    job_id = response.get_json()["job_id"]
+    assert wait_for_job(client, job_id)["result"] == {"transcription": "Transcription de test."}
+    events = client.get(f"/jobs/{job_id}/events").get_data(as_text=True)
+    assert events.startswith("data: ") and '"status": "done"' in events
+
+
+def test_failing_backend_reports_an_error(app, client, monkeypatch):
+    class FailingBackend:
+        def reformat(self, api_key, text):
+            raise RuntimeError("service indisponible")
+
+    monkeypatch.setattr(mythic, "get_ai_backend", FailingBackend)
+    job_id = client.post("/reformat_journal", data={"journal_text": "x"}).get_json()["job_id"]
+    job = wait_for_job(client, job_id)
+    assert job["status"] == "error" and job["error"] == "service indisponible"
+
+
+def test_unknown_job_and_missing_key(app, client):
+    assert client.get("/jobs/inconnu").status_code == 404
+    app.config["AI_BACKEND"] = "openai"
+    assert client.post("/reformat_journal", data={"journal_text": "x"}).status_code == 400
@@ -0,0 +1,43 @@
+import subprocess
+import sys
+
+import app as mythic
+
+
+def test_import_does_not_touch_the_database(tmp_path):
+    # Importer le module ne crée pas la base : c'est create_app qui la prépare
+    database = tmp_path / "import.db"
+    code = "import app, os, sys; sys.exit(os.path.exists(sys.argv[1]))"
+    env = {"MYTHIC_DATABASE_URI": f"sqlite:///{database}", "PATH": ""}
+    result = subprocess.run([sys.executable, "-c", code, str(database)], cwd=mythic.app.root_path, env=env)
+    assert result.returncode == 0
+
+
+def test_create_app_initialises_once(app):
+    assert mythic.create_app() is app
+    with app.app_context():
+        assert mythic.db.session.get(mythic.Campaign, mythic.DEFAULT_CAMPAIGN_ID) is not None
+        assert mythic.GameState.query.count() == 1
+
+
+def test_init_db_is_rerunnable(app):
+    with app.app_context():
+        mythic.init_db()
+        mythic.init_db()
+        assert mythic.Campaign.query.count() == 1
+        assert mythic.event.contains(mythic.db.engine, "before_cursor_execute", mythic._count_query)
+
+
+def test_query_listener_counts_each_query_once(app, client):
+    app.config["QUERY_BUDGET_CHECK"] = True
+    client.post("/roll_d100")
+    with app.app_context():
+        mythic.init_db()
+    first = int(client.post("/roll_d100").headers["X-Query-Count"])
+    second = int(client.post("/roll_d100").headers["X-Query-Count"])
+    assert first == second
+
+
+def test_dispose_engines_keeps_the_app_usable(app, client):
+    mythic.dispose_engines()
+    assert client.post("/roll_d100").status_code == 200
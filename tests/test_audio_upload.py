@@ -0,0 +1,49 @@
+import io
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+import app as mythic
+
+
+def test_upload_is_taken_without_copy(app):
+    stream = io.BytesIO(b"x" * 5000)
+    upload = FileStorage(stream)
+    taken = mythic.take_upload(upload, 100_000)
+    assert taken is stream and taken.read() == b"x" * 5000
+    upload.close()  # fin de la requête : le fichier du job reste ouvert
+    assert not taken.closed
+
+
+def test_upload_over_the_limit_is_refused(app):
+    assert mythic.take_upload(FileStorage(io.BytesIO(b"x" * 1001)), 1000) is None
+
+
+@pytest.mark.parametrize("limits", [{"AUDIO_MAX_BYTES": 100_000},
+                                    {"AUDIO_MAX_BYTES": 1_000_000, "MAX_CONTENT_LENGTH": 100_000}])
+def test_transcribe_rejects_large_recordings(app, client, limits):
+    app.config.update(limits)
+    response = client.post("/transcribe_audio", data={"audio": (io.BytesIO(b"x" * 120_000), "a.wav")})
+    assert response.status_code == 413 and response.get_json()["error"]
+
+
+def test_body_over_max_content_length_is_not_read(app, client, monkeypatch):
+    app.config["MAX_CONTENT_LENGTH"] = 1000
+    monkeypatch.setattr(mythic, "take_upload", lambda *args: pytest.fail("upload lu"))
+    response = client.post("/transcribe_audio", data={"audio": (io.BytesIO(b"x" * 5000), "a.wav")})
+    assert response.status_code == 413
+
+
+def test_transcribe_requires_a_file(client):
+    assert client.post("/transcribe_audio", data={}).status_code == 400
+
+
+def test_job_reads_then_closes_the_upload(app, client, monkeypatch):
+    taken = []
+    original = mythic.take_upload
+    monkeypatch.setattr(mythic, "take_upload", lambda *args: taken.append(original(*args)) or taken[-1])
+    monkeypatch.setattr(mythic.StubAIBackend, "transcribe", lambda self, api_key, audio: audio[1].read().decode())
+    job_id = client.post("/transcribe_audio", data={"audio": (io.BytesIO(b"RIFF"), "a.wav")}).get_json()["job_id"]
+    mythic._jobs[job_id]["finished"].wait(5)
+    assert mythic._jobs[job_id]["result"] == {"transcription": "RIFF"}
+    assert taken[0].closed
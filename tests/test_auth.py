@@ -0,0 +1,56 @@
+import base64
+
+import app as mythic
+
+
+def basic(username, password):
+    return {"Authorization": "Basic " + base64.b64encode(f"{username}:{password}".encode()).decode()}
+
+
+def test_wrong_password_is_rejected(app):
+    client = app.test_client()
+    assert client.post("/roll_d100", headers=basic("admin", "faux")).status_code == 401
+    assert client.post("/roll_d100", headers=basic("inconnu", "motdepasse")).status_code == 401
+
+
+def test_verified_credentials_are_cached(app, monkeypatch):
+    calls = []
+    original = mythic.check_password_hash
+    monkeypatch.setattr(mythic, "check_password_hash", lambda *args: calls.append(args) or original(*args))
+    client = app.test_client()
+    for _ in range(5):
+        assert client.post("/roll_d100", headers=basic("admin", "motdepasse")).status_code == 200
+    assert len(calls) == 1
+
+
+def test_cache_never_keeps_the_password_in_clear(app):
+    app.test_client().post("/roll_d100", headers=basic("admin", "motdepasse"))
+    assert all(b"motdepasse" not in key for key in mythic._auth_cache)
+
+
+def test_password_change_invalidates_the_cache(app):
+    client = app.test_client()
+    assert client.post("/roll_d100", headers=basic("admin", "motdepasse")).status_code == 200
+    try:
+        mythic.set_user_password("admin", "nouveau")
+        assert client.post("/roll_d100", headers=basic("admin", "motdepasse")).status_code == 401
+        assert client.post("/roll_d100", headers=basic("admin", "nouveau")).status_code == 200
+    finally:
+        mythic.set_user_password("admin", "motdepasse")
+
+
+def test_cache_disabled_and_size_limit(app, monkeypatch):
+    calls = []
+    original = mythic.check_password_hash
+    monkeypatch.setattr(mythic, "check_password_hash", lambda *args: calls.append(args) or original(*args))
+    client = app.test_client()
+    app.config["AUTH_CACHE_TTL"] = 0
+    for _ in range(3):
+        client.post("/roll_d100", headers=basic("admin", "motdepasse"))
+    assert len(calls) == 3
+    app.config["AUTH_CACHE_TTL"] = 300
+    app.config["AUTH_CACHE_SIZE"] = 2
+    for i in range(4):
+        monkeypatch.setitem(mythic.users, f"joueur{i}", mythic.generate_password_hash("secret"))
+        assert client.post("/roll_d100", headers=basic(f"joueur{i}", "secret")).status_code == 200
+    assert len(mythic._auth_cache) == 2
@@ -0,0 +1,67 @@
+import app as mythic
+
+
+def test_rows_are_scoped_to_their_campaign(client):
+    assert client.post("/add_campaign", data={"name": "Deux"}).get_json()["url"] == "/c/2/"
+    client.post("/add_npc", data={"name": "Alpha", "description": ""})
+    client.post("/c/2/add_npc", data={"name": "Beta", "description": ""})
+    main, second = client.get("/").get_data(as_text=True), client.get("/c/2/").get_data(as_text=True)
+    assert "Alpha" in main and "Beta" not in main
+    assert "Beta" in second and "Alpha" not in second
+    assert client.post("/c/2/delete_npc/1").status_code == 404
+    assert client.post("/search", query_string={"q": "beta"}).get_json() == []
+    assert len(client.post("/c/2/search", query_string={"q": "beta"}).get_json()) == 1
+
+
+def test_each_campaign_has_its_own_chaos_and_history(client):
+    client.post("/add_campaign", data={"name": "Deux"})
+    assert client.post("/c/2/update_chaos", data={"adjustment": "2"}).get_json() == {"new_chaos": 7}
+    assert client.post("/update_chaos", data={"adjustment": "0"}).get_json() == {"new_chaos": 5}
+    client.post("/c/2/roll_batch", data={"spec": "3d6"})
+    assert client.post("/dice_history").get_json() == []
+    assert len(client.post("/c/2/dice_history").get_json()) == 3
+
+
+def test_foreign_parent_rows_are_not_found(client):
+    client.post("/add_campaign", data={"name": "Deux"})
+    inventory_id = client.post("/c/2/add_inventory", data={"title": "sac"}).get_json()["id"]
+    assert client.post(f"/add_inventory_item/{inventory_id}", data={"name": "x", "quantity": 1}).status_code == 404
+    assert client.post(f"/c/2/add_inventory_item/{inventory_id}", data={"name": "x", "quantity": 1}).status_code == 200
+    table_id = client.post("/c/2/add_custom_table",
+                           data={"customTableName": "T", "customTableValues": "a"}).get_json()["id"]
+    assert client.post(f"/roll_custom_table/{table_id}").status_code == 404
+    assert client.post(f"/c/2/roll_custom_table/{table_id}").status_code == 200
+
+
+def test_unknown_campaign(client):
+    assert client.get("/c/99/").status_code == 404
+    assert client.get("/c/2").status_code in (301, 308)
+
+
+def test_index_stays_within_budget_cold_and_warm(app, client):
+    client.post("/add_npc", data={"name": "Alpha", "description": ""})
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_player", data={"name": "PJ", "description": ""})
+    # Comme au premier affichage d'un nouveau processus : aucun cache rempli
+    mythic._singletons.clear()
+    mythic._known_campaigns.clear()
+    mythic.clear_auth_cache()
+    app.config["QUERY_BUDGET_CHECK"] = True
+    cold = client.get("/")
+    warm = client.get("/")
+    assert cold.status_code == 200 and warm.status_code == 200
+    assert int(warm.headers["X-Query-Count"]) < int(cold.headers["X-Query-Count"]) <= mythic.index.query_budget
+
+
+def test_unknown_campaign_is_checked_after_authentication(app):
+    anonymous = app.test_client()
+    app.config["QUERY_BUDGET_CHECK"] = True
+    response = anonymous.get("/c/99/")
+    assert response.status_code == 401 and response.headers["X-Query-Count"] == "0"
+    assert anonymous.post("/c/1/roll_d100").status_code == 401
+
+
+def test_player_attributes_have_a_campaign_index(app):
+    with app.app_context():
+        indexes = mythic.db.session.execute(mythic.text("PRAGMA index_list(player_attribute)")).all()
+    assert "ix_player_attribute_campaign_id" in {row[1] for row in indexes}
@@ -0,0 +1,93 @@
+import threading
+
+import pytest
+
+import app as mythic
+
+
+@pytest.fixture
+def counters(client):
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_inventory_item/1", data={"name": "Flèches", "quantity": 10})
+    client.post("/add_player", data={"name": "P", "description": ""})
+    client.post("/add_player_attribute/1", data={"attribute_name": "PV", "attribute_value": "10", "is_numeric": "on"})
+    client.post("/add_player_attribute/1", data={"attribute_name": "Classe", "attribute_value": "Mage"})
+    return client
+
+
+def test_single_counter_updates(counters):
+    assert counters.post("/update_item_quantity/1/decrease").get_json()["new_quantity"] == 9
+    assert counters.post("/update_item_quantity/1/decrease", data={"delta": 50}).get_json()["new_quantity"] == 0
+    assert counters.post("/update_attribute/1/increase", data={"delta": 5}).get_json()["new_value"] == 15
+    assert counters.post("/update_attribute/2/increase").status_code == 400  # non numérique
+    assert counters.post("/update_attribute/9/increase").status_code == 404
+    assert counters.post("/update_item_quantity/9/increase").status_code == 404
+    assert counters.post("/update_item_quantity/1/double").status_code == 400
+
+
+def test_concurrent_updates_are_not_lost(app, counters):
+    def decrease():
+        worker = app.test_client()
+        worker.environ_base.update(counters.environ_base)
+        for _ in range(25):
+            worker.post("/update_attribute/1/decrease")
+
+    threads = [threading.Thread(target=decrease) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert counters.post("/update_attribute/1/increase", data={"delta": 0}).get_json()["new_value"] == -90
+
+
+def test_bulk_update(counters):
+    result = counters.post("/bulk_update", json={"items": [{"id": 1, "delta": 7}],
+                                                  "attributes": [{"id": 1, "delta": -4}]}).get_json()
+    assert result["items"] == [{"id": 1, "quantity": 17, "inventory_id": 1}]
+    assert result["attributes"] == [{"id": 1, "value": 6}]
+
+
+def test_bulk_update_is_atomic(counters):
+    response = counters.post("/bulk_update", json={"items": [{"id": 1, "delta": 7}],
+                                                    "attributes": [{"id": 2, "delta": 1}]})
+    assert response.status_code == 404
+    assert counters.post("/update_item_quantity/1/increase", data={"delta": 0}).get_json()["new_quantity"] == 10
+
+
+@pytest.mark.parametrize("body", [[], [1], [{"id": 1, "delta": 1}], 3, "items", None,
+                                  {"items": [{"id": 1}]}, {"items": 5}, {"items": [{"id": "x", "delta": 1}]}])
+def test_bulk_update_rejects_bad_json(counters, body):
+    response = counters.post("/bulk_update", json=body)
+    assert response.status_code == 400
+    assert "Format attendu" in response.get_json()["error"]
+
+
+def test_bulk_update_rejects_malformed_body(counters):
+    response = counters.post("/bulk_update", data="{items", content_type="application/json")
+    assert response.status_code == 400
+    assert counters.post("/bulk_update", data={"items": "1"}).status_code == 400
+
+
+@pytest.mark.parametrize("delta", ["-5", "abc", "1.5", str(2 ** 63), str(mythic.COUNTER_MAX_DELTA + 1)])
+def test_invalid_delta_is_rejected(counters, delta):
+    for url in ["/update_item_quantity/1/increase", "/update_item_quantity/1/decrease",
+                "/update_attribute/1/increase", "/update_attribute/1/decrease"]:
+        assert counters.post(url, data={"delta": delta}).status_code == 400, url
+
+
+def test_largest_delta_is_accepted(counters):
+    response = counters.post("/update_item_quantity/1/increase", data={"delta": mythic.COUNTER_MAX_DELTA})
+    assert response.get_json()["new_quantity"] == 10 + mythic.COUNTER_MAX_DELTA
+
+
+@pytest.mark.parametrize("change", [{"id": 1, "delta": 2 ** 64}, {"id": 1, "delta": -2 ** 64},
+                                    {"id": 2 ** 64, "delta": 1}, {"id": 1, "delta": 1.5}, {"id": 1, "delta": True}])
+def test_bulk_update_rejects_out_of_range_values(counters, change):
+    assert counters.post("/bulk_update", json={"items": [change]}).status_code == 400
+    assert counters.post("/bulk_update", json={"attributes": [change]}).status_code == 400
+
+
+def test_bulk_update_rejects_infinite_delta(counters):
+    response = counters.post("/bulk_update", data='{"items": [{"id": 1, "delta": 1e400}]}',
+                             content_type="application/json")
+    assert response.status_code == 400
@@ -0,0 +1,32 @@
+from collections import Counter
+
+import app as mythic
+
+
+def test_parse_ranges_weights_and_plain_lines():
+    parsed = mythic.parse_custom_table("a\n\n1-5: b\n6: c\nx3: d\nx0: e\n12h: f")
+    assert parsed.results == ["a", "b", "c", "d", "12h: f"]
+    assert parsed.total == 11
+    assert [parsed.result_for(roll) for roll in range(1, 12)] == ["a"] + ["b"] * 5 + ["c"] + ["d"] * 3 + ["12h: f"]
+
+
+def test_weighted_entries_are_rolled_more_often(client):
+    client.post("/add_custom_table", data={"customTableName": "T", "customTableValues": "x9: a\nb"})
+    counts = Counter(client.post("/roll_custom_table/1").get_json()["result"] for _ in range(300))
+    assert counts["a"] > 4 * counts["b"] > 0
+
+
+def test_edit_and_delete_invalidate_the_cache(client):
+    client.post("/add_custom_table", data={"customTableName": "T", "customTableValues": "a"})
+    assert client.post("/roll_custom_table/1").get_json()["result"] == "a"
+    client.post("/edit_custom_table/1", data={"customTableNameEdit": "T", "customTableValuesEdit": "z"})
+    assert client.post("/roll_custom_table/1").get_json()["result"] == "z"
+    client.post("/delete_custom_table/1")
+    assert client.post("/roll_custom_table/1").status_code == 404
+
+
+def test_index_does_not_send_table_values(client):
+    client.post("/add_custom_table", data={"customTableName": "T", "customTableValues": "valeur-secrete"})
+    page = client.get("/").get_data(as_text=True)
+    assert "valeur-secrete" not in page
+    assert client.post("/get_custom_table", query_string={"table_id": 1}).get_json() == {"values": "valeur-secrete"}
@@ -0,0 +1,91 @@
+import itertools
+import time
+from collections import defaultdict
+
+import pytest
+
+import app as mythic
+
+
+def brute_force(expression):
+    # Toutes les combinaisons de dés, terme par terme
+    terms, _ = mythic.parse_dice_expression(expression)
+    distribution = {0: 1.0}
+    for term in terms:
+        if not term.faces:
+            outcomes = {term.sign * term.count: 1.0}
+        else:
+            if term.explode:
+                offset, probs = mythic._die_distribution(term, [mythic.DICE_DISTRIBUTION_MAX_WORK])
+                die = {offset + i: p for i, p in enumerate(probs) if p}
+            else:
+                die = {value: 1 / term.faces for value in range(1, term.faces + 1)}
+            outcomes = defaultdict(float)
+            for combination in itertools.product(die.items(), repeat=term.count):
+                p = 1.0
+                for _, q in combination:
+                    p *= q
+                outcomes[term.sign * term.score([value for value, _ in combination])] += p
+        following = defaultdict(float)
+        for a, p in distribution.items():
+            for b, q in outcomes.items():
+                following[a + b] += p * q
+        distribution = following
+    return distribution
+
+
+@pytest.mark.parametrize("expression, canonical", [("3d6+2", "3d6+2"), ("4d6kh3 + 2", "4d6kh3+2"), ("d%", "1d100"),
+                                                   ("d6!", "1d6!"), ("2D6-1d4", "2d6-1d4")])
+def test_canonical_form(expression, canonical):
+    assert mythic.parse_dice_expression(expression)[1] == canonical
+
+
+@pytest.mark.parametrize("expression", ["", "3d", "2d6kh3", "d1!", "abc", "3d6 2", "101d6", "0d6",
+                                        "+".join(["1"] * 21)])
+def test_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        mythic.parse_dice_expression(expression)
+
+
+@pytest.mark.parametrize("expression", ["3d6+2", "4d6kh3", "4d6kl2-1", "d10!", "2d4!kh1", "5d10>=8",
+                                        "4d6kh2>=4", "2d6-1d4", "3d6>4"])
+def test_exact_distribution_matches_brute_force(expression):
+    expected = brute_force(expression)
+    rows = mythic.dice_distribution(mythic.parse_dice_expression(expression)[1])
+    assert sum(p for _, p, _ in rows) == pytest.approx(1)
+    for total, p, at_least in rows:
+        assert p == pytest.approx(expected.get(total, 0), abs=1e-9)
+        assert at_least == pytest.approx(sum(q for value, q in expected.items() if value >= total), abs=1e-9)
+
+
+def test_roll_expression_route(client):
+    result = client.post("/roll_expression", data={"expression": "4d6kh3 + 2", "repeat": 500}).get_json()
+    assert result["expression"] == "4d6kh3+2"
+    assert len(result["totals"]) == 500 and all(5 <= total <= 20 for total in result["totals"])
+    distribution = client.post("/dice_distribution", data={"expression": "4d6kh3+2"}).get_json()
+    assert (distribution["min"], distribution["max"]) == (5, 20)
+    assert sum(result["totals"]) / 500 == pytest.approx(distribution["mean"], abs=0.6)
+    history = client.post("/dice_history").get_json()
+    assert history[0]["expression"] == "4d6kh3+2"
+    assert client.post("/roll_expression", data={"expression": "3d"}).status_code == 400
+    assert client.post("/roll_expression", data={"expression": "d6", "repeat": 0}).status_code == 400
+
+
+def test_distribution_work_is_bounded(client):
+    response = client.post("/dice_distribution", data={"expression": "100d100"})
+    assert response.status_code == 400 and "error" in response.get_json()
+
+
+@pytest.mark.parametrize("expression", ["d20000000", "d1000000000!", "2d100000000kh1"])
+def test_huge_dice_are_rejected_quickly(client, expression):
+    start = time.perf_counter()
+    response = client.post("/dice_distribution", data={"expression": expression})
+    assert response.status_code == 400 and "faces" in response.get_json()["error"]
+    assert client.post("/roll_expression", data={"expression": expression}).status_code == 400
+    assert time.perf_counter() - start < 0.5
+
+
+def test_die_distribution_is_charged_before_it_is_built():
+    term = mythic.parse_dice_expression("d10000!")[0][0]
+    with pytest.raises(ValueError):
+        mythic._die_distribution(term, [1000])
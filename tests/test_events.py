@@ -0,0 +1,64 @@
+import json
+import queue
+
+import pytest
+
+import app as mythic
+
+
+def test_local_broker_fans_out_and_drops_when_full():
+    broker = mythic.LocalBroker(queue_size=1)
+    first, second, other = broker.subscribe(1), broker.subscribe(1), broker.subscribe(2)
+    broker.publish(1, "a")
+    broker.publish(1, "b")  # files pleines : perdu, sans bloquer
+    assert first.get_nowait() == "a" and second.get_nowait() == "a"
+    assert other.empty() and first.empty()
+    broker.unsubscribe(1, first)
+    broker.unsubscribe(1, second)
+    assert 1 not in broker.channels
+
+
+@pytest.fixture
+def subscription():
+    broker = mythic.get_event_broker()
+    subscribers = []
+
+    def subscribe(channel):
+        subscriber = broker.subscribe(channel)
+        subscribers.append((channel, subscriber))
+        return subscriber
+
+    yield subscribe
+    for channel, subscriber in subscribers:
+        broker.unsubscribe(channel, subscriber)
+
+
+def read_event(subscriber):
+    event, data = subscriber.get(timeout=1).strip().split("\n")
+    return event.removeprefix("event: "), json.loads(data.removeprefix("data: "))
+
+
+def test_writes_publish_on_their_campaign_channel(client, subscription):
+    client.post("/add_campaign", data={"name": "Deux"})
+    main, second = subscription(1), subscription(2)
+    response = client.post("/ask_fate", data={"question": "q", "odds": "50/50"}).get_json()
+    event, payload = read_event(main)
+    assert event == "fate" and payload["id"] == response["id"] and payload["html"] == response["html"]
+    client.post("/c/2/update_chaos", data={"adjustment": "1"})
+    assert read_event(second)[0] == "chaos"
+    with pytest.raises(queue.Empty):
+        main.get_nowait()
+
+
+def test_events_stream(app, client):
+    app.config["EVENT_HEARTBEAT"] = 0.05
+    response = client.get("/events", buffered=False)
+    chunks = iter(response.response)
+    try:
+        assert next(chunks) == b"retry: 3000\n\n"
+        assert next(chunks) == b": ping\n\n"
+        client.post("/update_chaos", data={"adjustment": "1"})
+        assert next(chunks).startswith(b"event: chaos\n")
+    finally:
+        response.close()
+    assert 1 not in mythic.get_event_broker().channels
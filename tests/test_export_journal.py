@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+import app as mythic
+
+
+@pytest.fixture
+def journal(client):
+    # Plus d'entrées que la taille d'un lot : l'export traverse plusieurs lots
+    for i in range(mythic.JOURNAL_EXPORT_BATCH + 50):
+        client.post("/add_journal_entry", data={"content": f"e{i}\n<b>x</b>"})
+    return mythic.JOURNAL_EXPORT_BATCH + 50
+
+
+def test_markdown_export_in_date_order(client, journal):
+    response = client.get("/export_journal")
+    text = response.get_data(as_text=True)
+    assert response.mimetype == "text/markdown"
+    assert text.startswith("# Journal") and text.count("---") == journal
+    assert text.index("e0\n") < text.index(f"e{journal - 1}\n")
+
+
+def test_jsonl_and_html_exports(client, journal):
+    response = client.post("/export_journal", query_string={"format": "jsonl"})
+    rows = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert response.mimetype == "application/x-ndjson" and len(rows) == journal
+    html = client.get("/export_journal", query_string={"format": "html"}).get_data()
+    assert b"&lt;b&gt;" in html and html.endswith(b"</html>\n")
+
+
+def test_date_filters(client, journal):
+    assert client.get("/export_journal?start=2000-01-01&end=2001-01-01").get_data(as_text=True) == "# Journal\n\n"
+    lines = client.get("/export_journal?format=jsonl&start=2000-01-01").get_data(as_text=True).splitlines()
+    assert len(lines) == journal
+
+
+def test_invalid_parameters(client):
+    assert client.get("/export_journal?start=xx").status_code == 400
+    assert client.get("/export_journal?format=pdf").status_code == 400
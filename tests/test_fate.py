@@ -0,0 +1,57 @@
+import pytest
+
+import app as mythic
+
+
+@pytest.mark.parametrize("odds", list(mythic.FATE_ODDS) + ["Inconnue"])
+def test_fate_chart_matches_reference_rule(odds):
+    # Toutes les cases (et un chaos hors bornes) : la table précalculée donne la règle d'origine
+    for chaos_factor in range(mythic.CHAOS_MIN - 1, mythic.CHAOS_MAX + 2):
+        for roll in range(1, 101):
+            expected = mythic._fate_check_reference(odds, chaos_factor, roll)
+            assert mythic.fate_outcome(odds, chaos_factor, roll) == expected, (odds, chaos_factor, roll)
+
+
+def test_ask_fate_records_the_chart_answer(client):
+    for _ in range(20):
+        client.post("/ask_fate", data={"question": "q", "odds": "Probable"})
+    with mythic.app.app_context():
+        for question in mythic.FateQuestion.query.all():
+            expected = mythic._fate_check_reference("Probable", 5, question.roll)
+            assert question.answer == expected["answer"]
+            assert question.random_event == expected["random_event"]
+
+
+def test_fate_probabilities_sum_to_one():
+    for odds in mythic.FATE_ODDS:
+        for chaos_factor in range(mythic.CHAOS_MIN, mythic.CHAOS_MAX + 1):
+            rates = mythic.fate_probabilities(odds, chaos_factor)
+            assert sum(rates["answers"].values()) == pytest.approx(1)
+            reference = [mythic._fate_check_reference(odds, chaos_factor, roll) for roll in range(1, 101)]
+            assert rates["answers"]["Oui"] == sum(r["answer"] == "Oui" for r in reference) / 100
+            assert rates["random_event"] == sum(r["random_event"] for r in reference) / 100
+
+
+def test_simulate_fate(client):
+    result = client.post("/simulate_fate", data={"odds": "Probable", "chaos": 5, "trials": 20000}).get_json()
+    stats = result["odds"]["Probable"]
+    for answer, p in stats["exact"]["answers"].items():
+        assert stats["simulated"]["answers"][answer] == pytest.approx(p, abs=0.02)
+    assert set(client.post("/simulate_fate").get_json()["odds"]) == set(mythic.FATE_ODDS)
+
+
+def test_simulate_fate_limits(client):
+    too_many = mythic.SIMULATION_MAX_TRIALS + 1
+    assert client.post("/simulate_fate", data={"trials": too_many}).status_code == 400
+    assert client.post("/simulate_fate", data={"scenes": mythic.SIMULATION_MAX_SCENES + 1}).status_code == 400
+    assert client.post("/simulate_fate", data={"chaos": 10}).status_code == 400
+    assert client.post("/simulate_fate", data={"odds": "Inconnue"}).status_code == 400
+    assert client.post("/simulate_fate", data={"p_control": 2}).status_code == 400
+
+
+def test_chaos_drift():
+    steps = mythic.chaos_drift(5, 10, 1.0)
+    assert [step["expected_chaos"] for step in steps[:5]] == pytest.approx([5, 4, 3, 2, 1])
+    assert steps[-1]["chaos"][mythic.CHAOS_MIN] == pytest.approx(1)
+    for step in mythic.chaos_drift(5, 10, 0.3):
+        assert sum(step["chaos"].values()) == pytest.approx(1)
@@ -0,0 +1,68 @@
+import pytest
+
+
+def ok(response):
+    assert response.status_code == 200, response.get_data(as_text=True)[:300]
+    return response.get_json()
+
+
+def test_add_routes_return_rendered_fragments(client):
+    assert "fq-1" in ok(client.post("/ask_fate", data={"question": "Q ?", "odds": "50/50"}))["html"]
+    assert 'id="objective-1"' in ok(client.post("/add_objective", data={"description": "Objectif"}))["html"]
+    assert 'id="npc-1"' in ok(client.post("/add_npc", data={"name": "Bob", "description": "x"}))["html"]
+    assert "S1" in ok(client.post("/add_scene", data={"title": "S1", "description": "x"}))["current_scene_html"]
+    assert 'id="journal-entry-1"' in ok(client.post("/add_journal_entry", data={"content": "a\nb"}))["html"]
+    assert 'id="inventory-1"' in ok(client.post("/add_inventory", data={"title": "Sac"}))["html"]
+    assert 'id="item-1"' in ok(client.post("/add_inventory_item/1", data={"name": "Corde", "quantity": 1}))["html"]
+    assert 'id="player-1"' in ok(client.post("/add_player", data={"name": "P", "description": ""}))["html"]
+    data = {"attribute_name": "PV", "attribute_value": "3", "is_numeric": "on"}
+    assert 'id="attr-1"' in ok(client.post("/add_player_attribute/1", data=data))["html"]
+    table = ok(client.post("/add_custom_table", data={"customTableName": "T", "customTableValues": "a\nb"}))
+    assert table["table"] == {"id": 1, "name": "T"}
+
+
+def test_fragments_escape_user_content(client):
+    html = ok(client.post("/add_npc", data={"name": "<script>x</script>", "description": ""}))["html"]
+    assert "<script>x</script>" not in html
+    assert "&lt;script&gt;" in html
+
+
+def test_deleting_the_scene_updates_the_banner(client):
+    client.post("/add_scene", data={"title": "S1", "description": "x"})
+    assert "Aucune" in ok(client.post("/delete_scene/1"))["current_scene_html"]
+
+
+@pytest.mark.parametrize("url, setup", [
+    ("/delete_objective/1", ("/add_objective", {"description": "o"})),
+    ("/delete_npc/1", ("/add_npc", {"name": "n", "description": ""})),
+    ("/delete_journal_entry/1", ("/add_journal_entry", {"content": "c"})),
+    ("/delete_inventory/1", ("/add_inventory", {"title": "t"})),
+    ("/delete_player/1", ("/add_player", {"name": "p", "description": ""})),
+    ("/delete_custom_table/1", ("/add_custom_table", {"customTableName": "T", "customTableValues": "a"})),
+])
+def test_delete_routes_return_the_id(client, url, setup):
+    client.post(setup[0], data=setup[1])
+    assert ok(client.post(url))["id"] == 1
+
+
+@pytest.mark.parametrize("url, data", [
+    ("/add_inventory_item/1", {"name": "", "quantity": 1}),
+    ("/add_inventory_item/1", {"name": "Corde", "quantity": 0}),
+    ("/add_inventory_item/1", {"name": "Corde"}),
+    ("/add_player_attribute/1", {"attribute_name": "PV", "attribute_value": "beaucoup", "is_numeric": "on"}),
+    ("/update_openai_key", {"api_key": "pas-une-cle"}),
+    ("/update_openai_key", {}),
+])
+def test_invalid_input_returns_a_json_error(client, url, data):
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_player", data={"name": "PJ", "description": ""})
+    response = client.post(url, data=data)
+    assert response.status_code == 400 and response.get_json()["error"]
+
+
+def test_fetch_routes_do_not_flash(client):
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_inventory_item/1", data={"name": "Corde", "quantity": 1})
+    client.post("/update_openai_key", data={"api_key": "sk-test"})
+    with client.session_transaction() as session:
+        assert "_flashes" not in session
@@ -0,0 +1,35 @@
+def seed(client, count):
+    for _ in range(count):
+        inventory_id = client.post("/add_inventory", data={"title": "Sac"}).get_json()["id"]
+        for name in ("Corde", "Torche"):
+            client.post(f"/add_inventory_item/{inventory_id}", data={"name": name, "description": "", "quantity": 1})
+        player_id = client.post("/add_player", data={"name": "PJ", "description": "Un aventurier"}).get_json()["id"]
+        for name in ("PV", "Force"):
+            client.post(f"/add_player_attribute/{player_id}",
+                        data={"attribute_name": name, "attribute_value": "3", "is_numeric": "on"})
+        client.post("/add_npc", data={"name": "PNJ", "description": ""})
+        client.post("/add_journal_entry", data={"content": "Une entrée"})
+
+
+def query_count(client):
+    response = client.get("/")
+    assert response.status_code == 200
+    return int(response.headers["X-Query-Count"])
+
+
+def test_index_query_count_does_not_grow_with_rows(app, client):
+    app.config["QUERY_BUDGET_CHECK"] = True
+    seed(client, 2)
+    query_count(client)
+    few = query_count(client)
+    seed(client, 8)
+    many = query_count(client)
+    assert many == few
+
+
+def test_index_renders_items_and_attributes(client):
+    seed(client, 3)
+    page = client.get("/").get_data(as_text=True)
+    assert page.count('id="inventory-') == 3
+    assert page.count("Torche") == 3
+    assert page.count('id="attr-value-') == 6
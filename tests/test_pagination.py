@@ -0,0 +1,44 @@
+import json
+import re
+
+
+def ids(html, prefix):
+    return [int(value) for value in re.findall(rf'id="{prefix}(\d+)"', html)]
+
+
+def test_journal_cursor_walks_every_entry(client):
+    for i in range(23):
+        client.post("/add_journal_entry", data={"content": f"e{i}"})
+    page = client.get("/").get_data(as_text=True)
+    assert len(ids(page, "journal-entry-")) == 5
+    cursor = json.loads(re.search(r"id=\"journalMoreBtn\".*?data-cursor='([^']*)'", page, re.S).group(1))
+    seen = []
+    while cursor:
+        data = client.post("/journal_entries", data=cursor).get_json()
+        seen += ids(data["html"], "journal-entry-")
+        cursor = data["next"]
+    assert seen == list(range(18, 0, -1))
+
+
+def test_fate_history_cursor(client):
+    for i in range(20):
+        client.post("/ask_fate", data={"question": f"q{i}", "odds": "50/50"})
+    assert len(ids(client.get("/").get_data(as_text=True), "fq-")) == 6
+    cursor, seen = {"before_id": 15}, []
+    while cursor:
+        data = client.post("/fate_history", data=cursor).get_json()
+        seen += ids(data["html"], "fq-")
+        cursor = data["next"]
+    assert seen == list(range(14, 0, -1))
+
+
+def test_dice_history_cursor(client):
+    for _ in range(15):
+        client.post("/roll_dice/6")
+    history = client.post("/dice_history").get_json()
+    assert len(history) == 10 and history[0]["id"] == 15
+    assert [entry["id"] for entry in client.post("/dice_history", data={"before_id": 6}).get_json()] == [5, 4, 3, 2, 1]
+
+
+def test_old_journal_page_redirects(client):
+    assert client.get("/journal/page/3").status_code == 302
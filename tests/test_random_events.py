@@ -0,0 +1,53 @@
+import pytest
+
+import app as mythic
+
+
+@pytest.fixture
+def forced_event(monkeypatch):
+    # Jet de 11 avec un chaos de 5 : double, donc événement aléatoire
+    monkeypatch.setattr(mythic, "fate_check",
+                        lambda odds, chaos_factor: {**mythic.fate_outcome(odds, chaos_factor, 11), "seed": None})
+
+    def focus(text):
+        monkeypatch.setattr(mythic, "roll_random_event_focus", lambda: (1, text))
+    return focus
+
+
+def test_event_targets_an_npc_and_marks_it_seen(client, forced_event):
+    forced_event("PNJ négatif: Un PNJ agit contre vous.")
+    client.post("/add_npc", data={"name": "Gandalf", "description": ""})
+    response = client.post("/ask_fate", data={"question": "q", "odds": "50/50", "resolve_event": "1"}).get_json()
+    event = response["event"]
+    assert event["focus"].startswith("PNJ négatif") and event["action"] and event["descriptor"]
+    assert (event["target"]["kind"], event["target"]["id"], event["target"]["name"]) == ("npc", 1, "Gandalf")
+    assert "Gandalf" in response["html"]
+    with mythic.app.app_context():
+        question = mythic.db.session.get(mythic.FateQuestion, response["id"])
+        assert question.random_event and question.event == event
+        assert mythic.db.session.get(mythic.NPC, 1).last_seen is not None
+
+
+@pytest.mark.parametrize("focus, kind", [("Fermer un fil narratif: x", "objective"),
+                                         ("Avantage pour le PJ: x", "player"),
+                                         ("Événement lointain: x", None)])
+def test_event_target_kinds(client, forced_event, focus, kind):
+    forced_event(focus)
+    client.post("/add_objective", data={"description": "Trouver l'anneau"})
+    client.post("/add_player", data={"name": "Frodon", "description": ""})
+    event = client.post("/ask_fate", data={"question": "q", "odds": "50/50", "resolve_event": "1"}).get_json()["event"]
+    assert (event["target"] or {}).get("kind") == kind
+
+
+def test_event_without_candidates_has_no_target(client, forced_event):
+    forced_event("Action de PNJ: x")
+    event = client.post("/ask_fate", data={"question": "q", "odds": "50/50", "resolve_event": "1"}).get_json()["event"]
+    assert event["target"] is None
+
+
+def test_event_is_only_resolved_on_request(client, forced_event):
+    forced_event("Action de PNJ: x")
+    response = client.post("/ask_fate", data={"question": "q", "odds": "50/50"}).get_json()
+    assert response["event"] is None
+    with mythic.app.app_context():
+        assert mythic.db.session.get(mythic.FateQuestion, response["id"]).random_event
@@ -0,0 +1,43 @@
+import app as mythic
+
+
+def count(table):
+    with mythic.app.app_context():
+        return mythic.db.session.execute(mythic.text(f"SELECT count(*) FROM {table}")).scalar()
+
+
+def test_retention_is_off_by_default(app, client):
+    app.config["RETENTION_EVERY"] = 5
+    for _ in range(20):
+        client.post("/roll_dice/6")
+    assert count("dice_roll_history") == 20
+    assert count("dice_roll_history_archive") == 0
+
+
+def test_compaction_keeps_the_latest_rows_and_the_totals(app, client):
+    app.config.update(DICE_HISTORY_KEEP=20, FATE_HISTORY_KEEP=5, RETENTION_EVERY=10)
+    client.post("/add_campaign", data={"name": "Deux"})
+    for _ in range(55):
+        client.post("/roll_dice/4")
+    client.post("/c/2/roll_dice/4")
+    for _ in range(12):
+        client.post("/ask_fate", data={"question": "q", "odds": "50/50"})
+    # Compactage à la 50e écriture : 20 lignes gardées, puis 5 de plus (et 1 pour la campagne 2)
+    assert count("dice_roll_history") == 26
+    assert count("dice_roll_history_archive") == 30
+    assert count("fate_question") == 7
+    stats = client.post("/roll_stats").get_json()
+    assert sum(stats["dice"].values()) == 55
+    assert sum(stats["fate"].values()) == 12
+    assert sum(client.post("/c/2/roll_stats").get_json()["dice"].values()) == 1
+
+
+def test_archived_rolls_can_still_be_audited(app, client):
+    app.config.update(DICE_HISTORY_KEEP=2, RETENTION_EVERY=10)
+    client.post("/add_campaign", data={"name": "Deux"})
+    for _ in range(10):
+        client.post("/roll_dice/20")
+    assert count("dice_roll_history_archive") == 8
+    audit = client.post("/audit_roll/1").get_json()
+    assert audit["valid"] and audit["id"] == 1
+    assert client.post("/c/2/audit_roll/1").status_code == 404
@@ -0,0 +1,31 @@
+import pytest
+
+import app as mythic
+
+
+def test_dice_batch_is_recorded_in_one_go(app, client):
+    data = client.post("/roll_batch", data={"spec": "4d6"}).get_json()
+    assert len(data["rolls"]) == 4 and all(1 <= roll <= 6 for roll in data["rolls"])
+    assert data["total"] == sum(data["rolls"])
+    history = client.post("/dice_history").get_json()
+    assert sorted(entry["roll"] for entry in history) == sorted(data["rolls"])
+
+
+def test_table_batch(client):
+    data = client.post("/roll_batch", data={"spec": "10x ACTIONS"}).get_json()
+    assert len(data["results"]) == 10
+    assert all(result["result"] == mythic.ACTIONS[result["roll"]] for result in data["results"])
+
+
+def test_custom_table_batch(client):
+    client.post("/add_custom_table", data={"customTableName": "T", "customTableValues": "a\n\nb"})
+    for spec in ("3x custom 1", "3x custom table 1"):
+        data = client.post("/roll_batch", data={"spec": spec}).get_json()
+        assert len(data["results"]) == 3
+        assert {result["result"] for result in data["results"]} <= {"a", "b"}
+    assert client.post("/roll_batch", data={"spec": "2x custom 99"}).status_code == 404
+
+
+@pytest.mark.parametrize("spec", ["5000d6", "blah", "2x NOPE", "0d6", ""])
+def test_invalid_specs(client, spec):
+    assert client.post("/roll_batch", data={"spec": spec}).status_code == 400
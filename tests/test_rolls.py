@@ -0,0 +1,67 @@
+import app as mythic
+
+
+def test_stream_is_reproducible_from_its_seed():
+    first, second = mythic.RollStream("graine"), mythic.RollStream("graine")
+    assert [first.roll(20)[0] for _ in range(600)] == [second.roll(20)[0] for _ in range(600)]
+
+
+def test_batched_rolls_match_single_rolls():
+    single, batched = mythic.RollStream("graine"), mythic.RollStream("graine")
+    expected = [single.roll(6)[0] for _ in range(30)]
+    values, seeds = batched.rolls(6, 30, with_seeds=True)
+    assert values == expected
+    # Un lancer plus grand qu'un bloc tire un bloc plus long : même début de suite
+    long, _ = mythic.RollStream("graine", block_size=8).rolls(6, 30)
+    assert long[:8] == expected[:8]
+    assert [mythic.replay_roll(6, seed) for seed in seeds] == values
+
+
+def test_replay_roll_matches_every_position():
+    stream = mythic.RollStream("graine", block_size=16)
+    for _ in range(40):
+        value, block_seed, position = stream.roll(100)
+        assert mythic.replay_roll(100, mythic.seed_ref(block_seed, position)) == value
+
+
+def test_campaigns_have_independent_streams():
+    engine = mythic.RollEngine("graine")
+    assert engine.stream(1) is engine.stream(1)
+    ones = [engine.stream(1).roll(1000)[0] for _ in range(20)]
+    twos = [engine.stream(2).roll(1000)[0] for _ in range(20)]
+    assert ones != twos
+    again = mythic.RollEngine("graine")
+    assert [again.stream(1).roll(1000)[0] for _ in range(20)] == ones
+
+
+def test_routes_are_reproducible_with_a_seed(client):
+    mythic.reset_roll_engine("abc")
+    first = [client.post("/roll_dice/20").get_json()["roll"] for _ in range(50)]
+    mythic.reset_roll_engine("abc")
+    assert [client.post("/roll_dice/20").get_json()["roll"] for _ in range(50)] == first
+
+
+def test_audit_roll(client):
+    client.post("/roll_batch", data={"spec": "5d20"})
+    history = client.post("/dice_history").get_json()
+    assert len(history) == 5
+    for entry in history:
+        audit = client.post(f"/audit_roll/{entry['id']}").get_json()
+        assert audit["valid"] and audit["replayed"] == entry["roll"]
+    assert client.post("/audit_roll/999").status_code == 404
+
+
+def test_block_seeds_never_reach_the_client(client):
+    # La graine d'un bloc donne tous les jets suivants : elle reste en base
+    bodies = [client.post("/roll_dice/100").get_data(as_text=True),
+              client.post("/roll_batch", data={"spec": "3d100"}).get_data(as_text=True),
+              client.post("/ask_fate", data={"question": "q", "odds": "50/50"}).get_data(as_text=True),
+              client.post("/dice_history").get_data(as_text=True),
+              client.post("/audit_roll/1").get_data(as_text=True)]
+    with mythic.app.app_context():
+        stored = {row.seed.split("/")[0] for row in mythic.DiceRollHistory.query.all()}
+        stored |= {row.seed.split("/")[0] for row in mythic.FateQuestion.query.all()}
+    assert stored and None not in stored
+    for body in bodies:
+        assert "seed" not in body
+        assert not any(block_seed in body for block_seed in stored)
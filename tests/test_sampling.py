@@ -0,0 +1,67 @@
+from collections import Counter
+from datetime import datetime, timedelta
+
+import pytest
+
+import app as mythic
+
+
+@pytest.fixture
+def npcs(client):
+    for i in range(30):
+        client.post("/add_npc", data={"name": f"n{i}", "description": ""})
+    for i in range(1, 31, 2):  # des trous dans les ids
+        client.post(f"/delete_npc/{i}")
+    client.post("/add_campaign", data={"name": "Deux"})
+    for i in range(10):
+        client.post("/c/2/add_npc", data={"name": f"b{i}", "description": ""})
+    return client
+
+
+def draw(n, **kwargs):
+    with mythic.app.test_request_context("/"):
+        return Counter(npc.id for _ in range(n) for npc in mythic.sample_rows(mythic.NPC, **kwargs))
+
+
+def test_sampling_is_uniform_over_the_campaign_rows(npcs):
+    counts = draw(1500)
+    assert set(counts) == set(range(2, 31, 2))
+    assert min(counts.values()) > 1500 / 15 * 0.6
+
+
+def test_sampled_rows_are_distinct(npcs):
+    samples = npcs.post("/random_pick/npc", data={"k": 15}).get_json()["samples"]
+    assert len({sample["id"] for sample in samples}) == 15
+    assert len(npcs.post("/random_pick/npc", data={"k": 40}).get_json()["samples"]) == 15
+    assert all(sample["name"].startswith("b")
+               for sample in npcs.post("/c/2/random_pick/npc", data={"k": 5}).get_json()["samples"])
+
+
+def test_recent_npcs_are_weighted(npcs):
+    with mythic.app.app_context():
+        mythic.db.session.execute(mythic.update(mythic.NPC).values(last_seen=datetime.utcnow() - timedelta(days=5)))
+        mythic.db.session.execute(mythic.update(mythic.NPC).where(mythic.NPC.id == 2).values(last_seen=datetime.utcnow()))
+        mythic.db.session.commit()
+    with mythic.app.test_request_context("/"):
+        counts = Counter(npc.id for _ in range(1500)
+                         for npc in mythic.sample_rows(mythic.NPC, weight=mythic.npc_recency_weight(), max_weight=3))
+    assert counts[2] / 1500 == pytest.approx(3 / 17, abs=0.03)
+
+
+def test_random_pick_kinds(client):
+    assert client.post("/random_pick/scene").get_json()["samples"] == []
+    client.post("/add_inventory", data={"title": "sac"})
+    client.post("/add_inventory", data={"title": "coffre"})
+    for i in range(5):
+        client.post("/add_inventory_item/1", data={"name": f"a{i}", "quantity": 1})
+        client.post("/add_inventory_item/2", data={"name": f"c{i}", "quantity": 1})
+    samples = client.post("/random_pick/item", data={"k": 3, "inventory_id": 2}).get_json()["samples"]
+    assert len(samples) == 3 and all(sample["inventory_id"] == 2 for sample in samples)
+    assert client.post("/random_pick/nope").status_code == 400
+
+
+def test_random_npc_marks_it_seen(client):
+    client.post("/add_npc", data={"name": "Alpha", "description": ""})
+    assert client.post("/random_npc").get_json()["name"] == "Alpha"
+    with mythic.app.app_context():
+        assert mythic.db.session.get(mythic.NPC, 1).last_seen is not None
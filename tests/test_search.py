@@ -0,0 +1,43 @@
+import app as mythic
+
+
+def search(client, terms):
+    return client.post("/search", query_string={"q": terms}).get_json()
+
+
+def test_search_across_sources(client):
+    client.post("/add_npc", data={"name": "Élodie la forgeronne", "description": "Vit près du <script>pont</script>"})
+    client.post("/add_scene", data={"title": "Le pont brisé", "description": "Une embuscade"})
+    client.post("/add_journal_entry", data={"content": "Rencontre avec elodie au pont"})
+    client.post("/ask_fate", data={"question": "Le pont tient-il ?", "odds": "50/50"})
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_inventory_item/1", data={"name": "Corde du pont", "quantity": 1})
+    assert {result["kind"] for result in search(client, "pont")} == {"npc", "scene", "journal", "fate", "item"}
+    # Sans accents et sans casse
+    assert {result["kind"] for result in search(client, "elodie")} == {"npc", "journal"}
+    assert "&lt;script&gt;" in search(client, "forgeronne")[0]["snippet"]
+
+
+def test_index_follows_updates_and_deletes(app, client):
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_inventory_item/1", data={"name": "Corde", "quantity": 1})
+    client.post("/delete_inventory/1")
+    assert search(client, "corde") == []
+    client.post("/add_npc", data={"name": "Zed", "description": ""})
+    with app.app_context():
+        mythic.db.session.execute(mythic.text("UPDATE npc SET name = 'Zorglub' WHERE id = 1"))
+        mythic.db.session.commit()
+    assert search(client, "zorg") and not search(client, "zed")
+
+
+def test_quantity_change_does_not_rewrite_the_index(app, client):
+    client.post("/add_inventory", data={"title": "Sac"})
+    client.post("/add_inventory_item/1", data={"name": "Corde", "quantity": 1})
+    client.post("/update_item_quantity/1/increase")
+    assert len(search(client, "corde")) == 1
+
+
+def test_search_syntax_is_neutralised(client):
+    client.post("/add_npc", data={"name": "Bob", "description": ""})
+    assert client.post("/search", query_string={"q": '" OR *'}).status_code == 200
+    assert search(client, "") == []
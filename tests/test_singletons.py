@@ -0,0 +1,52 @@
+import app as mythic
+
+
+def chaos(client, prefix=""):
+    return client.post(prefix + "/simulate_fate", data={"odds": "50/50"}).get_json()["chaos_factor"]
+
+
+def change_from_another_process(chaos_factor):
+    # Un autre processus écrit la ligne et incrémente sa version, sans toucher à ce cache
+    with mythic.app.app_context():
+        mythic.db.session.execute(mythic.text("UPDATE game_state SET chaos_factor = :cf WHERE campaign_id = 1"),
+                                  {"cf": chaos_factor})
+        mythic.bump_cache_version("game_state:1")
+        mythic.db.session.commit()
+
+
+def test_cached_reads_skip_the_database(app, client):
+    app.config["QUERY_BUDGET_CHECK"] = True
+    cold = int(client.post("/simulate_fate", data={"odds": "50/50"}).headers["X-Query-Count"])
+    warm = int(client.post("/simulate_fate", data={"odds": "50/50"}).headers["X-Query-Count"])
+    assert warm < cold
+
+
+def test_writes_update_the_cache(client):
+    assert chaos(client) == 5
+    assert client.post("/update_chaos", data={"adjustment": "3"}).get_json() == {"new_chaos": 8}
+    assert chaos(client) == 8
+
+
+def test_version_bump_from_another_process_is_picked_up(app, client):
+    app.config["SINGLETON_CACHE_CHECK"] = 60
+    assert chaos(client) == 5
+    change_from_another_process(2)
+    assert chaos(client) == 5  # vérifié il y a moins de SINGLETON_CACHE_CHECK secondes
+    app.config["SINGLETON_CACHE_CHECK"] = 0
+    assert chaos(client) == 2
+
+
+def test_unchanged_version_keeps_the_cached_value(app, client):
+    app.config["SINGLETON_CACHE_CHECK"] = 0
+    assert chaos(client) == 5
+    with mythic.app.app_context():
+        # Écriture sans nouvelle version : le cache ne la voit pas, il relit seulement la version
+        mythic.db.session.execute(mythic.text("UPDATE game_state SET chaos_factor = 3 WHERE campaign_id = 1"))
+        mythic.db.session.commit()
+    assert chaos(client) == 5
+
+
+def test_campaigns_are_cached_separately(client):
+    client.post("/add_campaign", data={"name": "Deux"})
+    assert client.post("/c/2/update_chaos", data={"adjustment": "-1"}).get_json() == {"new_chaos": 4}
+    assert chaos(client) == 5 and chaos(client, "/c/2") == 4
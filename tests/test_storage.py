@@ -0,0 +1,56 @@
+import sqlite3
+import threading
+
+import app as mythic
+
+
+def pragma(name):
+    with mythic.app.app_context():
+        return mythic.db.session.execute(mythic.text(f"PRAGMA {name}")).scalar()
+
+
+def test_wal_profile_is_applied(app):
+    assert pragma("journal_mode") == "wal"
+    assert pragma("busy_timeout") == app.config["SQLITE_BUSY_TIMEOUT"]
+
+
+def test_safe_profile(app, tmp_path):
+    app.config["SQLITE_PROFILE"] = "safe"
+    connection = sqlite3.connect(tmp_path / "safe.db")
+    try:
+        mythic._apply_sqlite_pragmas(connection, None)
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == "delete"
+        assert connection.execute("PRAGMA synchronous").fetchone()[0] == 2
+    finally:
+        connection.close()
+
+
+def test_group_commit_returns_ids(app, client):
+    app.config["GROUP_COMMIT"] = True
+    first = client.post("/ask_fate", data={"question": "q", "odds": "50/50"}).get_json()
+    second = client.post("/ask_fate", data={"question": "r", "odds": "50/50"}).get_json()
+    assert second["id"] == first["id"] + 1
+    assert f'fq-{first["id"]}' in first["html"]
+    assert len(client.post("/search", query_string={"q": "q"}).get_json()) == 1
+
+
+def test_concurrent_writes_with_group_commit(app, client):
+    app.config["GROUP_COMMIT"] = True
+    client.post("/add_campaign", data={"name": "Deux"})
+    errors = []
+
+    def write(prefix):
+        worker = app.test_client()
+        worker.environ_base.update(client.environ_base)
+        for _ in range(10):
+            if worker.post(prefix + "/roll_dice/6").status_code != 200:
+                errors.append(prefix)
+
+    threads = [threading.Thread(target=write, args=(prefix,)) for prefix in ["", "/c/2"] * 3]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(client.post("/dice_history", query_string={"limit": 100}).get_json()) == 30
+    assert len(client.post("/c/2/dice_history", query_string={"limit": 100}).get_json()) == 30
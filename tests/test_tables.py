@@ -0,0 +1,39 @@
+import app as mythic
+
+
+def test_compile_range_table():
+    faces, results = mythic.compile_table([(2, "a"), (5, "b"), (6, "c")])
+    assert faces == 6
+    assert results == ("a", "a", "b", "b", "b", "c")
+
+
+def test_compile_value_table_fills_gaps():
+    faces, results = mythic.compile_table({1: "un", 3: "trois"})
+    assert faces == 3
+    assert results == ("un", "Inconnu", "trois")
+
+
+def test_random_event_focus_boundaries():
+    faces, results = mythic.ROLL_TABLES["random_event_focus"]
+    assert faces == 100
+    previous = 0
+    for last, result in mythic.RANDOM_EVENT_FOCUS_TABLE:
+        assert results[previous] == result
+        assert results[last - 1] == result
+        previous = last
+
+
+def test_roll_on_table_uses_the_compiled_result(app, monkeypatch):
+    monkeypatch.setattr(mythic, "roll_die", lambda faces: 7)
+    assert mythic.roll_on_table("ACTIONS") == (7, mythic.ACTIONS[7])
+
+
+def test_every_table_can_be_rolled(client):
+    for name, (faces, results) in mythic.ROLL_TABLES.items():
+        data = client.post("/roll_table", query_string={"table": name}).get_json()
+        assert 1 <= data["roll"] <= faces, name
+        assert data["result"] == results[data["roll"] - 1], name
+
+
+def test_unknown_table(client):
+    assert client.post("/roll_table", query_string={"table": "NOPE"}).get_json() == {"error": "Table non définie"}
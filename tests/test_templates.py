@@ -0,0 +1,136 @@
+import pytest
+
+import app as mythic
+
+
+@pytest.fixture
+def add_table(client):
+    def add(name, values):
+        return client.post("/add_custom_table",
+                           data={"customTableName": name, "customTableValues": values}).get_json()["id"]
+    return add
+
+
+def expand(client, **data):
+    response = client.post("/expand_template", data=data)
+    return response.status_code, response.get_json()
+
+
+def test_references_are_expanded(client, add_table):
+    add_table("Peuples", "elfe\nnain")
+    pnj = add_table("PNJ", "Un [DESCRIPTEURS] [Peuples] qui veut [ACTIONS]")
+    gen = add_table("Gen", f"[PNJ] et [custom {pnj}] [Inconnue]")
+    for _ in range(10):
+        result = client.post(f"/roll_custom_table/{gen}").get_json()["result"]
+        assert result.count("[") == 1 and result.endswith("[Inconnue]")
+        assert "elfe" in result or "nain" in result
+    status, body = expand(client, template="Lieu : [Peuples]", count=3)
+    assert status == 200 and all(result in ("Lieu : elfe", "Lieu : nain") for result in body["results"])
+
+
+def test_unresolved_reference_repeated_across_levels(client, add_table):
+    add_table("B", "b [Inconnue]")
+    table_a = add_table("A", "a [Inconnue] [B]")
+    assert client.post(f"/roll_custom_table/{table_a}").get_json()["result"] == "a [Inconnue] b [Inconnue]"
+
+
+def test_circular_references_are_rejected(client, add_table):
+    table_a = add_table("A", "x [B]")
+    table_b = add_table("B", "y [A]")
+    response = client.post(f"/roll_custom_table/{table_a}")
+    assert response.status_code == 400 and "circulaire" in response.get_json()["error"]
+    assert expand(client, table_id=table_b)[0] == 400
+
+
+def test_depth_counts_every_path(app, client, add_table):
+    app.config["TEMPLATE_MAX_DEPTH"] = 4
+    add_table("D", "fin")
+    add_table("C", "[D]")
+    add_table("Y", "[C]")
+    deep = add_table("X", "[Y]")
+    shallow = add_table("R3", "[C]")
+    # C est atteinte directement (3 niveaux) et par X → Y (5 niveaux)
+    both = add_table("R", "[C] [X]")
+    assert expand(client, table_id=deep) == (200, {"results": ["fin"]})
+    assert expand(client, table_id=shallow)[0] == 200
+    status, body = expand(client, table_id=both)
+    assert status == 400 and "imbriquées" in body["error"]
+    status, body = expand(client, template="[C] [R3] [X]")
+    assert status == 400
+
+
+def test_edits_invalidate_the_graph(client, add_table):
+    peuples = add_table("Peuples", "elfe")
+    assert expand(client, template="[Peuples] [Inconnue]")[1]["results"] == ["elfe [Inconnue]"]
+    client.post(f"/edit_custom_table/{peuples}", data={"customTableNameEdit": "Peuples", "customTableValuesEdit": "orc"})
+    add_table("Inconnue", "trouvée")
+    assert expand(client, template="[Peuples] [Inconnue]")[1]["results"] == ["orc trouvée"]
+    client.post("/add_campaign", data={"name": "Deux"})
+    assert client.post("/c/2/expand_template", data={"template": "[Peuples]"}).get_json()["results"] == ["[Peuples]"]
+    assert expand(client, table_id=999)[0] == 404
+
+
+def test_graph_loads_one_query_per_level(app, client, add_table):
+    add_table("Peuples", "elfe")
+    pnj = add_table("PNJ", "[Peuples] [A1] [A2]")
+    add_table("A1", "a")
+    add_table("A2", "b")
+    gen = add_table("Gen", f"[PNJ] [custom {pnj}]")
+    app.config["QUERY_BUDGET_CHECK"] = True
+    with app.test_request_context("/"):
+        mythic.invalidate_template_graphs()
+        mythic.g.query_count = 0
+        mythic.get_template_graph(("custom", gen))
+        assert mythic.g.query_count == 3  # Gen, PNJ, puis Peuples + A1 + A2
+
+
+def test_batch_expands_references(client, add_table):
+    add_table("Peuples", "elfe")
+    table_id = add_table("PNJ", "Un [Peuples]\nUn nain")
+    results = client.post("/roll_batch", data={"spec": f"20x custom {table_id}"}).get_json()["results"]
+    assert {result["result"] for result in results} == {"Un elfe", "Un nain"}
+    table_a = add_table("A", "x [B]")
+    add_table("B", "y [A]")
+    assert client.post("/roll_batch", data={"spec": f"3x custom {table_a}"}).status_code == 400
+
+
+def test_fan_out_is_bounded(app, client, add_table):
+    add_table("C", " ".join(["[ACTIONS]"] * 20))
+    add_table("B", " ".join(["[C]"] * 20))
+    wide = add_table("A", " ".join(["[B]"] * 20))
+    status, body = expand(client, template="[A]", count=5)
+    assert status == 400 and "tirages" in body["error"]
+    # A : 1 + 20 × B, B : 1 + 20 × C, C : 1 + 20 → 8 421 tirages par développement
+    assert expand(client, table_id=wide)[0] == 200
+    assert expand(client, table_id=wide, count=2)[0] == 400
+    wider = add_table("Z", "[A] [A]")
+    response = client.post(f"/roll_custom_table/{wider}")
+    assert response.status_code == 400 and "trop nombreuses" in response.get_json()["error"]
+    # B seule : 1 + 20 × (1 + 20) = 421 tirages par développement
+    status, body = expand(client, template="[B]", count=20)
+    assert status == 200 and len(body["results"]) == 20
+    status, body = expand(client, template="[B]", count=30)
+    assert status == 400 and "30 × 422" in body["error"]
+
+
+def test_worst_case_rolls(client, add_table):
+    add_table("Peuples", "elfe\nnain [ACTIONS] [ACTIONS]")
+    add_table("PNJ", "Un [Peuples]\nDeux [Peuples] [Peuples] [Inconnue]")
+    with mythic.app.test_request_context("/"):
+        graph = mythic.get_template_graph(("template", "[PNJ]"), mythic.ParsedTable([(1, "[PNJ]")]))
+    # modèle (1) + PNJ (1) + 2 × Peuples (1 + 2 ACTIONS)
+    assert graph.rolls == 1 + 1 + 2 * 3
+
+
+def test_batch_respects_the_expansion_limit(app, client, add_table):
+    add_table("B", "[ACTIONS] [ACTIONS]")
+    table_id = add_table("A", "[B]")
+    app.config["TEMPLATE_MAX_EXPANSIONS"] = 40
+    assert client.post("/roll_batch", data={"spec": f"10x custom {table_id}"}).status_code == 200
+    assert client.post("/roll_batch", data={"spec": f"11x custom {table_id}"}).status_code == 400
+
+
+def test_free_template_length_is_capped(client):
+    status, body = expand(client, template="x" * (mythic.TEMPLATE_MAX_LENGTH + 1))
+    assert status == 400 and "trop long" in body["error"]
+    assert expand(client, template="x" * mythic.TEMPLATE_MAX_LENGTH)[0] == 200
@@ -0,0 +1,8 @@
+"""Point d'entrée WSGI pour un serveur de production.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+    waitress-serve --threads 16 --port 5345 wsgi:app
+"""
+from app import create_app
+
+app = create_app()